@@ -1,23 +1,18 @@
 from fastapi import APIRouter, Request
 from pathlib import Path
-import json
-
-try:
-    from sentence_transformers import SentenceTransformer
-except ImportError:  # pragma: no cover - optional dependency
-    SentenceTransformer = None
 
 from api.web_crawler import crawl_url
+from api.web_index import append_page
+from embeddings import get_model
 
 WEB_INDEX_PATH = Path(__file__).resolve().parent.parent / "knowledge" / "web_index.json"
 
-_router_model = None
-
 def _get_model():
-    global _router_model
-    if _router_model is None and SentenceTransformer is not None:
-        _router_model = SentenceTransformer("all-MiniLM-L6-v2")
-    return _router_model
+    """Shared embedding model, or ``None`` without sentence-transformers."""
+    try:
+        return get_model("all-MiniLM-L6-v2")
+    except RuntimeError:
+        return None
 
 router = APIRouter()
 
@@ -39,8 +34,6 @@ async def crawl_url_api(request: Request):
         return {"error": "Embedding model not available"}
 
     embedding = model.encode(text)
-    index = {"url": url, "text": text, "embedding": embedding.tolist()}
-    with WEB_INDEX_PATH.open("a", encoding="utf-8") as f:
-        f.write(json.dumps(index) + "\n")
+    append_page(WEB_INDEX_PATH, url, text, embedding)
 
     return {"status": "OK", "chars": len(text)}
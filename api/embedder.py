@@ -5,16 +5,17 @@ from __future__ import annotations
 from pathlib import Path
 from typing import List
 
+from api.search_knowledge import search_passages
+from embeddings import get_model
 from knowledge_store import KnowledgeStore
 
 MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
 
-_model = None
 _store: KnowledgeStore | None = None
 
 
 def _get_model():
-    """Return a cached instance of :class:`SentenceTransformer`.
+    """Return the shared :class:`SentenceTransformer` (see :func:`embeddings.get_model`).
 
     Raises
     ------
@@ -22,20 +23,19 @@ def _get_model():
         If the ``sentence-transformers`` package is not installed.
     """
 
-    global _model
-    if _model is None:
-        try:
-            from sentence_transformers import SentenceTransformer
-        except ImportError as exc:  # pragma: no cover - handled in tests
-            raise RuntimeError(
-                "sentence-transformers package is required for embeddings"
-            ) from exc
-        _model = SentenceTransformer(MODEL_NAME)
-    return _model
+    return get_model(MODEL_NAME)
+
+
+def set_store(store: KnowledgeStore) -> None:
+    """Use ``store`` (the application's store) instead of opening a second one."""
+
+    global _store
+    _store = store
 
 
 def _get_store() -> KnowledgeStore:
-    """Return a cached :class:`KnowledgeStore` instance."""
+    """Return the store registered by :func:`set_store`, or a cached
+    :class:`KnowledgeStore` over the repository root."""
 
     global _store
     if _store is None:
@@ -59,13 +59,42 @@ def embed_and_query(query: str, top_k: int = 3) -> List[str]:
     if not query:
         return []
 
-    # Ensure the embedding model is available.  We do not use the actual
-    # embedding further because :class:`KnowledgeStore` performs its own
-    # embedding internally, but calling ``encode`` validates that the model can
-    # be loaded and produces a vector.
-    model = _get_model()
-    model.encode([query])
+    # Ensure the embedding model is available.  The query itself is embedded
+    # only once, by :meth:`KnowledgeStore.search`, through the shared query
+    # embedding cache.
+    _get_model()
 
     store = _get_store()
     hits = store.search(query, top_k=top_k)
     return [h["snippet"] for h in hits]
+
+
+def hybrid_query(query: str, top_k: int = 3) -> List[str]:
+    """Snippets best matching ``query`` lexically and semantically.
+
+    :meth:`KnowledgeStore.hybrid_search` fuses the BM25 and vector rankings
+    of the store's chunks; the passages of the ``knowledge/`` folder
+    (:func:`api.search_knowledge.search_passages`) join them as a third
+    reciprocal-rank-fusion ranking, so the folder is searched even before
+    it has been indexed into the store.
+
+    Parameters
+    ----------
+    query:
+        Textual user query.
+    top_k:
+        Maximum number of snippets to return.
+    """
+
+    query = (query or "").strip()
+    if not query:
+        return []
+    fused = [(h["score"], h["snippet"]) for h in _get_store().hybrid_search(query, top_k=top_k)]
+    fused += [(1.0 / (KnowledgeStore.RRF_K + rank), p["text"])
+              for rank, p in enumerate(search_passages(query, top_k), 1)]
+    fused.sort(key=lambda p: -p[0])  # stable: store chunks win ties
+    snippets: List[str] = []
+    for _, snippet in fused:
+        if snippet not in snippets:
+            snippets.append(snippet)
+    return snippets[:top_k]
@@ -1,9 +1,9 @@
 # api/get_context.py
 from fastapi import APIRouter
 from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
 from api.get_memory import load_memory_context, append_to_memory
-from api.search_knowledge import search_knowledge
-from api.embedder import embed_and_query
+from api.embedder import hybrid_query
 from api.search_web import search_web
 
 router = APIRouter()
@@ -21,8 +21,8 @@ async def get_context(body: GetContextRequest):
     remember = body.remember
 
     memory_ctx = load_memory_context(user, query)
-    knowledge_ctx = search_knowledge(query)
-    embed_ctx = embed_and_query(query)
+    # store chunks (BM25 + vectors) and knowledge/ passages in one fused ranking
+    knowledge_ctx = await run_in_threadpool(hybrid_query, query)
     web_ctx = search_web(query)
 
     if remember and query.strip():
@@ -31,6 +31,5 @@ async def get_context(body: GetContextRequest):
     return {
         "memory": memory_ctx,
         "knowledge": knowledge_ctx,
-        "embedding": embed_ctx,
         "web": web_ctx,
     }
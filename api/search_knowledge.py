@@ -7,104 +7,378 @@ results.  For tests and simple experiments we implement a very small BM25 style
 retriever directly in Python so we do not rely on heavy external packages.
 
 The retriever loads all ``.txt`` files from the ``knowledge`` folder on first
-use, tokenises them and computes inverse document frequencies.  Queries are then
-scored against the documents using the BM25 formula and the best matching
-snippets are returned.  Each snippet is a line of text from the document that
-contains a query term (the whole document is used as a fallback).
+use, splits them into passages of at most ``PASSAGE_CHARS`` characters
+(whole lines packed together, over-long lines cut at a space) and builds a
+:class:`bm25.BM25Index` over the passages: postings lists (term -> passage
+ids and term frequencies) and passage lengths are computed once, so a query
+only scores the postings of its own terms (vectorised with NumPy), skipping
+most of the long lists of common words via MaxScore pruning (see
+:meth:`bm25.BM25Index.top_k`).  Every passage keeps the byte
+offsets of its text in the file, so the best passages are read back with a
+single ``seek`` each and returned directly, together with the spans of the
+query terms in them.  A snippet is never longer than ``PASSAGE_CHARS``.
+
+Changes are picked up incrementally: at most every ``SCAN_INTERVAL``
+seconds (``KNOWLEDGE_SCAN_INTERVAL``) a query stats the ``.txt`` files, and
+only files whose size or mtime changed are re-read and re-tokenised, new
+files are added and deleted ones removed.  BM25 statistics (IDF, average
+passage length) follow from the live index, so they stay exact without a
+full rebuild.  :func:`sync_knowledge` runs the same update on demand.
+
+After a change the index, the passage offsets and the file stamps are
+saved as a snapshot (``knowledge/.bm25/`` or ``KNOWLEDGE_BM25_SNAPSHOT``)
+by a background thread, ``SAVE_DELAY`` seconds (``KNOWLEDGE_BM25_SAVE_DELAY``)
+after the first unsaved change, so a burst of edits is written once and no
+query waits for the write.  A fresh process memory-maps that snapshot
+instead of tokenising the whole folder and then re-tokenises only files
+whose stamps differ; a save lost on exit only costs re-tokenising those
+files.
 """
 
 from __future__ import annotations
 
-import math
+import logging
+import os
 import re
-from collections import Counter
+import threading
+import time
 from pathlib import Path
-from typing import Dict, List
+from typing import Dict, List, Optional, Tuple
+
+from bm25 import TOKEN_RE, BM25Index, tokenize
 
 # Path to the knowledge directory relative to this file
 KNOWLEDGE_DIR = Path(__file__).resolve().parents[1] / "knowledge"
-
-_documents: List[str] = []
-_doc_tokens: List[List[str]] = []
-_idf: dict[str, float] = {}
-_avgdl: float = 0.0
-_file_mtimes: Dict[Path, float] = {}
+# Minimum number of seconds between two scans of KNOWLEDGE_DIR
+SCAN_INTERVAL = float(os.getenv("KNOWLEDGE_SCAN_INTERVAL", "2"))
+# Where the BM25 snapshot lives; defaults to KNOWLEDGE_DIR / ".bm25"
+SNAPSHOT_DIR: Optional[Path] = (Path(os.environ["KNOWLEDGE_BM25_SNAPSHOT"])
+                                if os.getenv("KNOWLEDGE_BM25_SNAPSHOT") else None)
+# Seconds between the first unsaved change and the snapshot save (0: save inline)
+SAVE_DELAY = float(os.getenv("KNOWLEDGE_BM25_SAVE_DELAY", "5"))
+# Longest passage (and therefore snippet) in characters
+PASSAGE_CHARS = int(os.getenv("KNOWLEDGE_PASSAGE_CHARS", "500"))
+
+LOGGER = logging.getLogger("fura.search_knowledge")
+
+_LINE_RE = re.compile(r"\S[^\n]*")
+
+_passages: Dict[int, Tuple[Path, int, int]] = {}  # passage id -> (file, byte start, byte end)
+_file_passages: Dict[Path, List[int]] = {}
+_index = BM25Index()
+_file_stamps: Dict[Path, Tuple[int, int]] = {}
+_next_id = 0
 _loaded = False
+_last_scan = 0.0
+_lock = threading.Lock()
+_save_timer: Optional[threading.Timer] = None
 
 
 def reload_knowledge() -> None:
     """Clear cached knowledge and mark it as unloaded."""
 
-    global _documents, _doc_tokens, _idf, _avgdl, _file_mtimes, _loaded
-    _documents = []
-    _doc_tokens = []
-    _idf = {}
-    _avgdl = 0.0
-    _file_mtimes = {}
-    _loaded = False
-
+    global _passages, _file_passages, _index, _file_stamps, _next_id, _loaded, _last_scan
+    global _save_timer
+    with _lock:
+        if _save_timer is not None:
+            _save_timer.cancel()
+            _save_timer = None
+        _passages = {}
+        _file_passages = {}
+        _index = BM25Index()
+        _file_stamps = {}
+        _next_id = 0
+        _loaded = False
+        _last_scan = 0.0
+
+
+def passage_spans(text: str, max_chars: Optional[int] = None) -> List[Tuple[int, int]]:
+    """Character spans ``(start, end)`` of the passages of ``text``.
+
+    Consecutive lines are packed into one passage while it stays within
+    ``max_chars``; a blank line ends a passage that is already half full.
+    Lines longer than ``max_chars`` (default ``PASSAGE_CHARS``) are cut at
+    the last space that fits.
+    """
 
-def _files_changed() -> bool:
-    """Return ``True`` if files in ``KNOWLEDGE_DIR`` changed since last load."""
+    max_chars = max_chars or PASSAGE_CHARS
+    spans: List[Tuple[int, int]] = []
+    start = end = None
+    for m in _LINE_RE.finditer(text):
+        s, e = m.start(), m.start() + len(m.group().rstrip())
+        if start is not None:
+            paragraph = end - start >= max_chars // 2 and text.count("\n", end, s) > 1
+            if e - start <= max_chars and not paragraph:
+                end = e
+                continue
+            spans.append((start, end))
+        while e - s > max_chars:
+            cut = text.rfind(" ", s + 1, s + max_chars + 1)
+            if cut <= s:
+                cut = s + max_chars
+            spans.append((s, cut))
+            s = cut
+            while s < e and text[s].isspace():
+                s += 1
+        start, end = s, e
+    if start is not None and end > start:
+        spans.append((start, end))
+    return spans
+
+
+def _byte_spans(text: str, spans: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """Translate character spans of ``text`` into UTF-8 byte spans."""
+
+    out, pos, offset = [], 0, 0
+    for s, e in spans:
+        offset += len(text[pos:s].encode("utf-8"))
+        start = offset
+        offset += len(text[s:e].encode("utf-8"))
+        pos = e
+        out.append((start, offset))
+    return out
+
+
+def _stamp(path: Path) -> Optional[Tuple[int, int]]:
+    try:
+        st = path.stat()
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def _scan() -> Dict[Path, Tuple[int, int]]:
+    """Current ``(mtime_ns, size)`` of every ``.txt`` file in ``KNOWLEDGE_DIR``."""
 
     if not KNOWLEDGE_DIR.exists():
-        return bool(_file_mtimes)
-
-    current: Dict[Path, float] = {}
+        return {}
+    current = {}
     for path in KNOWLEDGE_DIR.glob("**/*.txt"):
-        try:
-            current[path] = path.stat().st_mtime
-        except OSError:
-            return True
-    return current != _file_mtimes
-
+        if any(part.startswith(".") for part in path.relative_to(KNOWLEDGE_DIR).parts[:-1]):
+            continue  # e.g. the .bm25 snapshot
+        stamp = _stamp(path)
+        if stamp is not None:
+            current[path] = stamp
+    return current
+
+
+def _remove_file(path: Path) -> None:
+    for pid in _file_passages.pop(path, []):
+        _index.remove(pid)
+        _passages.pop(pid, None)
+    _file_stamps.pop(path, None)
+
+
+def _update_file(path: Path, stamp: Tuple[int, int]) -> bool:
+    """(Re-)index the passages of ``path``; an unreadable file is dropped."""
+
+    global _next_id
+    try:
+        # newline="" keeps "\r\n", so character offsets map onto file bytes
+        with open(path, "r", encoding="utf-8", newline="") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError):
+        _remove_file(path)
+        return False
+    spans = passage_spans(text)
+    pids = _file_passages.get(path, [])[:len(spans)]  # reuse ids of the old version
+    _remove_file(path)
+    while len(pids) < len(spans):
+        pids.append(_next_id)
+        _next_id += 1
+    for pid, (s, e), (start, end) in zip(pids, spans, _byte_spans(text, spans)):
+        _index.add(pid, text[s:e])
+        _passages[pid] = (path, start, end)
+    _file_passages[path] = pids
+    _file_stamps[path] = stamp
+    return True
+
+
+def _snapshot_dir() -> Path:
+    return SNAPSHOT_DIR or KNOWLEDGE_DIR / ".bm25"
+
+
+def _restore_snapshot() -> bool:
+    """Adopt the saved index, passages and file stamps, if a usable snapshot exists."""
+
+    global _index, _next_id
+    try:
+        index, extra = BM25Index.load(str(_snapshot_dir()))
+    except FileNotFoundError:
+        return False
+    except (OSError, ValueError, KeyError) as exc:
+        LOGGER.warning("Ignoring unreadable BM25 snapshot: %s", exc)
+        return False
+    if extra.get("passage_chars") != PASSAGE_CHARS:
+        return False  # written with other passage settings (or whole files)
+    _index = index
+    _next_id = extra.get("next_id", 0)
+    for rel, (mtime_ns, size, pids, offsets) in extra.get("files", {}).items():
+        path = KNOWLEDGE_DIR / rel
+        _file_passages[path] = pids
+        for pid, start, end in zip(pids, offsets[::2], offsets[1::2]):
+            _passages[pid] = (path, start, end)
+        _file_stamps[path] = (mtime_ns, size)
+    return True
+
+
+def _save_snapshot() -> None:
+    files = {}
+    for path, pids in _file_passages.items():
+        offsets = [x for pid in pids for x in _passages[pid][1:]]
+        files[path.relative_to(KNOWLEDGE_DIR).as_posix()] = [*_file_stamps[path], pids, offsets]
+    extra = {"next_id": _next_id, "passage_chars": PASSAGE_CHARS, "files": files}
+    try:
+        _index.save(str(_snapshot_dir()), extra=extra)
+    except OSError as exc:
+        LOGGER.warning("Could not save BM25 snapshot: %s", exc)
+
+
+def _schedule_save() -> None:
+    """Save the snapshot ``SAVE_DELAY`` seconds from now (caller holds ``_lock``)."""
+
+    global _save_timer
+    if SAVE_DELAY <= 0:
+        _save_snapshot()
+    elif _save_timer is None:
+        _save_timer = threading.Timer(SAVE_DELAY, flush_snapshot)
+        _save_timer.daemon = True
+        _save_timer.name = "bm25-snapshot"
+        _save_timer.start()
+
+
+def flush_snapshot() -> bool:
+    """Write a pending snapshot now; returns whether there was one."""
+
+    global _save_timer
+    with _lock:
+        timer, _save_timer = _save_timer, None
+        if timer is None:
+            return False
+        timer.cancel()  # no-op when called by the timer itself
+        _save_snapshot()
+    return True
+
+
+def sync_knowledge() -> Dict[str, int]:
+    """Bring the index in line with ``KNOWLEDGE_DIR``, touching only changed files.
+
+    Returns
+    -------
+    dict
+        Number of files ``added``, ``updated`` and ``removed``.
+    """
 
-def _load_knowledge() -> None:
-    """Load documents and pre-compute statistics for BM25."""
+    global _loaded, _last_scan
+    with _lock:
+        restored = _loaded or _restore_snapshot()
+        current = _scan()
+        stats = {"added": 0, "updated": 0, "removed": 0}
+        for path in [p for p in _file_stamps if p not in current]:
+            _remove_file(path)
+            stats["removed"] += 1
+        for path, stamp in current.items():
+            old = _file_stamps.get(path)
+            if old != stamp and _update_file(path, stamp):
+                stats["updated" if old else "added"] += 1
+        if any(stats.values()) or not restored:
+            _schedule_save()
+        _loaded = True
+        _last_scan = time.monotonic()
+    return stats
 
-    global _loaded, _documents, _doc_tokens, _idf, _avgdl, _file_mtimes
-    if _loaded and not _files_changed():
-        return
 
-    reload_knowledge()
+def _load_knowledge() -> None:
+    """Load documents on first use and sync changed files at most every
+    ``SCAN_INTERVAL`` seconds."""
 
-    if not KNOWLEDGE_DIR.exists():
-        _loaded = True
+    if _loaded and time.monotonic() - _last_scan < SCAN_INTERVAL:
         return
-
-    # Read all text files inside the knowledge directory
-    for path in KNOWLEDGE_DIR.glob("**/*.txt"):
-        try:
-            text = path.read_text(encoding="utf-8")
-        except OSError:
+    sync_knowledge()
+
+
+def _read_passage(path: Path, start: int, end: int) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            f.seek(start)
+            return f.read(end - start).decode("utf-8", errors="replace")
+    except OSError:
+        return None
+
+
+def _resync(paths: List[Path]) -> None:
+    """Re-index ``paths`` whose stamps no longer match the index."""
+
+    with _lock:
+        for path in paths:
+            stamp = _stamp(path)
+            if stamp is None:
+                _remove_file(path)
+            elif stamp != _file_stamps.get(path):
+                _update_file(path, stamp)
+        _schedule_save()
+
+
+def _passage_hits(query: str, top_k: int, q_terms: set) -> Tuple[List[Dict], List[Path]]:
+    """Hits read from unchanged files, and the files that changed since indexing."""
+
+    with _lock:  # a concurrent sync mutates the index and the passage table
+        ids, scores = _index.top_k(query, top_k)
+        found = [(score, *_passages[pid], _file_stamps.get(_passages[pid][0]))
+                 for pid, score in zip(ids.tolist(), scores.tolist()) if pid in _passages]
+    hits: List[Dict] = []
+    stale: List[Path] = []
+    for score, path, start, end, stamp in found:
+        if _stamp(path) != stamp:
+            stale.append(path)  # the stored offsets may point anywhere now
             continue
-        _documents.append(text)
-        _doc_tokens.append(re.findall(r"\w+", text.lower()))
-        try:
-            _file_mtimes[path] = path.stat().st_mtime
-        except OSError:
-            pass
-
-    if not _documents:
-        _loaded = True
-        return
-
-    lengths = [len(toks) for toks in _doc_tokens]
-    _avgdl = sum(lengths) / len(lengths)
+        text = _read_passage(path, start, end)
+        if text is None:
+            continue
+        hits.append({
+            "source": path.relative_to(KNOWLEDGE_DIR).as_posix(),
+            "start": start,
+            "end": end,
+            "score": score,
+            "text": text,
+            "highlights": [[m.start(), m.end()] for m in TOKEN_RE.finditer(text)
+                           if m.group().lower() in q_terms],
+        })
+    return hits, stale
+
+
+def search_passages(query: str, top_k: int = 3) -> List[Dict]:
+    """Return the best-matching passages for ``query``.
+
+    Each hit is a dict with the ``source`` file (relative to
+    ``KNOWLEDGE_DIR``), the ``start``/``end`` byte offsets of the passage in
+    it, its BM25 ``score``, its ``text`` (at most ``PASSAGE_CHARS``
+    characters) and ``highlights`` – ``[start, end]`` character spans of the
+    query terms within ``text``.
+
+    A file edited since the last scan is not read at its old offsets: it
+    is re-indexed and the query runs once more.
+    """
 
-    # document frequencies
-    df = Counter()
-    for tokens in _doc_tokens:
-        df.update(set(tokens))
-    N = len(_documents)
-    _idf = {term: math.log(1 + (N - freq + 0.5) / (freq + 0.5)) for term, freq in df.items()}
+    _load_knowledge()
+    q_terms = set(tokenize(query))
+    if not q_terms:
+        return []
 
-    _loaded = True
+    hits, stale = _passage_hits(query, top_k, q_terms)
+    if stale:
+        _resync(list(dict.fromkeys(stale)))
+        hits, _ = _passage_hits(query, top_k, q_terms)
+    return hits
 
 
 def search_knowledge(query: str, top_k: int = 3) -> List[str]:
     """Return snippets from the knowledge base matching ``query``.
 
+    Each snippet is the text of one of the best passages (see
+    :func:`search_passages`), so the response never exceeds
+    ``top_k * PASSAGE_CHARS`` characters.
+
     Parameters
     ----------
     query:
@@ -113,41 +387,6 @@ def search_knowledge(query: str, top_k: int = 3) -> List[str]:
         Maximum number of snippets to return.
     """
 
-    _load_knowledge()
-    if not query or not _documents:
-        return []
-
-    q_tokens = re.findall(r"\w+", query.lower())
-    if not q_tokens:
+    if not query:
         return []
-
-    k1, b = 1.5, 0.75
-    scores = []
-    for tokens, doc in zip(_doc_tokens, _documents):
-        dl = len(tokens) or 1
-        tf = Counter(tokens)
-        score = 0.0
-        for q in q_tokens:
-            if q not in tf:
-                continue
-            idf = _idf.get(q, 0.0)
-            freq = tf[q]
-            score += idf * (freq * (k1 + 1)) / (freq + k1 * (1 - b + b * dl / _avgdl))
-        scores.append(score)
-
-    # Sort documents by score and build snippets
-    results: List[str] = []
-    for idx in sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)[:top_k]:
-        if scores[idx] <= 0:
-            continue
-        doc = _documents[idx]
-        # Find a line containing any of the query terms
-        snippet = doc
-        for line in doc.splitlines():
-            if any(q in line.lower() for q in q_tokens):
-                snippet = line.strip()
-                break
-        results.append(snippet)
-
-    return results
-
+    return [hit["text"] for hit in search_passages(query, top_k)]
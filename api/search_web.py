@@ -1,99 +1,68 @@
 """Simple vector similarity search over crawled web pages.
 
 The crawler API stores fetched pages in ``knowledge/web_index.json`` as
-line-delimited JSON objects with the following structure::
-
-    {"url": "http://example.com", "text": "…", "embedding": [0.1, 0.2, …]}
-
-This module loads these entries on demand and allows querying them using
-cosine similarity.  Embeddings are expected to be compatible with the
-``all-MiniLM-L6-v2`` model used elsewhere in the project.  The dependency on
-``sentence-transformers`` is optional; when the package is not available the
-search simply returns an empty list.
+line-delimited JSON metadata with the following structure::
+
+    {"url": "http://example.com", "text": "…", "row": 0, "dim": 384}
+
+while the unit-length ``float32`` embeddings are packed into the
+``knowledge/web_index.f32`` sidecar (see :mod:`api.web_index`).  This
+module loads the index on demand and allows querying it using cosine
+similarity; older lines with an inline ``"embedding"`` list are still
+understood.  Because ``/crawl`` only appends, a reload parses just the
+lines added since the previous one (:class:`api.web_index.WebIndexReader`);
+the whole file is re-read only after it was truncated or rewritten.
+Embeddings are expected to be compatible with the ``all-MiniLM-L6-v2``
+model used elsewhere in the project.  The dependency on
+``sentence-transformers`` is optional; when the package is not available
+the search simply returns an empty list.
 """
 
 from __future__ import annotations
 
 from pathlib import Path
-import json
-from typing import List
+from typing import TYPE_CHECKING, List, Optional
 
 import numpy as np
 
-try:  # pragma: no cover - optional dependency
+from api.web_index import WebIndexReader
+from embeddings import encode_cached, get_model
+
+if TYPE_CHECKING:  # pragma: no cover - only for type hints
     from sentence_transformers import SentenceTransformer
-except ImportError:  # pragma: no cover - handled gracefully
-    SentenceTransformer = None
+
+MODEL_NAME = "all-MiniLM-L6-v2"
 
 # Path to the line-delimited JSON file produced by ``/crawl``
 WEB_INDEX_PATH = Path(__file__).resolve().parents[1] / "knowledge" / "web_index.json"
 
-_model: SentenceTransformer | None = None
-_entries: List[dict] = []
-_vectors: np.ndarray | None = None
-_mtime: float | None = None
+_reader: Optional[WebIndexReader] = None
 
 
 def _get_model() -> SentenceTransformer | None:
-    """Return a cached embedding model if available."""
+    """Return the shared embedding model, or ``None`` if it is unavailable."""
 
-    global _model
-    if _model is None and SentenceTransformer is not None:
-        _model = SentenceTransformer("all-MiniLM-L6-v2")
-    return _model
+    try:
+        return get_model(MODEL_NAME)
+    except RuntimeError:
+        return None
 
 
 def reload_web_index() -> None:
     """Clear the cached index forcing a reload on next search."""
 
-    global _entries, _vectors, _mtime
-    _entries = []
-    _vectors = None
-    _mtime = None
-
+    global _reader
+    _reader = None
 
-def _load_index() -> None:
-    """Load ``WEB_INDEX_PATH`` if it changed since the last read."""
 
-    global _entries, _vectors, _mtime
+def _load_index() -> WebIndexReader:
+    """Bring the cached index up to date with ``WEB_INDEX_PATH``."""
 
-    path = WEB_INDEX_PATH
-    try:
-        mtime = path.stat().st_mtime
-    except OSError:
-        mtime = None
-
-    if _mtime is not None and mtime == _mtime:
-        return  # Index unchanged
-
-    _entries = []
-    vectors: List[List[float]] = []
-
-    if mtime is not None:
-        try:
-            with path.open("r", encoding="utf-8") as f:
-                for line in f:
-                    line = line.strip()
-                    if not line:
-                        continue
-                    try:
-                        obj = json.loads(line)
-                    except json.JSONDecodeError:
-                        continue
-                    _entries.append(obj)
-                    vectors.append(obj.get("embedding", []))
-        except OSError:
-            pass
-
-    if vectors:
-        arr = np.array(vectors, dtype=float)
-        norms = np.linalg.norm(arr, axis=1, keepdims=True)
-        norms[norms == 0] = 1.0
-        _vectors = arr / norms
-    else:
-        _vectors = np.zeros((0, 0), dtype=float)
-
-    _mtime = mtime
+    global _reader
+    if _reader is None or _reader.path != WEB_INDEX_PATH:
+        _reader = WebIndexReader(WEB_INDEX_PATH)
+    _reader.refresh()
+    return _reader
 
 
 def search_web(query: str, top_k: int = 3) -> List[str]:
@@ -111,26 +80,29 @@ def search_web(query: str, top_k: int = 3) -> List[str]:
     if not query:
         return []
 
-    _load_index()
-    if not _entries or _vectors is None or _vectors.size == 0:
+    reader = _load_index()
+    entries, vectors = reader.entries, reader.vectors
+    if not len(vectors):
         return []
 
     model = _get_model()
     if model is None:
         return []
 
-    q_vec = np.asarray(model.encode([query])[0], dtype=float)
+    q_vec = encode_cached(
+        MODEL_NAME, [query], lambda texts: model.encode(texts, normalize_embeddings=True)
+    )[0].astype("float32")
     q_norm = np.linalg.norm(q_vec)
-    if q_norm == 0:
+    if q_norm == 0 or q_vec.shape[0] != vectors.shape[1]:
         return []
     q_vec /= q_norm
 
-    sims = _vectors.dot(q_vec)
+    sims = vectors @ q_vec  # stored vectors are unit length
     idx = np.argsort(-sims)[:top_k]
 
     results: List[str] = []
     for i in idx:
-        entry = _entries[i]
+        entry = entries[i]
         url = entry.get("url", "")
         text = entry.get("text", "")
         snippet = text[:200]
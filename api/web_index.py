@@ -0,0 +1,314 @@
+"""Storage format of the crawled web page index.
+
+``knowledge/web_index.json`` holds one JSON object per line with the page
+metadata and the position of its embedding in a sidecar file::
+
+    {"url": "http://example.com", "text": "…", "row": 0, "dim": 384}
+
+The vectors live in ``knowledge/web_index.f32`` next to it: L2-normalised
+``float32`` rows of ``dim`` values, packed back to back without a header,
+so a reader memory-maps them instead of parsing thousands of floats per
+page.  The vector is appended before its metadata line, so a reader
+never sees a record without its row; a crash in between only leaves an
+unreferenced row behind.  Appends hold an ``flock`` on the sidecar, so
+several worker processes can ``/crawl`` into the same index.
+
+:class:`WebIndexReader` follows the files as ``/crawl`` appends to them and
+only parses the new lines.
+
+Lines written before the sidecar existed carry the vector inline
+(``"embedding": [0.1, …]``).  They are still read, and
+:func:`migrate_web_index` (``scripts/migrate_web_index.py``) moves them into
+the sidecar once.
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are then serialised within one process only
+    fcntl = None
+
+LOGGER = logging.getLogger("fura.web_index")
+
+VECTORS_SUFFIX = ".f32"
+
+_append_lock = threading.Lock()
+
+
+def vectors_path(index_path: Path) -> Path:
+    """Sidecar holding the vectors of ``index_path``."""
+
+    return Path(index_path).with_suffix(VECTORS_SUFFIX)
+
+
+def _normalized(vec) -> np.ndarray:
+    arr = np.asarray(vec, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(arr)
+    return arr / norm if norm else arr
+
+
+def _append_vector(f, vec: np.ndarray) -> int:
+    """Append ``vec`` as the next row of the open sidecar ``f``; returns its row number."""
+
+    row_bytes = vec.nbytes
+    end = f.seek(0, os.SEEK_END)
+    row = -(-end // row_bytes)  # round up over a torn or foreign row
+    if row * row_bytes != end:
+        f.write(b"\0" * (row * row_bytes - end))
+    f.write(vec.tobytes())
+    f.flush()
+    return row
+
+
+def append_page(index_path: Path, url: str, text: str, embedding) -> Dict:
+    """Store one crawled page and return its metadata record.
+
+    The sidecar stays locked (threads and processes) from picking the row
+    until the metadata line is written, so two writers never share a row.
+    """
+
+    index_path = Path(index_path)
+    vec = _normalized(embedding)
+    with _append_lock, vectors_path(index_path).open("ab") as vf:
+        if fcntl is not None:
+            fcntl.flock(vf, fcntl.LOCK_EX)  # released when vf is closed
+        row = _append_vector(vf, vec)
+        record = {"url": url, "text": text, "row": row, "dim": int(vec.size)}
+        with index_path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+    return record
+
+
+def _parse_lines(lines: Iterable) -> List[Dict]:
+    records = []
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            records.append(json.loads(line))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            continue
+    return records
+
+
+def _read_records(index_path: Path) -> List[Dict]:
+    with index_path.open("r", encoding="utf-8") as f:
+        return _parse_lines(f)
+
+
+def _first_dim(records: List[Dict]) -> int:
+    dims = (r.get("dim") or len(r.get("embedding") or ()) for r in records)
+    return next((d for d in dims if d), 0)
+
+
+def _map_vectors(path: Path, dim: int) -> np.ndarray:
+    """The sidecar as a read-only ``(rows, dim)`` memory map."""
+
+    try:
+        rows = path.stat().st_size // (4 * dim)
+    except OSError:
+        rows = 0
+    if not rows:
+        return np.zeros((0, dim), dtype="float32")
+    return np.memmap(path, dtype="float32", mode="r", shape=(rows, dim))
+
+
+def load_web_index(index_path: Path) -> Tuple[List[Dict], np.ndarray]:
+    """Read the index: page records and their unit-length vectors.
+
+    Records whose vector is missing or has another dimension than the
+    first one are skipped.  When every record refers to the sidecar in
+    order, the returned matrix is the memory map itself.
+    """
+
+    index_path = Path(index_path)
+    try:
+        records = _read_records(index_path)
+    except OSError:
+        return [], np.zeros((0, 0), dtype="float32")
+    dim = _first_dim(records)
+    if not dim:
+        return [], np.zeros((0, 0), dtype="float32")
+    mapped = _map_vectors(vectors_path(index_path), dim)
+    entries, rows = _resolve(records, dim, mapped)
+    if all(isinstance(row, int) for row in rows) and rows == list(range(len(rows))):
+        return entries, mapped[:len(rows)]
+    return entries, _gather(rows, mapped, dim)
+
+
+def _resolve(records: List[Dict], dim: int, mapped: np.ndarray) -> Tuple[List[Dict], List]:
+    """Records with a usable vector, and for each its sidecar row or inline vector."""
+
+    entries: List[Dict] = []
+    rows: List = []
+    for r in records:
+        if "row" in r:
+            if r.get("dim") == dim and 0 <= r["row"] < len(mapped):
+                entries.append(r)
+                rows.append(r["row"])
+        elif len(r.get("embedding") or ()) == dim:
+            entries.append(r)
+            rows.append(_normalized(r["embedding"]))
+    if len(entries) < len(records):
+        LOGGER.warning("Skipped %d web index records without a usable vector",
+                       len(records) - len(entries))
+    return entries, rows
+
+
+def _gather(rows: List, mapped: np.ndarray, dim: int) -> np.ndarray:
+    vectors = np.empty((len(rows), dim), dtype="float32")
+    for i, row in enumerate(rows):
+        vectors[i] = mapped[row] if isinstance(row, int) else row
+    return vectors
+
+
+class WebIndexReader:
+    """Follows an append-only web index, parsing only what was appended.
+
+    The reader remembers how many bytes of the metadata file it has
+    consumed (always up to the end of a complete line).  :meth:`refresh`
+    parses just the lines appended since and copies their vectors into a
+    growable buffer; the whole file is re-read only when it was replaced
+    (another inode), truncated, or rewritten in place (the bytes just before
+    the remembered offset differ).
+    """
+
+    TAIL = 64  # bytes compared to detect an in-place rewrite
+
+    def __init__(self, index_path: Path):
+        self.path = Path(index_path)
+        self._lock = threading.Lock()
+        self.full_reloads = 0
+        self._clear()
+
+    def _clear(self) -> None:
+        self.entries: List[Dict] = []
+        self._buffer = np.zeros((0, 0), dtype="float32")
+        self._count = 0
+        self._dim = 0
+        self._offset = 0
+        self._tail = b""
+        self._ident: Optional[Tuple[int, int]] = None  # (device, inode) consumed from
+        self._stamp: Optional[Tuple[int, int]] = None  # (size, mtime) fully consumed
+
+    @property
+    def vectors(self) -> np.ndarray:
+        """Unit-length vectors of :attr:`entries`, row for row."""
+        return self._buffer[:self._count]
+
+    def refresh(self) -> int:
+        """Pick up changes of the file; returns the number of new entries."""
+
+        with self._lock:
+            try:
+                st = self.path.stat()
+            except OSError:
+                self._clear()
+                return 0
+            ident, stamp = (st.st_dev, st.st_ino), (st.st_size, st.st_mtime_ns)
+            if ident == self._ident and stamp == self._stamp:
+                return 0
+            with self.path.open("rb") as f:
+                if not self._continues(f, ident, st.st_size):
+                    LOGGER.info("%s was rewritten, reloading it", self.path)
+                    self._clear()
+                    self.full_reloads += 1
+                self._ident = ident
+                f.seek(self._offset)
+                data = f.read(st.st_size - self._offset)
+            end = data.rfind(b"\n") + 1
+            if end < len(data) and _parse_lines([data[end:]]):
+                end = len(data)  # a final line without newline, but complete
+            chunk = data[:end]
+            self._offset += len(chunk)
+            self._tail = (self._tail + chunk)[-self.TAIL:]
+            self._stamp = stamp if end == len(data) else None  # re-check a torn tail
+            return self._append(_parse_lines(chunk.splitlines()))
+
+    def _continues(self, f, ident: Tuple[int, int], size: int) -> bool:
+        """Whether the open file ``f`` still starts with what was consumed."""
+
+        if self._ident is None:
+            return True  # nothing consumed yet
+        if ident != self._ident:
+            return False  # replaced, e.g. by migrate_web_index
+        if size < self._offset:
+            return False  # truncated
+        f.seek(self._offset - len(self._tail))
+        return f.read(len(self._tail)) == self._tail
+
+    def _append(self, records: List[Dict]) -> int:
+        if not records:
+            return 0
+        if not self._dim:
+            self._dim = _first_dim(records)
+            if not self._dim:
+                return 0
+            self._buffer = np.zeros((0, self._dim), dtype="float32")
+        mapped = (_map_vectors(vectors_path(self.path), self._dim)
+                  if any("row" in r for r in records) else np.zeros((0, self._dim), "float32"))
+        entries, rows = _resolve(records, self._dim, mapped)
+        needed = self._count + len(rows)
+        if needed > len(self._buffer):
+            grown = np.zeros((max(needed, 2 * len(self._buffer)), self._dim), dtype="float32")
+            grown[:self._count] = self._buffer[:self._count]
+            self._buffer = grown
+        self._buffer[self._count:needed] = _gather(rows, mapped, self._dim)
+        self.entries.extend(entries)  # before the count, so vectors never outgrow entries
+        self._count = needed
+        return len(entries)
+
+
+def migrate_web_index(index_path: Path) -> Dict[str, int]:
+    """Move inline embeddings of ``index_path`` into the sidecar.
+
+    Both files are rewritten (through temporary files and ``os.replace``)
+    so that rows follow the record order; records without a usable vector
+    are dropped.  Running it again on a migrated index only re-packs it.
+    Stop the server (or anything calling ``/crawl``) while it runs.
+
+    Returns
+    -------
+    dict
+        Number of records ``migrated`` from inline JSON, ``kept`` from the
+        sidecar and ``dropped``.
+    """
+
+    index_path = Path(index_path)
+    if not index_path.exists():
+        return {"migrated": 0, "kept": 0, "dropped": 0}
+    sidecar = vectors_path(index_path)
+    entries, vectors = load_web_index(index_path)
+    total = len(_read_records(index_path))
+    stats = {"migrated": sum("row" not in e for e in entries),
+             "kept": sum("row" in e for e in entries),
+             "dropped": total - len(entries)}
+
+    tmp_vectors = sidecar.with_name(sidecar.name + ".tmp")
+    tmp_index = index_path.with_name(index_path.name + ".tmp")
+    np.ascontiguousarray(vectors, dtype="float32").tofile(tmp_vectors)
+    dim = vectors.shape[1] if vectors.ndim == 2 else 0
+    with tmp_index.open("w", encoding="utf-8") as f:
+        for row, entry in enumerate(entries):
+            record = {k: v for k, v in entry.items() if k != "embedding"}
+            record.update(row=row, dim=dim)
+            f.write(json.dumps(record) + "\n")
+    del vectors  # release the memory map before replacing its file
+    os.replace(tmp_vectors, sidecar)
+    os.replace(tmp_index, index_path)
+    return stats
+
+
+__all__ = ["WebIndexReader", "append_page", "load_web_index", "migrate_web_index",
+           "vectors_path"]
@@ -0,0 +1,433 @@
+"""Incremental BM25 index over short texts.
+
+:class:`BM25Index` keeps an inverted index ``term -> {doc id: term
+frequency}`` plus the length of every document, so a query only touches
+the postings of its own terms.  Documents can be added and removed one at a
+time; IDF and the average document length are derived from the live
+statistics at query time and therefore always match the current corpus.
+
+Scoring is vectorised: each posting list is materialised once as a pair of
+NumPy arrays (doc ids, term frequencies) and cached until a document
+containing that term changes, document lengths live in an array indexed by
+doc id, and the top-k is selected with a partial sort (``np.partition``).
+
+:meth:`BM25Index.top_k` prunes dynamically (MaxScore): every term has an
+upper bound on its contribution, derived from its largest term frequency
+and the shortest document containing it.  Terms are scored best bound
+first; once the bounds of the remaining terms cannot lift an unseen
+document past the current k-th best score, the remaining (usually long,
+common-word) posting lists are only probed for the surviving candidates by
+binary search instead of being scored in full.  The result is identical to
+exhaustive scoring (``exhaustive=True``).
+
+:meth:`BM25Index.save` writes a compact snapshot – the vocabulary, all
+postings as CSR arrays sorted by doc id, the per-term bounds, a doc ->
+terms forward index (needed to remove a document) and the document
+lengths – and :meth:`BM25Index.load` opens it memory-mapped.  A loaded
+index scores straight from the mapped postings; only the posting lists of
+terms whose documents change afterwards are copied into ordinary dicts.
+Saving and loading hold an ``flock`` on the snapshot directory, so several
+worker processes can share one snapshot.
+
+Used by :mod:`api.search_knowledge` (passages) and by
+:meth:`KnowledgeStore.hybrid_search` (chunks).  Tokenisation is
+deliberately simple (lower-cased ``\\w+`` runs), so Czech diacritics stay
+part of a word.
+"""
+
+from __future__ import annotations
+
+import contextlib
+import glob
+import json
+import math
+import os
+import re
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: a snapshot directory is then single-process only
+    fcntl = None
+
+TOKEN_RE = re.compile(r"\w+")
+SNAPSHOT_VERSION = 2
+_ARRAYS = ("offsets", "ids", "tfs", "max_tf", "min_dl", "doc_offsets", "doc_terms",
+           "lengths", "present")
+_LOCK_FILE = "lock"
+# relative tolerance of the MaxScore bounds against float32 rounding
+_SLACK = 1e-5
+
+
+@contextlib.contextmanager
+def _snapshot_lock(path: str, exclusive: bool):
+    """Hold an ``flock`` on the snapshot directory ``path``.
+
+    Writers take it exclusively for the whole save (generation number,
+    files, ``meta.json``, clean-up); readers share it while they open the
+    files of the current generation.
+    """
+    if fcntl is None:
+        yield
+        return
+    try:
+        f = open(os.path.join(path, _LOCK_FILE), "a")
+    except PermissionError:
+        if exclusive:
+            raise
+        yield  # read-only snapshot, nobody can be writing it
+        return
+    with f:
+        fcntl.flock(f, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+
+def tokenize(text: str) -> List[str]:
+    """Lower-cased word tokens of ``text``."""
+
+    return TOKEN_RE.findall((text or "").lower())
+
+
+class BM25Index:
+    """Okapi BM25 over integer document ids.
+
+    Parameters
+    ----------
+    k1, b:
+        The usual BM25 term-frequency saturation and length normalisation.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self._postings: Dict[str, Dict[int, int]] = {}  # terms changed since load (all, if not loaded)
+        self._terms: Dict[int, Tuple[str, ...]] = {}  # doc id -> distinct terms, for removal
+        self._arrays: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # term -> (ids, tf) cache
+        self._bounds: Dict[str, Tuple[float, float]] = {}  # term -> (max tf, min length) cache
+        self._dl = np.zeros(0, dtype="float32")  # document length by doc id
+        self._present = np.zeros(0, dtype=bool)
+        self._count = 0
+        self._total = 0
+        # memory-mapped snapshot, see load()
+        self._vocab: Dict[str, int] = {}
+        self._vocab_list: List[str] = []
+        self._base: Optional[Dict[str, np.ndarray]] = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __contains__(self, doc_id: int) -> bool:
+        return 0 <= doc_id < len(self._present) and bool(self._present[doc_id])
+
+    def doc_ids(self) -> np.ndarray:
+        """Ids of all indexed documents, ascending."""
+        return np.flatnonzero(self._present)
+
+    # ---------- postings ----------
+    def _base_slice(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        t = self._vocab.get(term)
+        if t is None:
+            return None
+        start, end = self._base["offsets"][t], self._base["offsets"][t + 1]
+        return self._base["ids"][start:end], self._base["tfs"][start:end]
+
+    def _posting(self, term: str) -> Dict[int, int]:
+        """Mutable posting dict of ``term``, copied out of the snapshot on first change."""
+        posting = self._postings.get(term)
+        if posting is None:
+            base = self._base_slice(term) if self._base is not None else None
+            posting = {} if base is None else dict(zip(base[0].tolist(), base[1].astype(int).tolist()))
+            self._postings[term] = posting
+        return posting
+
+    def _posting_arrays(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        arrays = self._arrays.get(term)
+        if arrays is None:
+            posting = self._postings.get(term)
+            if posting is None:
+                return self._base_slice(term) if self._base is not None else None
+            if not posting:
+                return None
+            ids = np.fromiter(posting.keys(), dtype="int64", count=len(posting))
+            tfs = np.fromiter(posting.values(), dtype="float32", count=len(posting))
+            order = np.argsort(ids, kind="stable")
+            arrays = self._arrays[term] = ids[order], tfs[order]
+        return arrays
+
+    def _bound(self, term: str, arrays: Tuple[np.ndarray, np.ndarray]) -> Tuple[float, float]:
+        """``(largest tf, shortest document)`` over the posting list of ``term``."""
+        bound = self._bounds.get(term)
+        if bound is None:
+            t = self._vocab.get(term) if term not in self._postings else None
+            if t is not None:
+                bound = float(self._base["max_tf"][t]), float(self._base["min_dl"][t])
+            else:
+                docs, tf = arrays
+                bound = float(tf.max()), float(self._dl[docs].min())
+            self._bounds[term] = bound
+        return bound
+
+    def _invalidate(self, term: str) -> None:
+        self._arrays.pop(term, None)
+        self._bounds.pop(term, None)
+
+    def _doc_terms(self, doc_id: int) -> Tuple[str, ...]:
+        terms = self._terms.pop(doc_id, None)
+        if terms is None and self._base is not None and doc_id + 1 < len(self._base["doc_offsets"]):
+            start, end = self._base["doc_offsets"][doc_id], self._base["doc_offsets"][doc_id + 1]
+            terms = tuple(self._vocab_list[t] for t in self._base["doc_terms"][start:end].tolist())
+        return terms or ()
+
+    def _ensure_capacity(self, doc_id: int) -> None:
+        if doc_id >= len(self._dl):
+            size = max(doc_id + 1, 2 * len(self._dl))
+            self._dl = np.concatenate([self._dl, np.zeros(size - len(self._dl), dtype="float32")])
+            self._present = np.concatenate([self._present,
+                                            np.zeros(size - len(self._present), dtype=bool)])
+
+    # ---------- updates ----------
+    def add(self, doc_id: int, text: str) -> None:
+        """Index ``text`` under ``doc_id`` (replacing an earlier version)."""
+        if doc_id in self:
+            self.remove(doc_id)
+        tokens = tokenize(text)
+        tf = Counter(tokens)
+        for term, freq in tf.items():
+            self._posting(term)[doc_id] = freq
+            self._invalidate(term)
+        self._terms[doc_id] = tuple(tf)
+        self._ensure_capacity(doc_id)
+        self._dl[doc_id] = len(tokens)
+        self._present[doc_id] = True
+        self._count += 1
+        self._total += len(tokens)
+
+    def add_many(self, items: Iterable[Tuple[int, str]]) -> None:
+        for doc_id, text in items:
+            self.add(doc_id, text)
+
+    def remove(self, doc_id: int) -> bool:
+        """Drop ``doc_id``; returns ``False`` if it was not indexed."""
+        if doc_id not in self:
+            return False
+        for term in self._doc_terms(doc_id):
+            self._invalidate(term)
+            self._posting(term).pop(doc_id, None)
+        self._present[doc_id] = False
+        self._count -= 1
+        self._total -= int(self._dl[doc_id])
+        self._dl[doc_id] = 0
+        return True
+
+    # ---------- scoring ----------
+    def idf(self, term: str) -> float:
+        arrays = self._posting_arrays(term)
+        n = len(arrays[0]) if arrays is not None else 0
+        N = self._count
+        return math.log(1 + (N - n + 0.5) / (n + 0.5))
+
+    def scores(self, query: str) -> Tuple[np.ndarray, np.ndarray]:
+        """``(ids, scores)`` of every document matching a term of ``query``.
+
+        A term repeated in the query counts once per occurrence."""
+        empty = np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        if not self._count:
+            return empty
+        avgdl = self._total / self._count or 1.0
+        ids, parts = [], []
+        for term, qf in Counter(tokenize(query)).items():
+            arrays = self._posting_arrays(term)
+            if arrays is None or not len(arrays[0]):
+                continue
+            docs, tf = arrays
+            ids.append(np.asarray(docs, dtype="int64"))
+            parts.append(self._contributions(docs, tf, qf * self.idf(term), avgdl))
+        if not ids:
+            return empty
+        if len(ids) == 1:
+            return ids[0], parts[0].astype("float32")
+        docs, inverse = np.unique(np.concatenate(ids), return_inverse=True)
+        return docs, np.bincount(inverse, weights=np.concatenate(parts)).astype("float32")
+
+    def _contributions(self, docs: np.ndarray, tf: np.ndarray, weight: float,
+                       avgdl: float) -> np.ndarray:
+        k1, b = self.k1, self.b
+        norm = k1 * (1 - b + b * self._dl[docs] / avgdl)
+        return weight * tf * (k1 + 1) / (tf + norm)
+
+    def top_k(self, query: str, k: int, exhaustive: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+        """Best ``k`` ``(ids, scores)``, highest score first (ties by id).
+
+        Uses MaxScore pruning unless ``exhaustive``; both give the same result."""
+        if exhaustive:
+            ids, vals = self.scores(query)
+            return select_top_k(ids, vals, k)
+        empty = np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        if k <= 0 or not self._count:
+            return empty
+        avgdl = self._total / self._count or 1.0
+        k1, b = self.k1, self.b
+        terms = []  # (docs, tf, weight, upper bound) in query order
+        for term, qf in Counter(tokenize(query)).items():
+            arrays = self._posting_arrays(term)
+            if arrays is None or not len(arrays[0]):
+                continue
+            max_tf, min_dl = self._bound(term, arrays)
+            weight = qf * self.idf(term)
+            bound = weight * max_tf * (k1 + 1) / (max_tf + k1 * (1 - b + b * min_dl / avgdl))
+            terms.append((arrays[0], arrays[1], weight, bound))
+        if not terms:
+            return empty
+
+        cand = np.zeros(0, dtype="int64")
+        partial = np.zeros(0)  # lower bounds of the candidates' scores
+        remaining = sum(t[3] for t in terms)  # bound of the terms not scored yet
+        theta = 0.0  # lower bound of the k-th best score
+        for docs, tf, weight, bound in sorted(terms, key=lambda t: (-t[3], len(t[0]))):
+            if remaining >= theta * (1 - _SLACK):
+                # an unseen document can still reach the top k: score the whole list
+                contrib = self._contributions(docs, tf, weight, avgdl)
+                cand, inverse = np.unique(np.concatenate([cand, np.asarray(docs, dtype="int64")]),
+                                          return_inverse=True)
+                partial = np.bincount(inverse, weights=np.concatenate([partial, contrib]))
+            else:
+                found, pos = _lookup(docs, cand)
+                partial[found] += self._contributions(docs[pos], tf[pos], weight, avgdl)
+            remaining -= bound
+            if len(cand) >= k:
+                theta = -np.partition(-partial, k - 1)[k - 1]
+                keep = partial + remaining >= theta * (1 - _SLACK)
+                cand, partial = cand[keep], partial[keep]
+
+        # exact scores of the survivors, summed in query order like scores()
+        total = np.zeros(len(cand))
+        for docs, tf, weight, _ in terms:
+            found, pos = _lookup(docs, cand)
+            total[found] += self._contributions(docs[pos], tf[pos], weight, avgdl)
+        return select_top_k(cand, total.astype("float32"), k)
+
+    def search(self, query: str, top_k: int = 10) -> List[Tuple[int, float]]:
+        """Best ``top_k`` ``(doc id, score)`` pairs, highest score first."""
+        ids, vals = self.top_k(query, top_k)
+        return list(zip(ids.tolist(), vals.tolist()))
+
+    # ---------- snapshot ----------
+    def _live_terms(self) -> List[str]:
+        terms = [t for t in self._vocab_list if t not in self._postings]
+        terms += [t for t, posting in self._postings.items() if posting]
+        return sorted(terms)
+
+    def save(self, path: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """Write a snapshot to the directory ``path``.
+
+        Arrays go to generation-numbered ``.npy`` files and ``meta.json`` is
+        replaced last, so readers never see a half-written snapshot.  The
+        writing holds an exclusive lock on the directory, so concurrent
+        savers (e.g. several workers) take turns instead of picking the same
+        generation.  ``extra`` (JSON-serialisable) is stored alongside and returned by
+        :meth:`load`.
+        """
+        terms = self._live_terms()
+        lists = [self._posting_arrays(t) for t in terms]
+        counts = np.array([len(ids) for ids, _ in lists], dtype="int64")
+        bounds = np.array([self._bound(t, arrays) for t, arrays in zip(terms, lists)],
+                          dtype="float32").reshape(-1, 2)
+        ids = (np.concatenate([np.asarray(i, dtype="int64") for i, _ in lists])
+               if lists else np.zeros(0, dtype="int64"))
+        tfs = (np.concatenate([np.asarray(t, dtype="float32") for _, t in lists])
+               if lists else np.zeros(0, dtype="float32"))
+        term_of = np.repeat(np.arange(len(terms), dtype="int32"), counts)
+        ndocs = len(self._dl)
+        doc_offsets = np.zeros(ndocs + 1, dtype="int64")
+        np.cumsum(np.bincount(ids, minlength=ndocs), out=doc_offsets[1:])
+        arrays = {
+            "offsets": np.concatenate([[0], np.cumsum(counts)]).astype("int64"),
+            "ids": ids.astype("int32") if ndocs < 2 ** 31 else ids,
+            "tfs": tfs,
+            "max_tf": bounds[:, 0],
+            "min_dl": bounds[:, 1],
+            "doc_offsets": doc_offsets,
+            "doc_terms": term_of[np.argsort(ids, kind="stable")],
+            "lengths": self._dl,
+            "present": self._present,
+        }
+        meta = {"version": SNAPSHOT_VERSION, "k1": self.k1, "b": self.b,
+                "count": self._count, "total": self._total, "extra": extra or {}}
+        os.makedirs(path, exist_ok=True)
+        meta_path = os.path.join(path, "meta.json")
+        with _snapshot_lock(path, exclusive=True):
+            gen = 1
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    gen = json.load(f).get("generation", 0) + 1
+            for name, arr in arrays.items():
+                np.save(os.path.join(path, f"{name}-{gen}.npy"), arr)
+            with open(os.path.join(path, f"vocab-{gen}.lst"), "w", encoding="utf-8") as f:
+                f.write("\n".join(terms))
+            meta["generation"] = gen
+            tmp = meta_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, meta_path)
+            for old in glob.glob(os.path.join(path, "*-*.*")):
+                if not os.path.basename(old).rsplit(".", 1)[0].endswith(f"-{gen}"):
+                    os.remove(old)
+
+    @classmethod
+    def load(cls, path: str, mmap: bool = True) -> Tuple["BM25Index", Dict[str, Any]]:
+        """Open the snapshot in ``path``; returns the index and its ``extra``.
+
+        Raises
+        ------
+        FileNotFoundError
+            If there is no snapshot.
+        ValueError
+            If it was written by an incompatible version.
+        """
+        with _snapshot_lock(path, exclusive=False):
+            with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("version") != SNAPSHOT_VERSION:
+                raise ValueError(f"unsupported BM25 snapshot version {meta.get('version')}")
+            gen = meta["generation"]
+            base = {name: np.load(os.path.join(path, f"{name}-{gen}.npy"),
+                                  mmap_mode="r" if mmap else None)
+                    for name in _ARRAYS}
+            with open(os.path.join(path, f"vocab-{gen}.lst"), "r", encoding="utf-8") as f:
+                text = f.read()
+        index = cls(k1=meta["k1"], b=meta["b"])
+        index._vocab_list = text.split("\n") if text else []
+        index._vocab = {term: i for i, term in enumerate(index._vocab_list)}
+        index._base = base
+        index._dl = np.array(base["lengths"], dtype="float32")  # small, updated in place
+        index._present = np.array(base["present"], dtype=bool)
+        index._count = meta["count"]
+        index._total = meta["total"]
+        return index, meta.get("extra", {})
+
+
+def _lookup(docs: np.ndarray, cand: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Which of ``cand`` occur in the sorted posting ``docs``, and where."""
+    if not len(cand):
+        return np.zeros(0, dtype=bool), np.zeros(0, dtype="int64")
+    pos = np.minimum(np.searchsorted(docs, cand.astype(docs.dtype)), len(docs) - 1)
+    found = docs[pos] == cand
+    return found, pos[found]
+
+
+def select_top_k(ids: np.ndarray, scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """The ``k`` highest ``scores`` with their ``ids``, sorted (ties by id)."""
+    if k <= 0:
+        return ids[:0], scores[:0]
+    if len(ids) > k:
+        kth = -np.partition(-scores, k - 1)[k - 1]
+        keep = np.flatnonzero(scores >= kth)  # all ties of the k-th score, lowest ids win
+        ids, scores = ids[keep], scores[keep]
+    order = np.lexsort((ids, -scores))[:k]
+    return ids[order], scores[order]
+
+
+__all__ = ["BM25Index", "select_top_k", "tokenize"]
@@ -0,0 +1,207 @@
+"""Streaming, token-budgeted text chunker.
+
+:func:`iter_chunks` splits a document into overlapping chunks whose size is
+measured in the embedding model's own tokens, so the transformer never
+silently truncates a chunk.  The text may be a string or any iterable of
+string pieces (file blocks, PDF pages …); whitespace is collapsed and
+sentence boundaries are found in one linear pass while the pieces stream
+through.  Only the pending sentence and the current chunk are held in
+memory, so peak memory does not depend on the document size.
+
+Tokens are counted with the model's Hugging Face tokenizer when
+``transformers`` is installed (see :func:`get_tokenizer`); otherwise an
+:class:`ApproxTokenizer` that over- rather than under-estimates is used.
+"""
+
+from __future__ import annotations
+
+import logging
+import re
+from collections import deque
+from functools import lru_cache
+from typing import Iterable, Iterator, List, Tuple, Union
+
+from embeddings import canonical_model_name
+
+LOGGER = logging.getLogger("fura.chunking")
+
+# all-MiniLM-L6-v2 truncates at 256 word pieces including [CLS] and [SEP]
+DEFAULT_MAX_TOKENS = 254
+DEFAULT_OVERLAP = 32
+READ_SIZE = 1 << 16
+
+_SENTENCE_END = re.compile(r"[.!?]+ ")
+
+Span = Tuple[int, int]
+
+
+class ApproxTokenizer:
+    """Dependency-free stand-in for a WordPiece tokenizer.
+
+    Every punctuation mark is a token and words are cut into pieces of at
+    most ``piece_chars`` characters, which over-counts English and is close
+    for Czech, where the English vocabulary splits most words.
+    """
+
+    def __init__(self, piece_chars: int = 6):
+        self._token = re.compile(r"\w{1,%d}|[^\w\s]" % piece_chars)
+
+    def count(self, text: str) -> int:
+        return len(self._token.findall(text))
+
+    def spans(self, text: str) -> List[Span]:
+        return [m.span() for m in self._token.finditer(text)]
+
+
+class HFTokenizer:
+    """Token spans from a Hugging Face *fast* tokenizer."""
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+
+    def count(self, text: str) -> int:
+        return len(self.tokenizer(text, add_special_tokens=False, verbose=False)["input_ids"])
+
+    def spans(self, text: str) -> List[Span]:
+        enc = self.tokenizer(text, add_special_tokens=False, return_offsets_mapping=True,
+                             verbose=False)
+        return [tuple(s) for s in enc["offset_mapping"]]
+
+
+@lru_cache(maxsize=8)
+def get_tokenizer(model_name: str):
+    """Tokenizer of ``model_name``, or :class:`ApproxTokenizer` if unavailable."""
+
+    try:
+        from transformers import AutoTokenizer
+
+        tok = AutoTokenizer.from_pretrained(canonical_model_name(model_name))
+        if not tok.is_fast:
+            raise ValueError("offsets need a fast tokenizer")
+        return HFTokenizer(tok)
+    except Exception as e:
+        LOGGER.info("Using approximate token counts for %s: %s", model_name, e)
+        return ApproxTokenizer()
+
+
+def _pieces(text: Union[str, Iterable[str]]) -> Iterable[str]:
+    if isinstance(text, str):
+        return (text[i:i + READ_SIZE] for i in range(0, len(text), READ_SIZE))
+    return text
+
+
+def _normalized(pieces: Iterable[str]) -> Iterator[str]:
+    """Collapse runs of whitespace to one space, also across piece borders."""
+
+    started = pending = False
+    for piece in pieces:
+        words = piece.split()
+        if not words:
+            pending = pending or bool(piece)
+            continue
+        out = " ".join(words)
+        if started and (pending or piece[0].isspace()):
+            out = " " + out
+        started, pending = True, piece[-1].isspace()
+        yield out
+
+
+def iter_sentences(text: Union[str, Iterable[str]], max_chars: int = 4096) -> Iterator[str]:
+    """Yield sentences of the whitespace-normalised ``text``.
+
+    Text without a sentence end is cut at a space every ``max_chars``
+    characters so the buffer stays bounded.
+    """
+
+    buf = ""
+    for part in _normalized(_pieces(text)):
+        scan = max(0, len(buf) - 8)  # a '.' at the old end may now be followed by ' '
+        buf += part
+        pos = 0
+        for m in _SENTENCE_END.finditer(buf, scan):
+            sentence = buf[pos:m.end()].strip()
+            if sentence:
+                yield sentence
+            pos = m.end()
+        buf = buf[pos:].lstrip()
+        while len(buf) > max_chars:
+            cut = buf.rfind(" ", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            yield buf[:cut]
+            buf = buf[cut:].lstrip()
+    buf = buf.strip()
+    if buf:
+        yield buf
+
+
+def _budgeted(sentence: str, tokenizer, max_tokens: int) -> Iterator[Tuple[str, int]]:
+    """``(text, tokens)`` pieces of ``sentence`` of at most ``max_tokens`` tokens."""
+
+    n = tokenizer.count(sentence)
+    if n <= max_tokens:
+        if n:
+            yield sentence, n
+        return
+    spans = tokenizer.spans(sentence)
+    for i in range(0, len(spans), max_tokens):
+        part = spans[i:i + max_tokens]
+        yield sentence[part[0][0]:part[-1][1]], len(part)
+
+
+def iter_chunks(
+    text: Union[str, Iterable[str]],
+    max_tokens: int = DEFAULT_MAX_TOKENS,
+    overlap: int = DEFAULT_OVERLAP,
+    tokenizer=None,
+) -> Iterator[str]:
+    """Yield chunks of at most ``max_tokens`` tokens from ``text``.
+
+    Parameters
+    ----------
+    text:
+        A string or an iterable of string pieces, e.g. blocks read from a
+        file or the pages of a PDF.
+    max_tokens:
+        Token budget per chunk, without the model's special tokens.
+    overlap:
+        Up to this many tokens of whole trailing sentences are repeated at
+        the start of the next chunk.
+    tokenizer:
+        Object with ``count(text)`` and ``spans(text)`` (token character
+        offsets) methods; :class:`ApproxTokenizer` by default.
+    """
+
+    tokenizer = tokenizer or ApproxTokenizer()
+    window: deque = deque()  # (text, tokens) of the chunk being built
+    total = 0
+    fresh = False            # window holds text not yet emitted
+    for sentence in iter_sentences(text):
+        for part, n in _budgeted(sentence, tokenizer, max_tokens):
+            if total + n > max_tokens and fresh:
+                yield " ".join(s for s, _ in window)
+                kept: deque = deque()
+                total = 0
+                for s, c in reversed(window):
+                    if total + c > overlap:
+                        break
+                    kept.appendleft((s, c))
+                    total += c
+                window, fresh = kept, False
+            while window and total + n > max_tokens:
+                total -= window.popleft()[1]
+            window.append((part, n))
+            total += n
+            fresh = True
+    if fresh:
+        yield " ".join(s for s, _ in window)
+
+
+__all__ = [
+    "ApproxTokenizer",
+    "DEFAULT_MAX_TOKENS",
+    "DEFAULT_OVERLAP",
+    "HFTokenizer",
+    "get_tokenizer",
+    "iter_chunks",
+    "iter_sentences",
+]
@@ -0,0 +1,383 @@
+"""Process-wide embedding model registry and query-embedding cache.
+
+:func:`get_model` is the only place a ``SentenceTransformer`` is loaded:
+models are keyed by their canonical Hugging Face id, so the knowledge
+store, ``api.embedder``, ``api.search_web`` and ``api.crawler_router``
+share one copy of the MiniLM weights per process.  Each model is loaded
+and warmed up once; :func:`model_stats` reports load time and memory.
+``EMBED_BACKEND`` selects how the model runs: ``torch`` (default), or
+``onnx`` / ``onnx-int8`` for an exported graph on ONNX Runtime (see
+:mod:`onnx_backend`) with ``EMBED_THREADS`` intra-op threads.
+
+Every query-side embedding path (``KnowledgeStore.search``,
+``api.search_web.search_web`` …) goes through :func:`encode_cached`, so a
+repeated or popular question skips transformer inference entirely.  Entries
+are keyed by ``(canonical model name, whitespace-normalised text)`` and
+evicted least-recently-used once ``EMBED_CACHE_SIZE`` vectors are held; an
+optional ``EMBED_CACHE_TTL`` (seconds) expires stale vectors as well.
+
+Document ingestion deliberately bypasses the cache – chunks are seldom
+embedded twice and would only push hot queries out.
+
+Cache misses from concurrent requests can be funnelled through a
+:class:`MicroBatcher`: a single worker thread collects queued texts for at
+most ``max_wait_ms`` (or until ``max_batch`` are waiting), runs one
+``encode`` for the whole micro-batch and resolves every caller's future.
+"""
+
+from __future__ import annotations
+
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+if TYPE_CHECKING:  # pragma: no cover - only for type hints
+    from sentence_transformers import SentenceTransformer
+
+LOGGER = logging.getLogger("fura.embeddings")
+
+_ST_PREFIX = "sentence-transformers/"
+DEFAULT_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+BACKENDS = ("torch", "onnx", "onnx-int8")
+ONNX_DIR = Path(os.getenv("EMBED_ONNX_DIR") or Path(__file__).resolve().parent / "models" / "onnx")
+
+
+def canonical_model_name(name: str) -> str:
+    """Return the Hugging Face id for ``name`` (``all-MiniLM-L6-v2`` and
+    ``sentence-transformers/all-MiniLM-L6-v2`` are the same model)."""
+
+    name = (name or "").strip()
+    if name and "/" not in name:
+        return _ST_PREFIX + name
+    return name
+
+
+_models: Dict[str, "SentenceTransformer"] = {}
+_model_info: Dict[str, Dict[str, Any]] = {}
+_models_lock = threading.Lock()
+
+
+def _model_bytes(model) -> Optional[int]:
+    """Bytes held by the parameters and buffers of a torch model."""
+
+    try:
+        tensors = list(model.parameters()) + list(model.buffers())
+        return int(sum(t.numel() * t.element_size() for t in tensors))
+    except Exception:  # pragma: no cover - non-torch backends
+        return None
+
+
+def onnx_model_dir(name: str) -> Path:
+    """Directory holding the ONNX export of ``name``."""
+
+    return ONNX_DIR / canonical_model_name(name).replace("/", "__")
+
+
+def _load(key: str, backend: str):
+    if backend == "torch":
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as exc:
+            raise RuntimeError(
+                "sentence-transformers package is required for embeddings"
+            ) from exc
+        return SentenceTransformer(key)
+    try:
+        from onnx_backend import INT8_FILE, MODEL_FILE, OnnxEncoder, export_onnx
+    except ImportError as exc:  # pragma: no cover - numpy is always there
+        raise RuntimeError("onnx_backend module is not importable") from exc
+    quantized = backend == "onnx-int8"
+    path = onnx_model_dir(key)
+    if not (path / (INT8_FILE if quantized else MODEL_FILE)).exists():
+        try:
+            export_onnx(key, path, quantize=quantized)
+        except ImportError as exc:
+            raise RuntimeError(
+                "torch and sentence-transformers are required to export the ONNX model"
+            ) from exc
+    try:
+        return OnnxEncoder(path, quantized=quantized, threads=int(os.getenv("EMBED_THREADS", "0")))
+    except ImportError as exc:
+        raise RuntimeError(
+            "onnxruntime and transformers packages are required for the ONNX backend"
+        ) from exc
+
+
+def get_model(name: str = DEFAULT_MODEL, backend: Optional[str] = None) -> "SentenceTransformer":
+    """Return the process-wide embedding model for ``name``.
+
+    ``backend`` defaults to ``EMBED_BACKEND``; ONNX backends export the
+    model on first use when no export exists yet.  The first call loads
+    the model and runs one warm-up ``encode`` so the first real query does
+    not pay for lazy initialisation.
+
+    Raises
+    ------
+    RuntimeError
+        If the packages the backend needs are not installed.
+    ValueError
+        For an unknown backend.
+    """
+
+    backend = backend or os.getenv("EMBED_BACKEND", "torch")
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown embedding backend {backend!r}, expected one of {BACKENDS}")
+    name = canonical_model_name(name)
+    key = name if backend == "torch" else f"{name}@{backend}"
+    model = _models.get(key)
+    if model is not None:
+        return model
+    with _models_lock:
+        model = _models.get(key)
+        if model is None:
+            t0 = time.perf_counter()
+            model = _load(name, backend)
+            loaded = time.perf_counter() - t0
+            model.encode(["warm-up"], normalize_embeddings=True)
+            onnx_path = getattr(model, "path", None)
+            _model_info[key] = {
+                "backend": backend,
+                "load_seconds": round(loaded, 3),
+                "warmup_seconds": round(time.perf_counter() - t0 - loaded, 3),
+                "param_bytes": onnx_path.stat().st_size if onnx_path else _model_bytes(model),
+                "device": str(getattr(model, "device", "cpu")),
+                "dim": model.get_sentence_embedding_dimension(),
+            }
+            LOGGER.info("Loaded embedding model %s (%s) in %.1fs (%s bytes)", name, backend,
+                        loaded, _model_info[key]["param_bytes"])
+            _models[key] = model
+    return model
+
+
+def model_stats() -> Dict[str, Dict[str, Any]]:
+    """Backend, load time, warm-up time, parameter memory and device of each
+    loaded model (non-torch backends are keyed ``name@backend``)."""
+
+    with _models_lock:
+        return {key: dict(info) for key, info in _model_info.items()}
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different spellings share an entry."""
+
+    return " ".join((text or "").split())
+
+
+class EmbeddingCache:
+    """Thread-safe LRU cache of embedding vectors with optional TTL."""
+
+    def __init__(self, maxsize: int = 4096, ttl: Optional[float] = None):
+        self.maxsize = max(0, int(maxsize))
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Tuple[str, str], Tuple[float, np.ndarray]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[np.ndarray]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl is not None and time.monotonic() - item[0] > self.ttl:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Tuple[str, str], vector: np.ndarray) -> None:
+        if self.maxsize == 0:
+            return
+        vector = np.array(vector, dtype="float32")
+        vector.setflags(write=False)
+        with self._lock:
+            self._data[key] = (time.monotonic(), vector)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+
+_ttl = os.getenv("EMBED_CACHE_TTL")
+query_cache = EmbeddingCache(
+    maxsize=int(os.getenv("EMBED_CACHE_SIZE", "4096")),
+    ttl=float(_ttl) if _ttl else None,
+)
+
+
+def encode_cached(
+    model_name: str,
+    texts: List[str],
+    encode: Callable[[List[str]], np.ndarray],
+    cache: Optional[EmbeddingCache] = None,
+) -> np.ndarray:
+    """Embed ``texts`` using ``encode`` for cache misses only.
+
+    Parameters
+    ----------
+    model_name:
+        Name of the model ``encode`` runs; part of the cache key.
+    texts:
+        Query strings.  Duplicates within one call are encoded once.
+    encode:
+        Callable mapping a list of strings to an ``(n, dim)`` array.
+    cache:
+        Cache to use, :data:`query_cache` by default.
+
+    Returns
+    -------
+    numpy.ndarray
+        ``float32`` array of shape ``(len(texts), dim)``.
+    """
+
+    cache = query_cache if cache is None else cache
+    model = canonical_model_name(model_name)
+    keys = [(model, normalize_text(t)) for t in texts]
+    found: Dict[Tuple[str, str], np.ndarray] = {}
+    missing: "OrderedDict[Tuple[str, str], None]" = OrderedDict()
+    for key in keys:
+        if key in found or key in missing:
+            continue
+        vec = cache.get(key)
+        if vec is None:
+            missing[key] = None
+        else:
+            found[key] = vec
+    if missing:
+        vecs = np.asarray(encode([text for _, text in missing]), dtype="float32")
+        for key, vec in zip(missing, vecs):
+            cache.put(key, vec)
+            found[key] = vec
+    if not keys:
+        return np.zeros((0, 0), dtype="float32")
+    return np.stack([found[key] for key in keys]).astype("float32")
+
+
+class MicroBatcher:
+    """Merge concurrent ``encode`` calls into micro-batches.
+
+    Parameters
+    ----------
+    encode:
+        Callable mapping a list of strings to an ``(n, dim)`` array; only
+        ever called from the batcher's worker thread.
+    max_batch:
+        Largest number of texts encoded together.
+    max_wait_ms:
+        How long the first queued text waits for company before the batch
+        is encoded anyway.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], max_batch: int = 32,
+                 max_wait_ms: float = 5.0, name: str = "embed-batcher"):
+        self._encode = encode
+        self.max_batch = max(1, int(max_batch))
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self.batches = 0
+        self.items = 0
+        self._queue: "queue.Queue[Optional[Tuple[str, Future]]]" = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, texts: List[str]) -> List[Future]:
+        """Queue ``texts``; each future resolves to one ``float32`` vector."""
+        futures = []
+        for text in texts:
+            fut: Future = Future()
+            self._queue.put((text, fut))
+            futures.append(fut)
+        return futures
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Blocking drop-in for ``encode``, usable as :func:`encode_cached`'s encoder."""
+        futures = self.submit(texts)
+        if not futures:
+            return np.zeros((0, 0), dtype="float32")
+        return np.stack([f.result() for f in futures])
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "mean_batch": self.items / self.batches if self.batches else 0.0,
+            "queued": self._queue.qsize(),
+        }
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _loop(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    self._queue.put(None)  # finish this batch, stop afterwards
+                    break
+                batch.append(item)
+            self._run(batch)
+
+    def _run(self, batch: List[Tuple[str, Future]]) -> None:
+        live = [(text, fut) for text, fut in batch if fut.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            vecs = np.asarray(self._encode([text for text, _ in live]), dtype="float32")
+        except Exception as e:
+            LOGGER.warning("Batched encode of %d texts failed: %s", len(live), e)
+            for _, fut in live:
+                fut.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(live)
+        for (_, fut), vec in zip(live, vecs):
+            fut.set_result(vec)
+
+
+__all__ = [
+    "BACKENDS",
+    "DEFAULT_MODEL",
+    "EmbeddingCache",
+    "MicroBatcher",
+    "canonical_model_name",
+    "encode_cached",
+    "get_model",
+    "model_stats",
+    "normalize_text",
+    "onnx_model_dir",
+    "query_cache",
+]
@@ -0,0 +1,122 @@
+"""Background job queue for long-running ingestion work.
+
+HTTP handlers hand extraction / embedding / index writes to
+:class:`JobQueue` and return the job id immediately instead of blocking the
+event loop.  A bounded pool of worker threads runs the jobs in submission
+order; at most ``max_pending`` jobs may wait, further submissions raise
+:class:`QueueFull`.  Each job receives a ``progress`` callback whose latest
+statistics are reported by :meth:`Job.to_dict` together with the status,
+timings, throughput, result and error.
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+LOGGER = logging.getLogger("fura.jobs")
+
+JobFn = Callable[[Callable[[Dict], None]], Any]
+
+
+class QueueFull(RuntimeError):
+    """Too many jobs are already waiting."""
+
+
+@dataclass
+class Job:
+    id: str
+    kind: str
+    status: str = "queued"           # queued | running | done | error
+    submitted_at: float = field(default_factory=time.time)
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    progress: Dict = field(default_factory=dict)
+    result: Any = None
+    error: Optional[str] = None
+    future: Optional[Future] = field(default=None, repr=False)
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        chunks = (self.result or {}).get("chunks") if isinstance(self.result, dict) else None
+        if chunks is None:
+            chunks = self.progress.get("chunks")
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "submitted_at": self.submitted_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "queued_for": round((self.started_at or end) - self.submitted_at, 3),
+            "elapsed": round(elapsed, 3),
+            "chunks_per_sec": round(chunks / elapsed, 2) if chunks and elapsed > 0 else None,
+            "progress": dict(self.progress),
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobQueue:
+    """Run submitted jobs on ``workers`` background threads.
+
+    Finished jobs are remembered (the newest ``keep`` of them) so their
+    status can still be queried.
+    """
+
+    def __init__(self, workers: int = 1, max_pending: int = 100, keep: int = 1000):
+        self.max_pending = max_pending
+        self.keep = keep
+        self._pool = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="ingest")
+        self._jobs: "OrderedDict[str, Job]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind: str, fn: JobFn) -> Job:
+        """Queue ``fn(progress)``; its return value becomes the job result."""
+        with self._lock:
+            if sum(j.status == "queued" for j in self._jobs.values()) >= self.max_pending:
+                raise QueueFull(f"{self.max_pending} jobs are already waiting")
+            job = Job(id=uuid.uuid4().hex[:12], kind=kind)
+            self._jobs[job.id] = job
+            self._evict()
+        job.future = self._pool.submit(self._run, job, fn)
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self, wait: bool = False) -> None:
+        self._pool.shutdown(wait=wait, cancel_futures=not wait)
+
+    def _run(self, job: Job, fn: JobFn) -> Any:
+        job.started_at, job.status = time.time(), "running"
+
+        def progress(stats: Dict) -> None:
+            job.progress = dict(stats)
+
+        try:
+            result = fn(progress)
+        except Exception as e:
+            LOGGER.exception("Job %s (%s) failed", job.id, job.kind)
+            job.error = str(e) or type(e).__name__
+            job.finished_at, job.status = time.time(), "error"
+            raise
+        job.result = result
+        job.finished_at, job.status = time.time(), "done"
+        return result
+
+    def _evict(self) -> None:
+        finished = [j.id for j in self._jobs.values() if j.status in ("done", "error")]
+        for job_id in finished[:max(0, len(self._jobs) - self.keep)]:
+            del self._jobs[job_id]
+
+
+__all__ = ["Job", "JobQueue", "QueueFull"]
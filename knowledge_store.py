@@ -1,11 +1,19 @@
 # -*- coding: utf-8 -*-
-import os, io, json, time, pickle, logging, re, math
+import os, io, json, time, pickle, logging, re, math, hashlib, threading, tempfile
+import multiprocessing
+from functools import partial
+from itertools import islice, zip_longest
+from concurrent.futures import ProcessPoolExecutor
 from dataclasses import dataclass, field
-from typing import List, Dict, Optional, Tuple, TYPE_CHECKING
+from typing import IO, Callable, Iterable, Iterator, List, Dict, Optional, Tuple, Union, TYPE_CHECKING
 import numpy as np
 
 import faiss
 
+from bm25 import BM25Index, select_top_k
+from chunking import READ_SIZE, get_tokenizer, iter_chunks
+from embeddings import MicroBatcher, encode_cached, get_model
+
 if TYPE_CHECKING:  # pragma: no cover - only for type hints
     from sentence_transformers import SentenceTransformer
 
@@ -14,25 +22,101 @@ LOGGER = logging.getLogger("fura.knowledge")
 def _now_ts() -> int:
     return int(time.time())
 
-def _chunk_text(txt: str, max_chars=900, overlap=150) -> List[str]:
-    txt = re.sub(r'\s+', ' ', (txt or '')).strip()
-    if not txt:
-        return []
-    chunks = []
-    i = 0
-    n = len(txt)
-    while i < n:
-        j = min(n, i + max_chars)
-        # prefer split at sentence end
-        cut = txt[i:j]
-        m = re.search(r'.*?[.!?](\s|$)', cut)
-        if m and (i + m.end()) - i >= max_chars * 0.6:
-            j = i + m.end()
-        chunks.append(txt[i:j].strip())
-        if j >= n:
-            break
-        i = max(0, j - overlap)
-    return [c for c in chunks if c]
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+
+def _iter_text_chunks(text: Union[str, Iterable[str]]) -> Iterator[str]:
+    """Token-budgeted chunks of ``text`` (a string or a stream of pieces)."""
+    return iter_chunks(text or "", tokenizer=get_tokenizer(MODEL_NAME))
+
+def _chunk_text(text: Union[str, Iterable[str]]) -> List[str]:
+    return list(_iter_text_chunks(text))
+
+FOLDER_EXTS = (".md", ".txt", ".pdf")
+SPOOL_BYTES = 8 << 20  # downloads larger than this spill from RAM to a temp file
+
+class DocumentTooLarge(ValueError):
+    """A document exceeds ``KnowledgeStore.max_doc_bytes``."""
+
+def _check_size(size: int, max_bytes: Optional[int], name: str):
+    if max_bytes and size > max_bytes:
+        raise DocumentTooLarge(f"{name}: {size} bytes exceeds the limit of {max_bytes} bytes")
+
+def _iter_file_text(path: str, max_bytes: Optional[int] = None) -> Iterator[str]:
+    """Text of ``path`` as a stream of pieces: PDFs page by page, plain text
+    block by block."""
+    _check_size(os.path.getsize(path), max_bytes, path)
+    if path.lower().endswith(".pdf"):
+        yield from _iter_pdf_pages(path)
+        return
+    with open(path, "r", encoding="utf-8", errors="ignore") as f:
+        yield from iter(lambda: f.read(READ_SIZE), "")
+
+def _pdfminer_pages(f: IO[bytes]) -> Iterator[str]:
+    from pdfminer.converter import TextConverter
+    from pdfminer.layout import LAParams
+    from pdfminer.pdfinterp import PDFPageInterpreter, PDFResourceManager
+    from pdfminer.pdfpage import PDFPage
+
+    rsrc = PDFResourceManager(caching=False)
+    buf = io.StringIO()
+    device = TextConverter(rsrc, buf, laparams=LAParams())
+    try:
+        interpreter = PDFPageInterpreter(rsrc, device)
+        for page in PDFPage.get_pages(f, caching=False):
+            interpreter.process_page(page)
+            yield buf.getvalue() + "\n"
+            buf.seek(0)
+            buf.truncate()
+    finally:
+        device.close()
+
+def _iter_pdf_pages(source: Union[str, IO[bytes]]) -> Iterator[str]:
+    """Text of a PDF (path or seekable binary file) one page at a time.
+
+    pdfminer is preferred; PyPDF2 is used if pdfminer is missing or fails
+    before the first page."""
+    f = open(source, "rb") if isinstance(source, str) else source
+    try:
+        started = False
+        try:
+            for text in _pdfminer_pages(f):
+                started = True
+                yield text
+            return
+        except Exception:
+            if started:
+                raise
+        f.seek(0)
+        try:
+            from PyPDF2 import PdfReader
+            pages = PdfReader(f).pages
+        except Exception as e:
+            raise RuntimeError(
+                "PDF parsing requires pdfminer.six or PyPDF2"
+            ) from e
+        for page in pages:
+            yield (page.extract_text() or "") + "\n"
+    finally:
+        if f is not source:
+            f.close()
+
+def _extract_and_chunk(path: str, max_bytes: Optional[int] = None
+                       ) -> Tuple[str, Optional[List[str]], Optional[str]]:
+    """Process-pool worker: ``(path, chunks, error)`` for one file."""
+    try:
+        return path, _chunk_text(_iter_file_text(path, max_bytes)), None
+    except Exception as e:
+        return path, None, str(e)
+
+def _pool_context():
+    """Start method for extraction workers.
+
+    Forking a server that already runs threads (job queue, micro-batcher,
+    torch) can copy a held lock into the child and hang it, so workers are
+    started fresh; they only need the importable :func:`_extract_and_chunk`.
+    """
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
 
 @dataclass
 class DocMeta:
@@ -42,79 +126,811 @@ class DocMeta:
     tags: List[str] = field(default_factory=list)
     created_at: int = field(default_factory=_now_ts)
 
+ANN_TYPES = ("flat", "hnsw", "ivf", "ivfpq")
+CODECS = ("fp32", "fp16", "sq8", "pq")
+# rows needed before a codec index is trained (PQ needs 2**nbits points per sub-quantizer)
+CODEC_MIN_ROWS = {"fp32": 0, "fp16": 1, "sq8": 1, "pq": 39 * 16}
+
+def _pq_spec(n: int, dim: int) -> Tuple[int, int]:
+    """``(m, nbits)`` of a product quantizer for ``n`` training vectors."""
+    m = next(m for m in (48, 32, 24, 16, 12, 8, 4, 2, 1) if dim % m == 0)
+    nbits = max(4, min(8, int(math.log2(max(n, 16) / 39)))) if n >= 39 * 16 else 4
+    return m, nbits
+
+def _ann_factory(index_type: str, n: int, dim: int, codec: str = "fp32") -> str:
+    """FAISS ``index_factory`` description for an index over ``n`` vectors.
+
+    ``codec`` selects how the vectors are stored inside the index: raw
+    float32, ``fp16`` / ``sq8`` scalar quantization (2 / 1 bytes per
+    dimension) or ``pq`` product quantization (``m`` codes per vector).
+    ``ivfpq`` always uses PQ.  A bare ``IndexPQ`` rejects the ``IDSelector``
+    that tombstones and filters are searched with, so flat PQ is built as a
+    single-list IVF (``IVF1,PQ…``), which scans the same codes.
+    """
+    if codec not in CODECS:
+        raise ValueError(f"unknown codec: {codec}")
+    if index_type == "ivfpq":
+        codec = "pq"
+    m, nbits = _pq_spec(n, dim)
+    if index_type == "hnsw":
+        return {"fp32": "HNSW32", "fp16": "HNSW32_SQfp16", "sq8": "HNSW32_SQ8",
+                "pq": f"HNSW32_PQ{m}x{nbits}"}[codec]
+    storage = {"fp32": "Flat", "fp16": "SQfp16", "sq8": "SQ8", "pq": f"PQ{m}x{nbits}"}[codec]
+    if index_type == "flat":
+        return f"IVF1,{storage}" if codec == "pq" else storage
+    if index_type in ("ivf", "ivfpq"):
+        # ~4*sqrt(N) lists, but keep >= 39 training points per centroid
+        nlist = max(1, min(int(4 * math.sqrt(n)), n // 39, 65536))
+        return f"IVF{nlist},{storage}"
+    raise ValueError(f"unknown index type: {index_type}")
+
+def _factory_sizes(factory: str) -> Tuple[int, int]:
+    """``(nlist, nbits)`` of an :func:`_ann_factory` description (``0`` if absent)."""
+    nlist = re.search(r"IVF(\d+)", factory)
+    nbits = re.search(r"PQ\d+x(\d+)", factory)
+    return int(nlist.group(1)) if nlist else 0, int(nbits.group(1)) if nbits else 0
+
+def _outgrown(built: str, wanted: str) -> bool:
+    """Whether an index built as ``built`` is sized too far off ``wanted``:
+    another PQ code size, or an IVF list count off by 2x or more."""
+    (nlist, nbits), (want_nlist, want_nbits) = _factory_sizes(built), _factory_sizes(wanted)
+    if nbits != want_nbits or bool(nlist) != bool(want_nlist):
+        return True
+    return bool(nlist) and max(nlist, want_nlist) >= 2 * min(nlist, want_nlist)
+
+def _write_atomic(path: str, write) -> None:
+    """Call ``write(fileobj)`` on a temporary file and move it over ``path``."""
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        write(f)
+    os.replace(tmp, path)
+
 class KnowledgeStore:
-    def __init__(self, root_dir: str):
+    """Chunked document store with a FAISS inner-product index.
+
+    Chunks are persisted as append-only segments in ``knowledge_index/``
+    (:meth:`_maybe_merge`) and searched exactly, or through an ANN and/or
+    compressed index once the store is large enough (``index_type``,
+    ``codec``; :meth:`_maybe_train_ann`).  Deletes tombstone chunks until
+    :meth:`compact`; :meth:`hybrid_search` adds BM25 over the same chunks.
+    With ``load=False`` nothing is read before :meth:`load_in_background`.
+    """
+
+    FILTER_SCAN_ROWS = 50_000
+    EMBED_BATCH = 256
+    HYBRID_CANDIDATES = 50   # hits taken from each ranking before fusion
+    RRF_K = 60
+
+    def __init__(self, root_dir: str, merge_factor: int = 1, mmap: bool = False,
+                 index_type: str = "flat", ann_threshold: int = 50_000,
+                 nprobe: int = 16, ef_search: int = 64, compact_ratio: float = 0.2,
+                 codec: str = "fp32", rescore: int = 0,
+                 max_doc_bytes: Optional[int] = 100 << 20,
+                 query_batch: int = 0, query_wait_ms: float = 5.0, load: bool = True):
+        if index_type not in ANN_TYPES:
+            raise ValueError(f"index_type must be one of {ANN_TYPES}, got {index_type!r}")
+        if codec not in CODECS:
+            raise ValueError(f"codec must be one of {CODECS}, got {codec!r}")
         self.root = root_dir
         os.makedirs(self.root, exist_ok=True)
         self.store_path = os.path.join(self.root, "knowledge_store.jsonl")
-        self.index_path = os.path.join(self.root, "knowledge_index.pkl")
-        self.model_name = "sentence-transformers/all-MiniLM-L6-v2"
-        self._model: Optional['SentenceTransformer'] = None
-        self._index: Optional[faiss.IndexFlatIP] = None
-        self._vectors: Optional[np.ndarray] = None   # shape (N, D)
-        self._entries: List[Dict] = []              # aligned with _vectors rows
+        self.index_dir = os.path.join(self.root, "knowledge_index")
+        self.manifest_path = os.path.join(self.index_dir, "manifest.json")
+        self.index_path = os.path.join(self.root, "knowledge_index.pkl")  # legacy single-file format
+        self.model_name = MODEL_NAME
+        self.merge_factor = max(1, int(merge_factor))
+        self.mmap = mmap
+        self.index_type = index_type
+        self.ann_threshold = max(1, int(ann_threshold))
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.compact_ratio = compact_ratio
+        self.codec = codec
+        self.rescore = max(0, int(rescore))
+        self.max_doc_bytes = max_doc_bytes
+        # concurrent searches share micro-batched query encodes (0 = encode inline)
+        self._batcher = (MicroBatcher(lambda texts: self._embed(texts), query_batch, query_wait_ms,
+                                      name="knowledge-query-batcher")
+                         if query_batch > 0 else None)
+        self.ann_path = os.path.join(self.index_dir, "ann.faiss")
+        self.sources_path = os.path.join(self.index_dir, "sources.json")
+        self.tombstones_path = os.path.join(self.index_dir, "tombstones.npy")
+        self.lexical_dir = os.path.join(self.index_dir, "bm25")
+        self._lock = threading.RLock()       # guards the index structures
+        self._sync_lock = threading.Lock()   # serialises folder syncs / rebuilds
+        self._maint_lock = threading.Lock()  # serialises merges / ANN training after adds
+        self._layout = 0                     # bumped whenever chunk ids leave the segments
+        self._index: Optional[faiss.Index] = None   # IndexIDMap2; None in flat mmap mode
+        self._ann: Optional[Dict] = None             # {"type", "codec", "factory", "next_id"} once a trained index is active
+        self._segments: List[Dict] = []             # manifest records, in row order
+        self._blocks: List[np.ndarray] = []         # vectors per segment, aligned with _segments
+        self._block_ids: List[np.ndarray] = []      # ascending chunk ids per segment
+        self._dead_masks: List[Optional[np.ndarray]] = []  # tombstoned rows per segment (None = none)
+        self._entries: List[Dict] = []              # aligned with the concatenated rows
+        self._doc_chunks: Dict[str, List[int]] = {} # doc id -> live chunk ids
+        self._postings: Dict[Tuple[str, str], List[int]] = {}  # ("tag"|"source", value) -> chunk ids
+        self._filter_cache: Dict[Tuple, Dict] = {}  # (tags, source) -> bitmap / selector / rows
+        self._lexical: Optional[BM25Index] = BM25Index()  # BM25 over live chunk ids (None while loading)
+        self._tombstones: set = set()
+        self._tomb_sel = None                       # IDSelector excluding tombstones
+        self._next_segment = 1
+        self._next_chunk_id = 1
         self._dim = 384
-        self._load_store()
-        self._load_index()
+        self.last_ingest: Dict = {}                 # statistics of the last reindex_folder run
+        self._docs: List[DocMeta] = []
+        self._doc_seq = 0
+        self.ready = threading.Event()              # set once load() finished
+        self._load_state: Dict = {"status": "pending", "segments": 0, "segments_total": 0,
+                                  "rows": 0, "started_at": None, "finished_at": None,
+                                  "error": None}
+        self._loader: Optional[threading.Thread] = None
+        self._loader_lock = threading.Lock()
+        if load:
+            self.load()
+
+    def load(self) -> Dict:
+        """Read the documents and the vector index from disk.
+
+        Runs in the constructor unless ``load=False`` was given.  Returns
+        :meth:`load_status`."""
+        self._load_state.update(status="loading", segments=0, rows=0, started_at=time.time(),
+                                finished_at=None, error=None)
+        try:
+            with self._lock:
+                self._load_store()
+                self._load_index()
+        except Exception as e:
+            self._load_state.update(status="error", error=str(e) or type(e).__name__,
+                                    finished_at=time.time())
+            raise
+        self._load_state.update(status="ready", rows=self._live, finished_at=time.time())
+        self.ready.set()
+        return self.load_status()
+
+    def load_in_background(self) -> threading.Event:
+        """Start :meth:`load` on a daemon thread (once) and return :attr:`ready`.
+
+        :attr:`ready` is set once loaded; :meth:`load_status` reports progress."""
+        with self._loader_lock:
+            if self._loader is None and not self.ready.is_set():
+                def run():
+                    try:
+                        self.load()
+                    except Exception:
+                        LOGGER.exception("Loading the knowledge store failed")
+
+                self._loader = threading.Thread(target=run, name="knowledge-load", daemon=True)
+                self._loader.start()
+        return self.ready
+
+    def load_status(self) -> Dict:
+        """``status`` (pending | loading | ready | error), segments and rows
+        read so far, timings and the error of a failed load."""
+        state = dict(self._load_state)
+        if state["started_at"]:
+            state["elapsed"] = round((state["finished_at"] or time.time()) - state["started_at"], 3)
+        return state
+
+    @property
+    def _rows(self) -> int:
+        return len(self._entries)
+
+    @property
+    def _live(self) -> int:
+        return len(self._entries) - len(self._tombstones)
+
+    def _take_rows(self, rows: np.ndarray, blocks: Optional[List[np.ndarray]] = None) -> np.ndarray:
+        """Gather the vectors of the sorted global ``rows`` block by block."""
+        parts = []
+        offset = 0
+        for block in self._blocks if blocks is None else blocks:
+            n = block.shape[0]
+            lo, hi = np.searchsorted(rows, [offset, offset + n])
+            if hi > lo:
+                parts.append(block[rows[lo:hi] - offset])
+            offset += n
+        if not parts:
+            return np.zeros((0, self._dim), dtype="float32")
+        return np.ascontiguousarray(np.concatenate(parts), dtype="float32")
+
+    def _rows_of(self, labels: np.ndarray) -> np.ndarray:
+        """Map chunk ids returned by FAISS to global row numbers (``-1`` stays)."""
+        out = np.full(labels.shape, -1, dtype="int64")
+        if not self._block_ids:
+            return out
+        firsts = np.array([ids[0] if len(ids) else np.iinfo("int64").max for ids in self._block_ids])
+        offsets = np.cumsum([0] + [len(ids) for ids in self._block_ids])
+        valid = labels >= 0
+        block_of = np.searchsorted(firsts, labels[valid], side="right") - 1
+        rows = np.full(block_of.shape, -1, dtype="int64")
+        for b in np.unique(block_of):
+            sel = block_of == b
+            rows[sel] = offsets[b] + np.searchsorted(self._block_ids[b], labels[valid][sel])
+        out[valid] = rows
+        return out
+
+    @property
+    def _vectors(self) -> np.ndarray:
+        """All vectors as one ``(N, D)`` matrix.  Copies; meant for tests and tools."""
+        if not self._blocks:
+            return np.zeros((0, self._dim), dtype="float32")
+        return np.concatenate(self._blocks)
 
     # ---------- low-level ----------
     def _load_store(self):
         self._docs = []  # list[DocMeta]
+        self._doc_seq = 0
         if os.path.exists(self.store_path):
             with open(self.store_path, "r", encoding="utf-8") as f:
                 for line in f:
                     if not line.strip(): continue
                     obj = json.loads(line)
                     self._docs.append(DocMeta(**obj))
+                    m = re.fullmatch(r"doc-(\d+)", obj.get("id", ""))
+                    if m:
+                        self._doc_seq = max(self._doc_seq, int(m.group(1)))
         else:
             open(self.store_path, "a", encoding="utf-8").close()
 
     def _save_doc(self, meta: DocMeta):
-        with open(self.store_path, "a", encoding="utf-8") as f:
-            f.write(json.dumps(meta.__dict__, ensure_ascii=False) + "\n")
-        self._docs.append(meta)
+        # under the lock: _delete_docs / update_doc rebind _docs and rewrite the file
+        with self._lock:
+            with open(self.store_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(meta.__dict__, ensure_ascii=False) + "\n")
+            self._docs.append(meta)
+
+    def _rewrite_store(self):
+        _write_atomic(self.store_path, lambda f: f.write("".join(
+            json.dumps(d.__dict__, ensure_ascii=False) + "\n" for d in self._docs).encode("utf-8")))
+
+    def _get_doc(self, doc_id: str) -> DocMeta:
+        for meta in self._docs:
+            if meta.id == doc_id:
+                return meta
+        raise KeyError(doc_id)
+
+    def _new_doc_id(self) -> str:
+        # monotonic (and persisted in the manifest) so ids of deleted documents
+        # are never handed out again, not even after rebuild_folder
+        with self._lock:
+            self._doc_seq = max(self._doc_seq, len(self._docs)) + 1
+            return f"doc-{self._doc_seq}"
+
+    def _new_flat_index(self) -> faiss.Index:
+        return faiss.IndexIDMap2(faiss.IndexFlatIP(self._dim))
+
+    def _reset_index(self):
+        self._layout += 1
+        self._index = None if self.mmap else self._new_flat_index()
+        self._ann = None
+        self._segments = []
+        self._blocks = []
+        self._block_ids = []
+        self._dead_masks = []
+        self._entries = []
+        self._doc_chunks = {}
+        self._postings = {}
+        self._filter_cache = {}
+        self._lexical = BM25Index()
+        self._tombstones = set()
+        self._tomb_sel = None
 
     def _load_index(self):
-        if os.path.exists(self.index_path):
+        """Open the segments listed in the manifest, always memory-mapped.
+
+        With ``mmap=True`` no FAISS copy is built: searches scan the mapped
+        (already L2-normalised) vectors, so startup does not grow with the
+        corpus and only touched pages stay resident."""
+        self._reset_index()
+        if os.path.exists(self.manifest_path):
             try:
-                with open(self.index_path, "rb") as f:
-                    data = pickle.load(f)
-                self._vectors = data["vectors"].astype("float32")
-                self._entries = data["entries"]
-                self._dim = data.get("dim", 384)
-                self._index = faiss.IndexFlatIP(self._dim)
-                faiss.normalize_L2(self._vectors)
-                self._index.add(self._vectors)
-                LOGGER.info("Loaded knowledge index with %d vectors (%d dims) from %s",
-                            self._vectors.shape[0], self._dim, self.index_path)
+                with open(self.manifest_path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                self._dim = manifest.get("dim", 384)
+                self._next_segment = manifest.get("next_segment", 1)
+                self._next_chunk_id = manifest.get("next_chunk_id", 1)
+                self._doc_seq = max(self._doc_seq, manifest.get("doc_seq", 0))
+                self._reset_index()
+                self._lexical = None  # caught up from its snapshot by _load_lexical()
+                self._load_state["segments_total"] = len(manifest.get("segments", []))
+                for rec in manifest.get("segments", []):
+                    vecs, entries, ids = self._read_segment(rec["name"])
+                    if ids is None:  # segment written before chunk ids existed
+                        ids = np.arange(self._next_chunk_id, self._next_chunk_id + len(entries),
+                                        dtype="int64")
+                        _write_atomic(self._segment_paths(rec["name"])[2], lambda f: np.save(f, ids))
+                    if len(ids):
+                        self._next_chunk_id = max(self._next_chunk_id, int(ids[-1]) + 1)
+                    self._append_block(rec, vecs, ids, entries)
+                    self._load_state["segments"] += 1
+                    self._load_state["rows"] += len(entries)
+                if os.path.exists(self.tombstones_path):
+                    self._tombstones = set(np.load(self.tombstones_path).tolist())
+                    for chunk_ids in self._doc_chunks.values():
+                        chunk_ids[:] = [c for c in chunk_ids if c not in self._tombstones]
+                self._refresh_tombstones()
+                self._load_lexical()
+                if not self._load_ann(manifest.get("ann")):
+                    self._rebuild_index()
+                    self._maybe_train_ann()
+                LOGGER.info("Loaded knowledge index with %d vectors in %d segments from %s%s",
+                            self._live, len(self._segments), self.index_dir,
+                            " (memory-mapped)" if self.mmap else "")
                 return
             except Exception as e:
                 LOGGER.warning("Failed to load index, will rebuild: %s", e)
-        LOGGER.info("Knowledge index not found, will build on demand: %s", self.index_path)
-        self._index = faiss.IndexFlatIP(self._dim)
-        self._vectors = np.zeros((0, self._dim), dtype="float32")
-        self._entries = []
+                self._reset_index()
+        elif os.path.exists(self.index_path):
+            try:
+                self._migrate_legacy_index()
+                return
+            except Exception as e:
+                LOGGER.warning("Failed to load index, will rebuild: %s", e)
+                self._reset_index()
+        LOGGER.info("Knowledge index not found, will build on demand: %s", self.index_dir)
 
-    def _save_index(self):
-        if self._vectors is None: return
-        with open(self.index_path, "wb") as f:
-            pickle.dump({
-                "vectors": self._vectors.astype("float32"),
-                "entries": self._entries,
-                "dim": self._dim,
-                "model": self.model_name,
-            }, f)
+    def _append_block(self, rec: Dict, vecs: np.ndarray, ids: np.ndarray, entries: List[Dict]):
+        self._segments.append(rec)
+        self._blocks.append(vecs)
+        self._block_ids.append(ids)
+        self._dead_masks.append(None)
+        self._entries.extend(entries)
+        self._index_postings(entries, ids)
+        self._filter_cache = {}
+        if self._lexical is not None:
+            self._lexical.add_many((cid, e.get("chunk", "")) for e, cid in zip(entries, ids.tolist()))
+        for e, cid in zip(entries, ids.tolist()):
+            self._doc_chunks.setdefault(e.get("doc_id"), []).append(cid)
 
-    def _embedder(self) -> 'SentenceTransformer':
-        if self._model is None:
+    def _index_postings(self, entries: List[Dict], ids: np.ndarray):
+        for e, cid in zip(entries, ids.tolist()):
+            for tag in set(e.get("tags") or []):
+                self._postings.setdefault(("tag", tag), []).append(cid)
+            self._postings.setdefault(("source", e.get("source") or ""), []).append(cid)
+
+    def _rebuild_index(self):
+        """Re-add all segment vectors to a fresh copy of the current index."""
+        if self._ann is not None:
+            index = faiss.clone_index(self._index)
+            index.reset()  # keeps the trained quantizer / codebooks
+        elif self.mmap:
+            self._index = None
+            return
+        else:
+            index = self._new_flat_index()
+        for block, ids in zip(self._blocks, self._block_ids):
+            index.add_with_ids(np.ascontiguousarray(block), ids)
+        self._index = index
+        if self._ann is not None:
+            self._save_ann()
+
+    # ---------- tombstones ----------
+    def _dead_mask(self, ids: np.ndarray, tomb: np.ndarray) -> Optional[np.ndarray]:
+        if not len(tomb):
+            return None
+        mask = np.isin(ids, tomb)
+        return mask if mask.any() else None
+
+    def _refresh_tombstones(self):
+        tomb = np.fromiter(sorted(self._tombstones), dtype="int64", count=len(self._tombstones))
+        if len(tomb):
+            batch = faiss.IDSelectorBatch(tomb)
+            self._tomb_sel = faiss.IDSelectorNot(batch)
+            self._tomb_sel.referenced = batch  # keep the wrapped selector alive
+        else:
+            self._tomb_sel = None
+        self._dead_masks = [self._dead_mask(ids, tomb) for ids in self._block_ids]
+        self._filter_cache = {}
+
+    def _tombstone_docs(self, doc_ids) -> int:
+        """Mark the chunks of ``doc_ids`` dead (``tombstones.npy``); searches
+        exclude them through an ``IDSelector`` until :meth:`compact`."""
+        dead = []
+        for doc_id in doc_ids:
+            dead += self._doc_chunks.pop(doc_id, [])
+        if dead:
+            self._tombstones.update(dead)
+            if self._lexical is not None:
+                for cid in dead:
+                    self._lexical.remove(cid)
+            os.makedirs(self.index_dir, exist_ok=True)
+            tomb = np.array(sorted(self._tombstones), dtype="int64")
+            _write_atomic(self.tombstones_path, lambda f: np.save(f, tomb))
+            self._refresh_tombstones()
+        return len(dead)
+
+    def _delete_docs(self, doc_ids) -> int:
+        """Tombstone all chunks of ``doc_ids`` and drop their metadata."""
+        doc_ids = set(doc_ids)
+        if not doc_ids:
+            return 0
+        with self._lock:
+            removed = self._tombstone_docs(doc_ids)
+            self._docs = [d for d in self._docs if d.id not in doc_ids]
+            self._rewrite_store()
+            self._save_manifest()
+            self._maybe_compact()
+        return removed
+
+    def _maybe_compact(self):
+        """:meth:`compact` once more than ``compact_ratio`` of the rows are dead."""
+        if self._tombstones and len(self._tombstones) > self.compact_ratio * self._rows:
+            self.compact()
+
+    # ---------- metadata filters ----------
+    def _filter(self, tags: Optional[List[str]], source: Optional[str]) -> Optional[Dict]:
+        """Live chunks with any of ``tags`` and from ``source`` as
+        ``{"bits", "sel", "rows"}``; ``None`` when nothing is filtered.
+
+        Built from the per-tag / per-source posting lists and cached per
+        filter; FAISS gets it as an ``IDSelectorBitmap``, so no candidates
+        are over-fetched."""
+        tags = tuple(sorted(set(tags or [])))
+        if not tags and source is None:
+            return None
+        key = (tags, source)
+        filt = self._filter_cache.get(key)
+        if filt is not None:
+            return filt
+        nbits = self._next_chunk_id
+
+        def bitmap(ids) -> np.ndarray:
+            mask = np.zeros(nbits, dtype=bool)
+            mask[np.asarray(ids, dtype="int64")] = True
+            return mask
+
+        allowed = np.ones(nbits, dtype=bool)
+        if tags:
+            allowed &= np.logical_or.reduce([bitmap(self._postings.get(("tag", t), [])) for t in tags])
+        if source is not None:
+            allowed &= bitmap(self._postings.get(("source", source), []))
+        if self._tombstones:
+            allowed &= ~bitmap(list(self._tombstones))
+        ids = np.flatnonzero(allowed)
+        bits = np.packbits(allowed, bitorder="little")
+        sel = faiss.IDSelectorBitmap(len(bits), faiss.swig_ptr(bits))
+        sel.referenced = bits  # the selector does not own its bitmap
+        filt = {"bits": bits, "sel": sel, "rows": np.sort(self._rows_of(ids))}
+        self._filter_cache[key] = filt
+        return filt
+
+    def _load_lexical(self):
+        """Open the saved chunk BM25 index and catch it up with the live chunks.
+
+        Only chunks added or removed since the snapshot was written are
+        (un)indexed; without a snapshot every chunk is tokenised once.  The
+        result is saved again when anything changed."""
+        lexical, extra = None, {}
+        try:
+            lexical, extra = BM25Index.load(self.lexical_dir)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            LOGGER.warning("Ignoring unreadable BM25 snapshot, rebuilding: %s", e)
+        if lexical is None or extra.get("next_chunk_id", 0) > self._next_chunk_id:
+            lexical = BM25Index()  # missing, or from an index that was deleted since
+        saved = len(lexical)
+        live = (np.concatenate(self._block_ids) if self._block_ids
+                else np.zeros(0, dtype="int64"))
+        if self._tombstones:
+            live = live[~np.isin(live, list(self._tombstones))]
+        stale = np.setdiff1d(lexical.doc_ids(), live)
+        for cid in stale.tolist():
+            lexical.remove(cid)
+        added = 0
+        for ids, entries in zip(self._block_ids, self._entry_blocks()):
+            for e, cid in zip(entries, ids.tolist()):
+                if cid not in lexical and cid not in self._tombstones:
+                    lexical.add(cid, e.get("chunk", ""))
+                    added += 1
+        self._lexical = lexical
+        if added or len(stale) or not saved:
+            self._save_lexical()
+        LOGGER.info("BM25 index: %d chunks from snapshot, %d added, %d removed",
+                    saved - len(stale), added, len(stale))
+
+    def _save_lexical(self):
+        try:
+            self._lexical.save(self.lexical_dir, extra={"next_chunk_id": self._next_chunk_id})
+        except OSError as e:
+            LOGGER.warning("Could not save BM25 snapshot: %s", e)
+
+    def _entry_blocks(self) -> Iterator[List[Dict]]:
+        start = 0
+        for ids in self._block_ids:
+            yield self._entries[start:start + len(ids)]
+            start += len(ids)
+
+    def _search_rows(self, q: np.ndarray, k: int, rows: np.ndarray,
+                     batch: int = 16384) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-``k`` over the sorted global ``rows`` only, ``batch`` rows at a time."""
+        D = np.full((q.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((q.shape[0], k), -1, dtype="int64")
+        for start in range(0, len(rows), batch):
+            part = rows[start:start + batch]
+            d, i = faiss.knn(q, self._take_rows(part), min(k, len(part)),
+                             metric=faiss.METRIC_INNER_PRODUCT)
+            D = np.hstack([D, d])
+            I = np.hstack([I, np.where(i >= 0, part[np.maximum(i, 0)], -1)])
+            order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+            D = np.take_along_axis(D, order, axis=1)
+            I = np.take_along_axis(I, order, axis=1)
+        return D, I
+
+    # ---------- approximate index ----------
+    def _load_ann(self, rec: Optional[Dict]) -> bool:
+        """Activate the persisted ANN index; ``False`` if there is none usable."""
+        if (rec is None or rec.get("type") != self.index_type
+                or rec.get("codec", "fp32") != self.codec or not os.path.exists(self.ann_path)):
+            return False
+        try:
+            index = faiss.read_index(self.ann_path)
+            if not isinstance(index, faiss.IndexIDMap2):
+                raise ValueError("ANN index predates chunk ids")
+            if isinstance(faiss.downcast_index(index.index), faiss.IndexPQ):
+                raise ValueError("bare PQ index cannot skip tombstones")
+        except Exception as e:
+            LOGGER.warning("Failed to load ANN index, will retrain: %s", e)
+            return False
+        self._index = index
+        self._ann = dict(rec)
+        for block, ids in zip(self._blocks, self._block_ids):  # rows added after it was saved
+            start = int(np.searchsorted(ids, rec.get("next_id", 0)))
+            if start < len(ids):
+                index.add_with_ids(np.ascontiguousarray(block[start:]), ids[start:])
+        return True
+
+    def _trained_index_type(self) -> Optional[str]:
+        """Index type a trained index should have now (``None``: exact flat)."""
+        if self.index_type != "flat" and self._live >= self.ann_threshold:
+            return self.index_type
+        if self.codec != "fp32" and self._live >= CODEC_MIN_ROWS[self.codec]:
+            return "flat"
+        return None
+
+    def _maybe_train_ann(self, max_train: int = 200_000):
+        """Train the ANN / codec index once the store is large enough.
+
+        ``index_type`` ``"hnsw"``, ``"ivf"`` or ``"ivfpq"`` switches to
+        approximate search at ``ann_threshold`` chunks; ``codec`` ``"fp16"``,
+        ``"sq8"`` or ``"pq"`` compresses the vectors held by FAISS.  The index
+        is saved to ``ann.faiss`` and extended by later adds; it is retrained
+        once the store outgrows its PQ code size or IVF list count.  The
+        float32 segments stay on disk for rebuilds and re-scoring."""
+        with self._lock:
+            index_type = self._trained_index_type()
+            if index_type is None:
+                return
+            n = self._rows
+            factory = _ann_factory(index_type, n, self._dim, self.codec)
+            if (self._ann is not None and self._ann.get("built_as", self.index_type) == index_type
+                    and not _outgrown(self._ann["factory"], factory)):
+                return
+            prev, layout, next_id = self._ann, self._layout, self._next_chunk_id
+            blocks, block_ids = list(self._blocks), list(self._block_ids)
+        # train and fill outside the lock; searches keep using the current index
+        t0 = time.time()
+        index = faiss.IndexIDMap2(faiss.index_factory(self._dim, factory, faiss.METRIC_INNER_PRODUCT))
+        if not index.is_trained:
+            sample = np.sort(np.random.default_rng(0).choice(n, min(n, max_train), replace=False))
+            index.train(self._take_rows(sample, blocks))
+        for block, ids in zip(blocks, block_ids):
+            index.add_with_ids(np.ascontiguousarray(block), ids)
+        with self._lock:
+            if self._ann is not prev or self._layout != layout:
+                return  # retrained or compacted meanwhile
+            for block, ids in zip(self._blocks, self._block_ids):  # rows added meanwhile
+                start = int(np.searchsorted(ids, next_id))
+                if start < len(ids):
+                    index.add_with_ids(np.ascontiguousarray(block[start:]), ids[start:])
+            self._index = index
+            self._ann = {"type": self.index_type, "codec": self.codec, "built_as": index_type,
+                         "factory": factory, "trained_rows": n}
+            self._save_ann()
+        LOGGER.info("Trained %s index over %d vectors in %.1fs", factory, n, time.time() - t0)
+
+    def _save_ann(self):
+        if self._ann is None: return
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._ann["next_id"] = self._next_chunk_id
+        tmp = self.ann_path + ".tmp"
+        faiss.write_index(self._index, tmp)
+        os.replace(tmp, self.ann_path)
+        self._save_manifest()
+
+    def _search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+                       sel: Optional['faiss.IDSelector'] = None) -> Optional['faiss.SearchParameters']:
+        """FAISS search parameters; ``sel`` (already excluding tombstones)
+        replaces the tombstone selector."""
+        sel = self._tomb_sel if sel is None else sel
+        kw = {} if sel is None else {"sel": sel}
+        if self._ann is not None:
+            if faiss.try_extract_index_ivf(self._index) is not None:
+                return faiss.SearchParametersIVF(nprobe=nprobe or self.nprobe, **kw)
+            if isinstance(faiss.downcast_index(self._index.index), faiss.IndexHNSW):
+                return faiss.SearchParametersHNSW(efSearch=ef_search or self.ef_search, **kw)
+        return faiss.SearchParameters(**kw) if kw else None
+
+    def _migrate_legacy_index(self):
+        """Convert a ``knowledge_index.pkl`` file into a single segment."""
+        with open(self.index_path, "rb") as f:
+            data = pickle.load(f)
+        self._dim = data.get("dim", 384)
+        self._reset_index()
+        vectors = np.ascontiguousarray(data["vectors"], dtype="float32")
+        faiss.normalize_L2(vectors)
+        self._add_vectors(vectors, data["entries"])
+        self._save_manifest()
+        os.remove(self.index_path)
+        LOGGER.info("Migrated %s to segmented index with %d vectors",
+                    self.index_path, self._rows)
+
+    def _segment_paths(self, name: str) -> Tuple[str, str, str]:
+        base = os.path.join(self.index_dir, name)
+        return base + ".npy", base + ".jsonl", base + ".ids.npy"
+
+    def _read_segment(self, name: str) -> Tuple[np.ndarray, List[Dict], Optional[np.ndarray]]:
+        vec_path, ent_path, ids_path = self._segment_paths(name)
+        vecs = np.load(vec_path, mmap_mode="r")
+        if vecs.dtype != np.float32:
+            vecs = vecs.astype("float32")
+        with open(ent_path, "r", encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if vecs.shape[0] != len(entries):
+            raise ValueError(f"segment {name} has {vecs.shape[0]} vectors but {len(entries)} entries")
+        ids = np.load(ids_path).astype("int64") if os.path.exists(ids_path) else None
+        return vecs, entries, ids
+
+    def _new_segment_name(self) -> str:
+        with self._lock:
+            self._next_segment += 1
+            return f"seg-{self._next_segment - 1:06d}"
+
+    def _write_segment(self, vectors: np.ndarray, entries: List[Dict], ids: np.ndarray,
+                       name: Optional[str] = None) -> Tuple[Dict, np.ndarray]:
+        """Persist a segment and return its record and the re-opened mapped vectors."""
+        os.makedirs(self.index_dir, exist_ok=True)
+        name = name or self._new_segment_name()
+        vec_path, ent_path, ids_path = self._segment_paths(name)
+        _write_atomic(vec_path, lambda f: np.save(f, vectors))
+        _write_atomic(ids_path, lambda f: np.save(f, ids))
+        _write_atomic(ent_path, lambda f: f.write("".join(
+            json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")))
+        return {"name": name, "rows": int(vectors.shape[0])}, np.load(vec_path, mmap_mode="r")
+
+    def _remove_segment_files(self, name: str):
+        for p in self._segment_paths(name):
             try:
-                from sentence_transformers import SentenceTransformer
-            except ImportError as e:
-                raise RuntimeError(
-                    "sentence-transformers package is required for embeddings"
-                ) from e
-            self._model = SentenceTransformer(self.model_name)
-        return self._model
+                os.remove(p)
+            except FileNotFoundError:
+                pass
+
+    def _save_manifest(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        manifest = {
+            "version": 2,
+            "dim": self._dim,
+            "model": self.model_name,
+            "next_segment": self._next_segment,
+            "next_chunk_id": self._next_chunk_id,
+            "doc_seq": self._doc_seq,
+            "segments": self._segments,
+            "ann": self._ann,
+        }
+        _write_atomic(self.manifest_path,
+                      lambda f: f.write(json.dumps(manifest, indent=1).encode("utf-8")))
+
+    def _merge_segments(self, first: int, drop_dead: bool = False) -> List[str]:
+        """Merge segments ``first..end`` into one, optionally dropping tombstoned
+        rows; return names of the replaced files."""
+        has_dead = drop_dead and any(m is not None for m in self._dead_masks[first:])
+        if len(self._segments) - first < 2 and not has_dead:
+            return []
+        start = sum(rec["rows"] for rec in self._segments[:first])
+        vectors = np.concatenate(self._blocks[first:])
+        ids = np.concatenate(self._block_ids[first:])
+        entries = self._entries[start:]
+        masks = [m if m is not None else np.zeros(len(i), bool)
+                 for m, i in zip(self._dead_masks[first:], self._block_ids[first:])]
+        dead = np.concatenate(masks)
+        if has_dead:
+            self._layout += 1
+            keep = ~dead
+            self._tombstones.difference_update(ids[dead].tolist())
+            vectors, ids = np.ascontiguousarray(vectors[keep]), ids[keep]
+            entries = [e for e, k in zip(entries, keep.tolist()) if k]
+            dead = np.zeros(len(ids), bool)
+        old = [r["name"] for r in self._segments[first:]]
+        if len(ids):
+            rec, mapped = self._write_segment(vectors, entries, ids)
+            self._segments[first:] = [rec]
+            self._blocks[first:] = [mapped]
+            self._block_ids[first:] = [ids]
+            self._dead_masks[first:] = [dead if dead.any() else None]
+        else:
+            del self._segments[first:], self._blocks[first:], self._block_ids[first:], self._dead_masks[first:]
+        self._entries[start:] = entries
+        return old
+
+    def _maybe_merge(self):
+        """Fold the tail segments into their predecessor while the tail is at
+        least ``1/merge_factor`` of its size, so an add costs amortised
+        ``O(new * log N)``.
+
+        The merged segment is written without holding ``_lock`` and swapped
+        in afterwards; a compaction or rebuild in between discards it."""
+        with self._lock:
+            rows = [rec["rows"] for rec in self._segments]
+            first, tail = len(rows) - 1, rows[-1] if rows else 0
+            while first > 0 and rows[first - 1] <= tail * self.merge_factor:
+                first -= 1
+                tail += rows[first]
+            if first >= len(rows) - 1:
+                return
+            records = self._segments[first:]
+            blocks, block_ids = self._blocks[first:], self._block_ids[first:]
+            start = sum(rows[:first])
+            entries = self._entries[start:start + tail]
+            name = self._new_segment_name()
+        ids = np.concatenate(block_ids)
+        rec, mapped = self._write_segment(np.concatenate(blocks), entries, ids, name)
+        with self._lock:
+            end = first + len(records)
+            if any(a is not b for a, b in zip_longest(self._segments[first:end], records)):
+                self._remove_segment_files(name)
+                return
+            masks = [m if m is not None else np.zeros(len(i), bool)
+                     for m, i in zip(self._dead_masks[first:end], block_ids)]
+            dead = np.concatenate(masks)
+            self._segments[first:end] = [rec]
+            self._blocks[first:end] = [mapped]
+            self._block_ids[first:end] = [ids]
+            self._dead_masks[first:end] = [dead if dead.any() else None]
+            self._save_manifest()
+        for old in records:
+            self._remove_segment_files(old["name"])
+
+    def compact(self) -> Dict[str, int]:
+        """Merge all segments into one, dropping tombstoned chunks, and persist
+        the manifest (and ANN index).
+
+        A trained index whose quantizer / codebooks were fitted on less than a
+        quarter of the current rows, or that is sized for another row count
+        (see :meth:`_maybe_train_ann`), is retrained from scratch.
+        """
+        with self._lock:
+            purged = bool(self._tombstones)
+            old = self._merge_segments(0, drop_dead=True)
+            if purged:
+                self._tombstones = set()
+                self._refresh_tombstones()
+                if os.path.exists(self.tombstones_path):
+                    os.remove(self.tombstones_path)
+                self._postings = {}
+                if self._block_ids:
+                    self._index_postings(self._entries, np.concatenate(self._block_ids))
+            if self._ann is not None and (
+                    (self._ann["factory"] != "HNSW32"
+                     and self._ann.get("trained_rows", 0) * 4 <= self._rows)
+                    or _outgrown(self._ann["factory"], _ann_factory(
+                        self._ann.get("built_as", self.index_type), self._rows, self._dim,
+                        self.codec))):
+                self._ann = None
+                self._maybe_train_ann()
+                if self._ann is None:
+                    self._rebuild_index()
+            elif purged:
+                self._rebuild_index()
+            elif self._ann is not None:
+                self._save_ann()
+            self._save_manifest()
+            self._save_lexical()
+            for name in old:
+                self._remove_segment_files(name)
+            return {"segments": len(self._segments), "vectors": self._rows}
+
+    def _embedder(self) -> 'SentenceTransformer':
+        return get_model(self.model_name)
 
     def _embed(self, texts: List[str]) -> np.ndarray:
         if not texts: return np.zeros((0, self._dim), dtype="float32")
@@ -123,169 +939,593 @@ class KnowledgeStore:
             vecs = np.array(vecs)
         return vecs.astype("float32")
 
-    def _add_vectors(self, vectors: np.ndarray, entries: List[Dict]):
+    def _add_vectors(self, vectors: np.ndarray, entries: List[Dict], maintain: bool = True):
         if vectors.size == 0: return
-        if self._vectors is None or self._vectors.shape[0] == 0:
-            self._vectors = vectors
-            self._entries = entries
-            self._index = faiss.IndexFlatIP(vectors.shape[1])
-            self._index.add(vectors)
-        else:
-            self._vectors = np.vstack([self._vectors, vectors])
-            self._entries.extend(entries)
-            self._index.add(vectors)
-        self._save_index()
+        vectors = np.array(vectors, dtype="float32", order="C")
+        faiss.normalize_L2(vectors)
+        with self._lock:
+            if self._rows == 0 and not self._tombstones:
+                self._dim = vectors.shape[1]
+                self._reset_index()
+            ids = np.arange(self._next_chunk_id, self._next_chunk_id + len(entries), dtype="int64")
+            self._next_chunk_id += len(entries)
+            rec, mapped = self._write_segment(vectors, entries, ids)
+            self._append_block(rec, mapped, ids, entries)
+            if self._index is not None:
+                self._index.add_with_ids(vectors, ids)
+            self._save_manifest()
+        if maintain:
+            self._maintain()
+
+    def _maintain(self):
+        """Train the ANN index and merge segments as due after an add.
+
+        Both do their heavy work outside ``_lock``, so searches are not held
+        up.  Skipped while another thread is at it; the next add catches up."""
+        if not self._maint_lock.acquire(blocking=False):
+            return
+        try:
+            self._maybe_train_ann()
+            self._maybe_merge()
+        finally:
+            self._maint_lock.release()
+
+    def _search_vectors(self, q: np.ndarray, k: int,
+                        params: Optional['faiss.SearchParameters'] = None,
+                        rescore: int = 0) -> Tuple[np.ndarray, np.ndarray]:
+        """Return ``(scores, rows)`` of the ``k`` best live rows for each query vector.
+
+        With a trained index and ``rescore > 1`` the best ``k * rescore``
+        candidates are re-ranked by their exact float32 inner product.
+        """
+        if self._index is not None:
+            if self._ann is None or rescore <= 1:
+                D, labels = self._index.search(q, k, params=params)
+                return D, self._rows_of(labels)
+            _, labels = self._index.search(q, min(k * rescore, self._live), params=params)
+            return self._rescore(q, self._rows_of(labels), k)
+        # mmap mode: scan each mapped segment and merge the per-segment top-k;
+        # segments with tombstones are over-fetched by their number of dead rows
+        D = np.full((q.shape[0], k), -np.inf, dtype="float32")
+        I = np.full((q.shape[0], k), -1, dtype="int64")
+        offset = 0
+        for block, dead in zip(self._blocks, self._dead_masks):
+            n = block.shape[0]
+            extra = int(dead.sum()) if dead is not None else 0
+            d, i = faiss.knn(q, block, min(k + extra, n), metric=faiss.METRIC_INNER_PRODUCT)
+            if dead is not None:
+                drop = (i < 0) | dead[np.maximum(i, 0)]
+                d[drop] = -np.inf
+                i[drop] = -1
+            D = np.hstack([D, d])
+            I = np.hstack([I, np.where(i >= 0, i + offset, -1)])
+            order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+            D = np.take_along_axis(D, order, axis=1)
+            I = np.take_along_axis(I, order, axis=1)
+            offset += n
+        return D, I
+
+    def _rescore(self, q: np.ndarray, rows: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact scores of candidate ``rows`` from the float32 segments; keep the top ``k``."""
+        found = rows >= 0
+        uniq = np.unique(rows[found])
+        vecs = self._take_rows(uniq)
+        D = np.full(rows.shape, -np.inf, dtype="float32")
+        if len(uniq):
+            cand = vecs[np.searchsorted(uniq, np.where(found, rows, uniq[0]))]
+            D = np.where(found, np.einsum("qd,qcd->qc", q, cand), -np.inf).astype("float32")
+        order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(rows, order, axis=1)
 
     # ---------- public API ----------
     def add_manual(self, title: str, content: str, tags: Optional[List[str]] = None) -> Tuple[str,int]:
-        doc_id = f"doc-{len(self._docs)+1}"
+        doc_id = self._new_doc_id()
         meta = DocMeta(id=doc_id, title=title or "(bez názvu)", source="manual", tags=tags or [])
         self._save_doc(meta)
+        return doc_id, self._add_chunks(meta, _iter_text_chunks(content))
+
+    def _add_chunks(self, meta: DocMeta, chunks: Iterable[str], extra: Optional[Dict] = None) -> int:
+        """Embed and index the ``chunks`` of the saved document ``meta``
+        ``EMBED_BATCH`` at a time; returns their number.  If the stream fails
+        the partially indexed document is deleted again."""
+        chunks = iter(chunks)
+        n = 0
+        try:
+            while True:
+                batch = list(islice(chunks, self.EMBED_BATCH))
+                if not batch:
+                    return n
+                entries = [ {"doc_id": meta.id, "title": meta.title, "source": meta.source,
+                             "tags": meta.tags, "chunk": c, **(extra or {})} for c in batch ]
+                self._add_vectors(self._embed(batch), entries)
+                n += len(batch)
+        except Exception:
+            self._delete_docs([meta.id])
+            raise
+
+    def delete_doc(self, doc_id: str) -> int:
+        """Remove document ``doc_id``; returns the number of chunks tombstoned.
+
+        Raises ``KeyError`` for unknown ids."""
+        with self._lock:
+            self._get_doc(doc_id)
+            return self._delete_docs([doc_id])
+
+    def _doc_origin(self, doc_id: str) -> Dict:
+        """The ``url``/``file`` fields the chunks of ``doc_id`` carry."""
+        chunk_ids = self._doc_chunks.get(doc_id)
+        if not chunk_ids:
+            return {}
+        row = int(self._rows_of(np.array(chunk_ids[:1], dtype="int64"))[0])
+        if not 0 <= row < len(self._entries):
+            return {}
+        entry = self._entries[row]
+        return {k: entry[k] for k in ("url", "file") if k in entry}
+
+    def update_doc(self, doc_id: str, content: str, title: Optional[str] = None,
+                   tags: Optional[List[str]] = None) -> Tuple[str, int]:
+        """Replace the content (and optionally title/tags) of ``doc_id`` keeping its id
+        and origin (``url``/``file``).
+
+        Raises ``KeyError`` for unknown ids."""
+        meta = self._get_doc(doc_id)
         chunks = _chunk_text(content or "")
         vecs = self._embed(chunks)
-        entries = [ {"doc_id": doc_id, "title": meta.title, "source": meta.source,
-                     "tags": meta.tags, "chunk": c} for c in chunks ]
-        self._add_vectors(vecs, entries)
+        with self._lock:
+            meta = self._get_doc(doc_id)
+            origin = self._doc_origin(doc_id)
+            self._tombstone_docs([doc_id])
+            if title:
+                meta.title = title
+            if tags is not None:
+                meta.tags = tags
+            self._rewrite_store()
+            entries = [ {"doc_id": doc_id, "title": meta.title, "source": meta.source,
+                         "tags": meta.tags, "chunk": c, **origin} for c in chunks ]
+            self._add_vectors(vecs, entries, maintain=False)
+            self._save_manifest()
+            self._maybe_compact()
+        self._maintain()
         return doc_id, len(chunks)
 
-    def _fetch_url(self, url: str, timeout=15) -> Tuple[str, bytes]:
+    def _fetch_url(self, url: str, timeout=15) -> Tuple[str, IO[bytes]]:
+        """Download ``url`` into a spooled temporary file (rewound); the caller
+        closes it.  Raises :class:`DocumentTooLarge` past ``max_doc_bytes``."""
         try:
             import requests
         except ImportError as e:
             raise RuntimeError("requests package is required to fetch URLs") from e
         headers = {"User-Agent":"Mozilla/5.0 (compatible; FuraBot/1.0; +https://jarvik-ai.tech)"}
-        r = requests.get(url, headers=headers, timeout=timeout, allow_redirects=True)
-        ctype = (r.headers.get("content-type") or "").lower()
-        return ctype, r.content
+        with requests.get(url, headers=headers, timeout=timeout, allow_redirects=True,
+                          stream=True) as r:
+            ctype = (r.headers.get("content-type") or "").lower()
+            length = r.headers.get("content-length") or ""
+            if length.isdigit():
+                _check_size(int(length), self.max_doc_bytes, url)
+            body = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+            try:
+                size = 0
+                for block in r.iter_content(READ_SIZE):
+                    size += len(block)
+                    _check_size(size, self.max_doc_bytes, url)
+                    body.write(block)
+            except Exception:
+                body.close()
+                raise
+        body.seek(0)
+        return ctype, body
 
     def add_from_url(self, url: str) -> Tuple[str,int]:
+        """Download and index ``url`` (HTML or PDF).  Raises
+        :class:`DocumentTooLarge` past ``max_doc_bytes``."""
         ctype, body = self._fetch_url(url)
-        text = ""
-        title = url
-        if "pdf" in ctype or url.lower().endswith(".pdf"):
-            try:
-                from pdfminer.high_level import extract_text as pdfminer_extract
-                text = pdfminer_extract(io.BytesIO(body))
-            except Exception:
-                try:
-                    from PyPDF2 import PdfReader
-                    rd = PdfReader(io.BytesIO(body))
-                    text = "\n".join([p.extract_text() or "" for p in rd.pages])
-                except Exception as e:
-                    raise RuntimeError(
-                        "PDF parsing requires pdfminer.six or PyPDF2"
-                    ) from e
-        else:
-            html = body.decode("utf-8", errors="ignore")
-            try:
-                from bs4 import BeautifulSoup
-            except ImportError:
-                title_match = re.search(r"<title>(.*?)</title>", html, re.IGNORECASE | re.DOTALL)
-                if title_match:
-                    title = title_match.group(1).strip()
-                text = re.sub(r"<[^>]+>", " ", html)
+        with body:
+            title = url
+            if "pdf" in ctype or url.lower().endswith(".pdf"):
+                text = _iter_pdf_pages(body)
             else:
-                soup = BeautifulSoup(html, "html.parser")
-                title_tag = soup.find("title")
-                if title_tag: title = title_tag.text.strip()
-                for bad in soup(["script","style","noscript"]):
-                    bad.decompose()
-                text = (soup.get_text(" ") or "").strip()
-        doc_id = f"doc-{len(self._docs)+1}"
-        meta = DocMeta(id=doc_id, title=title or url, source="url", tags=["web"])
-        self._save_doc(meta)
-        chunks = _chunk_text(text)
-        vecs = self._embed(chunks)
-        entries = [ {"doc_id": doc_id, "title": meta.title, "source": meta.source,
-                     "tags": meta.tags, "chunk": c, "url": url} for c in chunks ]
-        self._add_vectors(vecs, entries)
-        return doc_id, len(chunks)
+                html = body.read().decode("utf-8", errors="ignore")
+                try:
+                    from bs4 import BeautifulSoup
+                except ImportError:
+                    title_match = re.search(r"<title>(.*?)</title>", html, re.IGNORECASE | re.DOTALL)
+                    if title_match:
+                        title = title_match.group(1).strip()
+                    text = re.sub(r"<[^>]+>", " ", html)
+                else:
+                    soup = BeautifulSoup(html, "html.parser")
+                    title_tag = soup.find("title")
+                    if title_tag: title = title_tag.text.strip()
+                    for bad in soup(["script","style","noscript"]):
+                        bad.decompose()
+                    text = (soup.get_text(" ") or "").strip()
+            doc_id = self._new_doc_id()
+            meta = DocMeta(id=doc_id, title=title or url, source="url", tags=["web"])
+            self._save_doc(meta)
+            return doc_id, self._add_chunks(meta, _iter_text_chunks(text), {"url": url})
 
     def add_from_file(self, path: str, title: Optional[str]=None, tags: Optional[List[str]]=None) -> Tuple[str,int]:
+        """Index a local file, PDFs page by page.  Raises
+        :class:`DocumentTooLarge` past ``max_doc_bytes``."""
         path = os.path.abspath(path)
         base = os.path.basename(path)
-        text = ""
-        if base.lower().endswith(".pdf"):
-            try:
-                from pdfminer.high_level import extract_text as pdfminer_extract
-                text = pdfminer_extract(path)
-            except Exception:
-                try:
-                    from PyPDF2 import PdfReader
-                    rd = PdfReader(path)
-                    text = "\n".join([p.extract_text() or "" for p in rd.pages])
-                except Exception as e:
-                    raise RuntimeError(
-                        "PDF parsing requires pdfminer.six or PyPDF2"
-                    ) from e
-        else:
-            with open(path, "r", encoding="utf-8", errors="ignore") as f:
-                text = f.read()
-        doc_id = f"doc-{len(self._docs)+1}"
+        _check_size(os.path.getsize(path), self.max_doc_bytes, path)
+        doc_id = self._new_doc_id()
         meta = DocMeta(id=doc_id, title=title or base, source="file", tags=tags or [])
         self._save_doc(meta)
-        chunks = _chunk_text(text)
-        vecs = self._embed(chunks)
-        entries = [ {"doc_id": doc_id, "title": meta.title, "source": meta.source,
-                     "tags": meta.tags, "chunk": c, "file": base} for c in chunks ]
-        self._add_vectors(vecs, entries)
-        return doc_id, len(chunks)
+        return doc_id, self._add_chunks(meta, _iter_text_chunks(_iter_file_text(path)), {"file": base})
+
+    def _folder_files(self, folder: str) -> List[str]:
+        paths = []
+        for root_dir, dirs, files in os.walk(folder):
+            dirs.sort()
+            for name in sorted(files):
+                if name.lower().endswith(FOLDER_EXTS):
+                    paths.append(os.path.join(root_dir, name))
+        return paths
+
+    def _ingest_files(self, paths: List[str], workers: Optional[int] = None, batch_size: int = 256,
+                      progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, Tuple[str, int]]:
+        """Pipelined ingestion of ``paths``; returns ``{path: (doc_id, chunks)}``.
 
-    def reindex_folder(self, folder: str) -> Dict[str, int]:
+        Text extraction and chunking run in a pool of ``workers`` processes
+        while this process encodes chunks in batches of ``batch_size``; all
+        documents are committed as a single segment at the end.  ``progress``
+        is called with the running statistics after each file and the final
+        ones (incl. docs/sec and chunks/sec) are kept in :attr:`last_ingest`.
+        Files that fail to parse are logged and skipped."""
+        if workers is None:
+            workers = min(4, os.cpu_count() or 1)
+        t0 = time.time()
+        stats = {"files": len(paths), "docs": 0, "chunks": 0, "errors": 0}
+        done: Dict[str, Tuple[str, int]] = {}
+        metas: List[DocMeta] = []
+        entries: List[Dict] = []
+        vec_parts: List[np.ndarray] = []
+        pending: List[str] = []
+
+        def report():
+            elapsed = max(time.time() - t0, 1e-9)
+            stats.update(elapsed=round(elapsed, 3),
+                         docs_per_sec=round(stats["docs"] / elapsed, 2),
+                         chunks_per_sec=round(stats["chunks"] / elapsed, 2))
+            if progress is not None:
+                progress(dict(stats))
+
+        pool = (ProcessPoolExecutor(max_workers=workers, mp_context=_pool_context())
+                if workers > 1 and len(paths) > 1 else None)
+        try:
+            work = partial(_extract_and_chunk, max_bytes=self.max_doc_bytes)
+            results = pool.map(work, paths, chunksize=4) if pool else map(work, paths)
+            for path, chunks, error in results:
+                if error is not None:
+                    LOGGER.warning("Skipping %s: %s", path, error)
+                    stats["errors"] += 1
+                    report()
+                    continue
+                base = os.path.basename(path)
+                meta = DocMeta(id=self._new_doc_id(), title=base, source="file", tags=[])
+                metas.append(meta)
+                entries.extend({"doc_id": meta.id, "title": meta.title, "source": meta.source,
+                                "tags": meta.tags, "chunk": c, "file": base} for c in chunks)
+                done[path] = (meta.id, len(chunks))
+                pending.extend(chunks)
+                while len(pending) >= batch_size:
+                    batch = pending[:batch_size]
+                    del pending[:batch_size]
+                    vec_parts.append(self._embed(batch))
+                stats["docs"] += 1
+                stats["chunks"] += len(chunks)
+                report()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        if pending:
+            vec_parts.append(self._embed(pending))
+
+        with self._lock:
+            for meta in metas:
+                self._save_doc(meta)
+        if vec_parts:
+            self._add_vectors(np.concatenate(vec_parts), entries)
+        report()
+        self.last_ingest = dict(stats)
+        LOGGER.info("Indexed %d docs / %d chunks in %.1fs (%.1f docs/s, %.1f chunks/s)",
+                    stats["docs"], stats["chunks"], stats["elapsed"],
+                    stats["docs_per_sec"], stats["chunks_per_sec"])
+        return done
+
+    def reindex_folder(self, folder: str, workers: Optional[int] = None, batch_size: int = 256,
+                       progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
         """Index all supported files from ``folder`` and append them to the current
         store without clearing existing data.  This can lead to duplicates when
-        called repeatedly.  Use :meth:`rebuild_folder` to perform a clean
-        rebuild."""
+        called repeatedly.  Use :meth:`sync_folder` for incremental updates or
+        :meth:`rebuild_folder` to perform a clean rebuild.  See
+        :meth:`_ingest_files` for ``workers``, ``batch_size`` and ``progress``."""
         folder = os.path.abspath(folder)
         os.makedirs(folder, exist_ok=True)
-        added_docs = 0
-        added_chunks = 0
-        for root_dir, _, files in os.walk(folder):
-            for name in files:
-                if not any(name.lower().endswith(ext) for ext in (".md", ".txt", ".pdf")):
-                    continue
-                p = os.path.join(root_dir, name)
-                doc_id, n = self.add_from_file(p)
-                added_docs += 1
-                added_chunks += n
-        return {"docs": added_docs, "chunks": added_chunks}
+        done = self._ingest_files(self._folder_files(folder), workers, batch_size, progress)
+        return {"docs": len(done), "chunks": sum(n for _, n in done.values())}
 
-    def rebuild_folder(self, folder: str) -> Dict[str, int]:
+    def rebuild_folder(self, folder: str,
+                       progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
         """Clear existing documents and vectors and rebuild the store from the
         contents of ``folder``.  The updated store and index are persisted even
-        if ``folder`` is empty."""
+        if ``folder`` is empty.  ``progress`` as for :meth:`_ingest_files`."""
         folder = os.path.abspath(folder)
         os.makedirs(folder, exist_ok=True)
-        # reset in-memory structures
-        self._docs = []
-        self._vectors = np.zeros((0, self._dim), dtype="float32")
-        self._entries = []
-        self._index = faiss.IndexFlatIP(self._dim)
-        # remove existing persisted files
-        for p in (self.store_path, self.index_path):
-            if os.path.exists(p):
-                os.remove(p)
-        open(self.store_path, "w", encoding="utf-8").close()
+        with self._sync_lock:
+            with self._lock:
+                # reset in-memory structures
+                self._docs = []
+                old = [rec["name"] for rec in self._segments]
+                self._reset_index()
+                # remove existing persisted files
+                for name in old:
+                    self._remove_segment_files(name)
+                for p in (self.store_path, self.index_path, self.manifest_path, self.ann_path,
+                          self.sources_path, self.tombstones_path):
+                    if os.path.exists(p):
+                        os.remove(p)
+                open(self.store_path, "w", encoding="utf-8").close()
+
+            paths = self._folder_files(folder)
+            done = self._ingest_files(paths, progress=progress)
+            sources = {}
+            for path in paths:
+                if path in done:
+                    sources[os.path.relpath(path, folder)] = self._source_record(path, *done[path])
+            self._save_sources(sources)
+            # ensure a manifest exists even when there are no documents
+            self._save_manifest()
+            with self._lock:
+                self._save_lexical()
+        return {"docs": len(done), "chunks": sum(n for _, n in done.values())}
+
+    # ---------- incremental folder sync ----------
+    def _load_sources(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.sources_path):
+            return {}
+        with open(self.sources_path, "r", encoding="utf-8") as f:
+            return json.load(f)
 
-        res = self.reindex_folder(folder)
-        # ensure an index file exists even when there are no documents
-        self._save_index()
+    def _save_sources(self, sources: Dict[str, Dict]):
+        os.makedirs(self.index_dir, exist_ok=True)
+        _write_atomic(self.sources_path, lambda f: f.write(
+            json.dumps(sources, ensure_ascii=False, indent=1).encode("utf-8")))
+
+    @staticmethod
+    def _file_hash(path: str) -> str:
+        h = hashlib.sha256()
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        return h.hexdigest()
+
+    def _source_record(self, path: str, doc_id: str, chunks: int, digest: Optional[str] = None) -> Dict:
+        st = os.stat(path)
+        return {"hash": digest or self._file_hash(path), "mtime": st.st_mtime, "size": st.st_size,
+                "doc_id": doc_id, "chunks": chunks}
+
+    def _seed_sources(self, current: Dict[str, str]) -> Dict[str, Dict]:
+        """Source records for a store indexed before ``sources.json`` existed.
+
+        Every file of ``current`` (relative path -> path) whose name is carried
+        by exactly one ``file`` document, and by no other file of the folder,
+        is taken to be that document's source as it is now."""
+        by_name: Dict[str, List[str]] = {}
+        with self._lock:
+            for meta in self._docs:
+                if meta.source == "file":
+                    name = self._doc_origin(meta.id).get("file")
+                    if name:
+                        by_name.setdefault(name, []).append(meta.id)
+            chunk_counts = {doc_id: len(ids) for doc_id, ids in self._doc_chunks.items()}
+        names = [os.path.basename(rel) for rel in current]
+        sources = {}
+        for rel, path in current.items():
+            name = os.path.basename(rel)
+            doc_ids = by_name.get(name, [])
+            if len(doc_ids) == 1 and names.count(name) == 1:
+                sources[rel] = self._source_record(path, doc_ids[0], chunk_counts.get(doc_ids[0], 0))
+        LOGGER.info("Seeded %d of %d source records from indexed documents",
+                    len(sources), len(current))
+        return sources
+
+    def sync_folder(self, folder: str, workers: Optional[int] = None, batch_size: int = 256,
+                    progress: Optional[Callable[[Dict], None]] = None) -> Dict[str, int]:
+        """Bring the store in line with ``folder`` touching only what changed.
+
+        ``knowledge_index/sources.json`` maps every indexed file (relative
+        path) to its content hash and document id.  Files whose size and mtime
+        are unchanged are skipped without being read; the rest are hashed and
+        only new or modified ones are re-embedded.  Documents of deleted or
+        modified files are removed from the index first.  A store without
+        ``sources.json`` (built before it existed) is seeded from its
+        ``file`` documents (:meth:`_seed_sources`) instead of re-ingesting
+        the whole folder next to them."""
+        folder = os.path.abspath(folder)
+        os.makedirs(folder, exist_ok=True)
+        with self._sync_lock:
+            current = {os.path.relpath(p, folder): p for p in self._folder_files(folder)}
+            if os.path.exists(self.sources_path):
+                sources = self._load_sources()
+            else:
+                sources = self._seed_sources(current)
+            to_ingest: Dict[str, str] = {}     # rel -> content hash
+            unchanged = 0
+            for rel, path in current.items():
+                rec = sources.get(rel)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                if rec and rec["size"] == st.st_size and rec["mtime"] == st.st_mtime:
+                    unchanged += 1
+                    continue
+                digest = self._file_hash(path)
+                if rec and rec["hash"] == digest:
+                    rec.update(mtime=st.st_mtime, size=st.st_size)
+                    unchanged += 1
+                    continue
+                to_ingest[rel] = digest
+            deleted = [rel for rel in sources if rel not in current]
+            stale = {sources[rel]["doc_id"] for rel in deleted + list(to_ingest) if rel in sources}
+            removed_chunks = self._delete_docs(stale)
+            added = sum(1 for rel in to_ingest if rel not in sources)
+            for rel in deleted:
+                del sources[rel]
+
+            done = self._ingest_files([current[rel] for rel in to_ingest], workers, batch_size, progress)
+            chunks = 0
+            for rel, digest in to_ingest.items():
+                path = current[rel]
+                if path in done:
+                    sources[rel] = self._source_record(path, *done[path], digest=digest)
+                    chunks += done[path][1]
+                else:
+                    sources.pop(rel, None)
+            self._save_sources(sources)
+        res = {"added": added, "updated": len(to_ingest) - added, "removed": len(deleted),
+               "unchanged": unchanged, "chunks": chunks, "removed_chunks": removed_chunks}
+        if to_ingest or deleted:
+            LOGGER.info("Synced %s: %s", folder, res)
         return res
 
-    def search(self, query: str, top_k=5) -> List[Dict]:
-        if not query.strip() or self._index is None or self._vectors.shape[0] == 0:
-            return []
-        q = self._embed([query])
-        D, I = self._index.search(q, min(top_k, self._vectors.shape[0]))
-        out = []
-        for score, idx in zip(D[0].tolist(), I[0].tolist()):
-            if idx < 0 or idx >= len(self._entries): continue
-            e = self._entries[idx]
-            out.append({
-                "title": e.get("title") or "(bez názvu)",
-                "source": e.get("source") or "",
-                "tags": e.get("tags") or [],
-                "score": float(score),
-                "snippet": e.get("chunk","")[:450]
-            })
+    def watch_folder(self, folder: str, interval: float = 5.0) -> threading.Event:
+        """Run :meth:`sync_folder` every ``interval`` seconds in a daemon thread.
+
+        A sync of an unchanged folder only stats its files, so polling is
+        cheap.  Syncing starts once the store is :attr:`ready`.  Set the
+        returned event to stop watching."""
+        stop = threading.Event()
+
+        def loop():
+            while not stop.wait(interval):
+                if not self.ready.is_set():
+                    continue
+                try:
+                    self.sync_folder(folder)
+                except Exception:
+                    LOGGER.exception("Knowledge folder sync failed")
+
+        threading.Thread(target=loop, name="knowledge-watch", daemon=True).start()
+        return stop
+
+    def search(self, query: str, top_k=5, nprobe: Optional[int] = None,
+               ef_search: Optional[int] = None, rescore: Optional[int] = None,
+               tags: Optional[List[str]] = None, source: Optional[str] = None) -> List[Dict]:
+        """Return the ``top_k`` chunks closest to ``query``.
+
+        ``nprobe`` and ``ef_search`` override the store defaults for IVF and
+        HNSW indexes; they are ignored while the exact flat index is used.
+        ``rescore`` overrides the float32 re-score factor (``0`` disables it).
+        ``tags`` keeps chunks carrying any of the given tags and ``source``
+        (``"manual"``, ``"url"`` or ``"file"``) chunks of that origin;
+        filters matching at most ``FILTER_SCAN_ROWS`` chunks (all of them with
+        ``mmap``) are answered by an exact scan of those rows.
+        """
+        return self.search_many([query], top_k, nprobe=nprobe, ef_search=ef_search,
+                                rescore=rescore, tags=tags, source=source)[0]
+
+    def search_many(self, queries: List[str], top_k=5, nprobe: Optional[int] = None,
+                    ef_search: Optional[int] = None, rescore: Optional[int] = None,
+                    tags: Optional[List[str]] = None,
+                    source: Optional[str] = None) -> List[List[Dict]]:
+        """Batched :meth:`search`: one ``encode`` call and one index search.
+
+        Query vectors go through the shared :mod:`embeddings` cache, so only
+        queries not seen recently reach the model; with ``query_batch`` set
+        those misses are merged with concurrent searches into one encode.
+
+        Returns one hit list per query, in order; blank queries get ``[]``.
+        """
+        out: List[List[Dict]] = [[] for _ in queries]
+        todo = [i for i, q in enumerate(queries) if (q or "").strip()]
+        if not todo or self._live == 0:
+            return out
+        encode = self._batcher.encode if self._batcher is not None else self._embed
+        q = encode_cached(self.model_name, [queries[i] for i in todo], encode)
+        with self._lock:
+            if self._live == 0:
+                return out
+            filt = self._filter(tags, source)
+            if filt is not None and not len(filt["rows"]):
+                return out
+            D, I = self._dense(q, top_k, filt, nprobe, ef_search, rescore)
+            for qi, scores, rows in zip(todo, D.tolist(), I.tolist()):
+                out[qi] = [self._hit(score, idx) for score, idx in zip(scores, rows)
+                           if 0 <= idx < len(self._entries)]
         return out
+
+    def _dense(self, q: np.ndarray, top_k: int, filt: Optional[Dict],
+               nprobe: Optional[int] = None, ef_search: Optional[int] = None,
+               rescore: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Vector top-``k`` rows for the query matrix ``q`` within ``filt``."""
+        rescore = self.rescore if rescore is None else rescore
+        if filt is None:
+            return self._search_vectors(q, min(top_k, self._live),
+                                        self._search_params(nprobe, ef_search), rescore)
+        if self._index is None or len(filt["rows"]) <= self.FILTER_SCAN_ROWS:
+            return self._search_rows(q, min(top_k, len(filt["rows"])), filt["rows"])
+        return self._search_vectors(q, min(top_k, len(filt["rows"])),
+                                    self._search_params(nprobe, ef_search, filt["sel"]), rescore)
+
+    def hybrid_search(self, query: str, top_k: int = 5, candidates: Optional[int] = None,
+                      tags: Optional[List[str]] = None,
+                      source: Optional[str] = None) -> List[Dict]:
+        """Rank chunks by BM25 and by vector similarity and fuse both lists.
+
+        The best ``candidates`` chunks of each ranking (``HYBRID_CANDIDATES``
+        by default) are combined with reciprocal rank fusion,
+        ``score = sum(1 / (RRF_K + rank))``, so a chunk found by both
+        retrievers outranks one found by a single retriever.  Hits carry the
+        fused ``score`` and their ``ranks`` (1-based, ``None`` when absent)
+        in each list.  Without an embedding model the BM25 ranking is used
+        alone.  ``tags`` and ``source`` filter as in :meth:`search`.
+        """
+        if not (query or "").strip() or self._live == 0:
+            return []
+        cand = max(top_k, candidates or self.HYBRID_CANDIDATES)
+        try:
+            encode = self._batcher.encode if self._batcher is not None else self._embed
+            q = encode_cached(self.model_name, [query], encode)
+        except RuntimeError as e:
+            LOGGER.warning("Vector search unavailable, ranking by BM25 only: %s", e)
+            q = None
+        with self._lock:
+            if self._live == 0:
+                return []
+            filt = self._filter(tags, source)
+            if filt is not None and not len(filt["rows"]):
+                return []
+            ranks: Dict[int, Dict[str, Optional[int]]] = {}
+            if q is not None:
+                rows = [r for r in self._dense(q, cand, filt)[1][0].tolist() if r >= 0]
+                for rank, row in enumerate(rows, 1):
+                    ranks[row] = {"vector": rank, "bm25": None}
+            if filt is None:
+                ids, scores = self._lexical.top_k(query, cand)
+            else:
+                ids, scores = self._lexical.scores(query)
+                keep = ((filt["bits"][ids >> 3] >> (ids & 7)) & 1).astype(bool)
+                ids, scores = select_top_k(ids[keep], scores[keep], cand)
+            for rank, row in enumerate(self._rows_of(ids).tolist(), 1):
+                ranks.setdefault(row, {"vector": None, "bm25": None})["bm25"] = rank
+            fused = sorted(
+                ((sum(1.0 / (self.RRF_K + r) for r in rr.values() if r), row)
+                 for row, rr in ranks.items() if 0 <= row < len(self._entries)),
+                key=lambda p: (-p[0], p[1]),
+            )[:top_k]
+            return [dict(self._hit(score, row), ranks=ranks[row]) for score, row in fused]
+
+    def _hit(self, score: float, idx: int) -> Dict:
+        e = self._entries[idx]
+        return {
+            "doc_id": e.get("doc_id") or "",
+            "title": e.get("title") or "(bez názvu)",
+            "source": e.get("source") or "",
+            "tags": e.get("tags") or [],
+            "score": float(score),
+            "snippet": e.get("chunk","")[:450]
+        }
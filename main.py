@@ -1,14 +1,19 @@
 # -*- coding: utf-8 -*-
-import os, json, logging
+import os, logging, asyncio
+from contextlib import asynccontextmanager
 from typing import Optional, List
-from fastapi import FastAPI, Depends, Request, HTTPException, Header
-from fastapi.responses import JSONResponse, FileResponse, RedirectResponse
+from fastapi import FastAPI, Depends, HTTPException, Header
+from fastapi.responses import JSONResponse, RedirectResponse
 from fastapi.staticfiles import StaticFiles
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
 from knowledge_store import KnowledgeStore
+from jobs import JobQueue, QueueFull
+from embeddings import model_stats, query_cache
 from api.auth import router as auth_router
 from api.user_endpoint import router as user_router
 from api.get_context import router as context_router
+from api.embedder import set_store as set_context_store
 from api.crawler_router import router as crawler_router
 from middleware import APIKeyAuthMiddleware, refresh_users
 
@@ -23,6 +28,31 @@ KNOW_DIR = os.path.join(APP_DIR, "knowledge")
 WEBUI_DIR = os.path.join(APP_DIR, "webui")
 os.makedirs(DATA_DIR, exist_ok=True)
 os.makedirs(KNOW_DIR, exist_ok=True)
+# Search the knowledge vectors straight from memory-mapped segment files
+# instead of building an in-RAM FAISS copy (fast cold start, half the memory).
+KNOWLEDGE_MMAP = os.getenv("KNOWLEDGE_MMAP", "false").lower() in ("1", "true", "yes")
+# "flat" (exact) or "hnsw" / "ivf" / "ivfpq", used once the store holds
+# KNOWLEDGE_ANN_THRESHOLD chunks.
+KNOWLEDGE_INDEX_TYPE = os.getenv("KNOWLEDGE_INDEX_TYPE", "flat")
+KNOWLEDGE_ANN_THRESHOLD = int(os.getenv("KNOWLEDGE_ANN_THRESHOLD", "50000"))
+# Vector codec inside the index: "fp32", "fp16", "sq8" (int8) or "pq"; with
+# KNOWLEDGE_RESCORE=N the top_k*N candidates are re-ranked in float32.
+KNOWLEDGE_CODEC = os.getenv("KNOWLEDGE_CODEC", "fp32")
+KNOWLEDGE_RESCORE = int(os.getenv("KNOWLEDGE_RESCORE", "0"))
+# Largest file / download accepted into the knowledge store (MB, 0 = unlimited).
+KNOWLEDGE_MAX_DOC_MB = float(os.getenv("KNOWLEDGE_MAX_DOC_MB", "100"))
+# Poll knowledge/ every N seconds and sync changed files into the index (0 = off).
+KNOWLEDGE_WATCH_INTERVAL = float(os.getenv("KNOWLEDGE_WATCH_INTERVAL", "0"))
+# Concurrent knowledge searches are encoded together in micro-batches of up to
+# EMBED_MAX_BATCH queries, waiting at most EMBED_MAX_WAIT_MS (0 = no batching).
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "32"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+# Ingestion (notes, reindex) runs as background jobs on this many threads.
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "100"))
+# The knowledge store loads in the background after startup; requests that
+# need it wait up to KNOWLEDGE_READY_WAIT seconds, then get 503.
+KNOWLEDGE_READY_WAIT = float(os.getenv("KNOWLEDGE_READY_WAIT", "10"))
 
 
 def _load_users() -> List[dict]:
@@ -56,16 +86,41 @@ async def current_user(authorization: Optional[str] = Header(None)):
     return u
 
 
-app = FastAPI(title="Fura API", version="1.0.0")
-ks = KnowledgeStore(APP_DIR)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    ks.load_in_background()
+    stop_watch = None
+    if KNOWLEDGE_WATCH_INTERVAL > 0:
+        stop_watch = ks.watch_folder(KNOW_DIR, interval=KNOWLEDGE_WATCH_INTERVAL)
+    yield
+    if stop_watch is not None:
+        stop_watch.set()
+    jobs.shutdown(wait=False)
+
+
+app = FastAPI(title="Fura API", version="1.0.0", lifespan=lifespan)
+ks = KnowledgeStore(
+    APP_DIR,
+    mmap=KNOWLEDGE_MMAP,
+    index_type=KNOWLEDGE_INDEX_TYPE,
+    ann_threshold=KNOWLEDGE_ANN_THRESHOLD,
+    codec=KNOWLEDGE_CODEC,
+    rescore=KNOWLEDGE_RESCORE,
+    max_doc_bytes=int(KNOWLEDGE_MAX_DOC_MB * 2**20) or None,
+    query_batch=EMBED_MAX_BATCH,
+    query_wait_ms=EMBED_MAX_WAIT_MS,
+    load=False,
+)
+set_context_store(ks)  # /get_context searches the same store
+jobs = JobQueue(workers=INGEST_WORKERS, max_pending=INGEST_MAX_PENDING)
 
 app.include_router(auth_router)
 app.include_router(user_router)
-app.include_router(context_router)
 app.include_router(crawler_router)
 app.add_middleware(
     APIKeyAuthMiddleware,
-    allow_paths={"/auth/register", "/auth/token", "/v1/chat", "/ask", "/v1/models"},
+    allow_paths={"/auth/register", "/auth/token", "/v1/chat", "/ask", "/v1/models",
+                 "/healthz", "/readyz"},
 )
 
 # --- Static web UI ----------------------------------------------------
@@ -77,6 +132,40 @@ async def root_redirect():
     return RedirectResponse(url="/app/", status_code=308)
 
 
+@app.get("/healthz", include_in_schema=False)
+async def healthz():
+    """Liveness: the process serves requests (the store may still be loading)."""
+    return {"status": "ok", "knowledge": ks.load_status()["status"]}
+
+
+@app.get("/readyz", include_in_schema=False)
+async def readyz():
+    """Readiness: 200 once the knowledge store is loaded, 503 with progress before."""
+    status = ks.load_status()
+    return JSONResponse(status_code=200 if ks.ready.is_set() else 503,
+                        content={"ready": ks.ready.is_set(), "knowledge": status})
+
+
+async def knowledge_ready():
+    """Wait up to KNOWLEDGE_READY_WAIT seconds for the store, else answer 503."""
+    if not ks.ready.is_set():
+        ks.load_in_background()  # no-op once loading has started
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + KNOWLEDGE_READY_WAIT
+        while (not ks.ready.is_set() and ks.load_status()["status"] != "error"
+               and loop.time() < deadline):
+            await asyncio.sleep(0.05)
+    if not ks.ready.is_set():
+        status = ks.load_status()
+        detail = ("Znalostní bázi se nepodařilo načíst" if status["status"] == "error"
+                  else "Znalostní báze se načítá, zkuste to později")
+        raise HTTPException(status_code=503, detail=detail, headers={"Retry-After": "5"})
+
+
+# /get_context searches the store too, so it waits for it like /knowledge/*
+app.include_router(context_router, dependencies=[Depends(knowledge_ready)])
+
+
 class AddNote(BaseModel):
     title: str
     content: str
@@ -86,6 +175,24 @@ class AddNote(BaseModel):
 class SearchReq(BaseModel):
     query: str
     top_k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    rescore: Optional[int] = None
+    tags: Optional[List[str]] = None
+    source: Optional[str] = None
+
+
+class SearchBatchReq(BaseModel):
+    queries: List[str]
+    top_k: int = 5
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    rescore: Optional[int] = None
+    tags: Optional[List[str]] = None
+    source: Optional[str] = None
+
+
+MAX_BATCH_QUERIES = 256
 
 
 class CrawlReq(BaseModel):
@@ -100,19 +207,126 @@ async def auth_me(u=Depends(current_user)):
     return {"username": u["username"], "email": u.get("email", ""), "approved": True}
 
 
-@app.post("/knowledge/add")
-async def knowledge_add(body: AddNote, u=Depends(current_user)):
-    doc_id, chunks = ks.add_manual(body.title, body.content, body.tags or [])
+def _submit(kind: str, fn):
+    try:
+        return jobs.submit(kind, fn)
+    except QueueFull:
+        raise HTTPException(status_code=429, detail="Fronta úloh je plná, zkuste to později")
+
+
+async def _wait(job):
+    try:
+        return await asyncio.wrap_future(job.future)
+    except Exception:
+        raise HTTPException(status_code=500, detail=job.error or "Úloha selhala")
+
+
+@app.post("/knowledge/add", dependencies=[Depends(knowledge_ready)])
+async def knowledge_add(body: AddNote, wait: bool = False, u=Depends(current_user)):
+    """Queue the note for indexing; ``?wait=true`` returns once it is indexed."""
+
+    def add(progress):
+        doc_id, chunks = ks.add_manual(body.title, body.content, body.tags or [])
+        return {"id": doc_id, "title": body.title, "chunks": chunks}
+
+    job = _submit("add", add)
+    if wait:
+        return {"ok": True, "job_id": job.id, **await _wait(job)}
+    return {"ok": True, "job_id": job.id, "status": job.status}
+
+
+@app.get("/admin/embeddings")
+async def admin_embeddings(u=Depends(current_user)):
+    """Loaded embedding models (load time, memory) and query-side statistics."""
+    return {
+        "models": model_stats(),
+        "query_cache": query_cache.stats(),
+        "query_batcher": ks._batcher.stats() if ks._batcher is not None else None,
+    }
+
+
+@app.get("/knowledge/jobs/{job_id}")
+async def knowledge_job(job_id: str, u=Depends(current_user)):
+    job = jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Úloha nenalezena")
+    return job.to_dict()
+
+
+@app.put("/knowledge/{doc_id}", dependencies=[Depends(knowledge_ready)])
+async def knowledge_update(doc_id: str, body: AddNote, u=Depends(current_user)):
+    try:
+        _, chunks = await run_in_threadpool(
+            ks.update_doc, doc_id, body.content, title=body.title, tags=body.tags
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Dokument nenalezen")
     return {"ok": True, "id": doc_id, "title": body.title, "chunks": chunks}
 
 
-@app.post("/admin/reindex_knowledge")
-async def admin_reindex(u=Depends(current_user)):
-    res = ks.rebuild_folder(KNOW_DIR)
-    return {"ok": True, **res}
+@app.delete("/knowledge/{doc_id}", dependencies=[Depends(knowledge_ready)])
+async def knowledge_delete(doc_id: str, u=Depends(current_user)):
+    try:
+        chunks = await run_in_threadpool(ks.delete_doc, doc_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Dokument nenalezen")
+    return {"ok": True, "id": doc_id, "chunks": chunks}
 
 
-@app.post("/knowledge/search")
+@app.post("/admin/reindex_knowledge", dependencies=[Depends(knowledge_ready)])
+async def admin_reindex(full: bool = False, wait: bool = False, u=Depends(current_user)):
+    """Queue a sync of changed files into the index; ``?full=true`` rebuilds
+    from scratch, ``?wait=true`` returns the result once done."""
+
+    def reindex(progress):
+        stats = {}  # ingest statistics of this job, not ks.last_ingest of whichever ran last
+
+        def report(current):
+            stats.update(current)
+            progress(current)
+
+        if full:
+            res = ks.rebuild_folder(KNOW_DIR, progress=report)
+        else:
+            res = ks.sync_folder(KNOW_DIR, progress=report)
+        return {**res, "stats": stats}
+
+    job = _submit("rebuild" if full else "sync", reindex)
+    if wait:
+        res = await _wait(job)
+        return {"ok": True, "job_id": job.id, **res}
+    return {"ok": True, "job_id": job.id, "status": job.status}
+
+
+@app.post("/knowledge/search", dependencies=[Depends(knowledge_ready)])
 async def knowledge_search(req: SearchReq, u=Depends(current_user)):
-    hits = ks.search(req.query, top_k=max(1, min(20, req.top_k)))
+    hits = await run_in_threadpool(
+        ks.search,
+        req.query,
+        top_k=max(1, min(20, req.top_k)),
+        nprobe=req.nprobe,
+        ef_search=req.ef_search,
+        rescore=req.rescore,
+        tags=req.tags,
+        source=req.source,
+    )
+    return {"results": hits}
+
+
+@app.post("/knowledge/search_batch", dependencies=[Depends(knowledge_ready)])
+async def knowledge_search_batch(req: SearchBatchReq, u=Depends(current_user)):
+    if len(req.queries) > MAX_BATCH_QUERIES:
+        raise HTTPException(
+            status_code=400, detail=f"Maximálně {MAX_BATCH_QUERIES} dotazů na dávku"
+        )
+    hits = await run_in_threadpool(
+        ks.search_many,
+        req.queries,
+        top_k=max(1, min(20, req.top_k)),
+        nprobe=req.nprobe,
+        ef_search=req.ef_search,
+        rescore=req.rescore,
+        tags=req.tags,
+        source=req.source,
+    )
     return {"results": hits}
@@ -0,0 +1,141 @@
+"""ONNX Runtime backend for sentence-transformers embedding models.
+
+:func:`export_onnx` converts a ``SentenceTransformer`` once into
+``<dir>/model.onnx`` (plus ``model-int8.onnx``, dynamically quantized
+weights) next to its tokenizer and a small ``meta.json`` describing the
+pooling.  :class:`OnnxEncoder` then runs that graph on ONNX Runtime's CPU
+provider and exposes the ``encode`` signature the rest of the code base
+uses, so it is a drop-in replacement for the PyTorch model returned by
+:func:`embeddings.get_model`.
+
+Exporting needs ``torch`` and ``sentence-transformers``; inference only
+needs ``onnxruntime`` and ``transformers`` (for the fast tokenizer).
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Dict, List, Union
+
+import numpy as np
+
+LOGGER = logging.getLogger("fura.onnx")
+
+MODEL_FILE = "model.onnx"
+INT8_FILE = "model-int8.onnx"
+META_FILE = "meta.json"
+
+
+def export_onnx(model_name: str, out_dir: Union[str, Path], quantize: bool = True,
+                opset: int = 17) -> Path:
+    """Export ``model_name`` to ONNX in ``out_dir`` and return that directory."""
+
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    st = SentenceTransformer(model_name, device="cpu")
+    transformer = st[0]
+    hf_model = transformer.auto_model.eval()
+    tokenizer = transformer.tokenizer
+    pooling = next((m for m in st if hasattr(m, "pooling_mode_cls_token")), None)
+    sample = tokenizer(["export sample"], return_tensors="pt")
+    names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+
+    class _Hidden(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(names, inputs))).last_hidden_state
+
+    axes = {n: {0: "batch", 1: "sequence"} for n in names}
+    axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+    tmp = out_dir / (MODEL_FILE + ".tmp")
+    with torch.no_grad():
+        torch.onnx.export(_Hidden(hf_model), tuple(sample[n] for n in names), str(tmp),
+                          input_names=names, output_names=["last_hidden_state"],
+                          dynamic_axes=axes, opset_version=opset, dynamo=False)
+    os.replace(tmp, out_dir / MODEL_FILE)
+    tokenizer.save_pretrained(str(out_dir))
+    meta = {
+        "model": model_name,
+        "inputs": names,
+        "pooling": "cls" if pooling is not None and pooling.pooling_mode_cls_token else "mean",
+        "normalize": any(type(m).__name__ == "Normalize" for m in st),
+        "max_seq_length": st.max_seq_length,
+        "dim": st.get_sentence_embedding_dimension(),
+    }
+    (out_dir / META_FILE).write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        quantize_dynamic(str(out_dir / MODEL_FILE), str(out_dir / INT8_FILE),
+                         weight_type=QuantType.QInt8)
+    LOGGER.info("Exported %s to %s", model_name, out_dir)
+    return out_dir
+
+
+class OnnxEncoder:
+    """``SentenceTransformer.encode``-compatible model running on ONNX Runtime.
+
+    Parameters
+    ----------
+    model_dir:
+        Directory written by :func:`export_onnx`.
+    quantized:
+        Use the int8 graph (``model-int8.onnx``).
+    threads:
+        ONNX Runtime intra-op threads; ``0`` lets the runtime decide.
+    """
+
+    device = "cpu"
+
+    def __init__(self, model_dir: Union[str, Path], quantized: bool = False, threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        model_dir = Path(model_dir)
+        self.meta: Dict = json.loads((model_dir / META_FILE).read_text(encoding="utf-8"))
+        self.tokenizer = AutoTokenizer.from_pretrained(str(model_dir))
+        self.path = model_dir / (INT8_FILE if quantized else MODEL_FILE)
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(str(self.path), opts,
+                                            providers=["CPUExecutionProvider"])
+        self.max_seq_length = self.meta["max_seq_length"]
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.meta["dim"]
+
+    def encode(self, sentences: Union[str, List[str]], batch_size: int = 32,
+               normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts = [sentences] if single else list(sentences)
+        out = np.zeros((len(texts), self.meta["dim"]), dtype="float32")
+        order = np.argsort([-len(t) for t in texts], kind="stable")  # similar lengths pad less
+        for start in range(0, len(texts), batch_size):
+            rows = order[start:start + batch_size]
+            enc = self.tokenizer([texts[i] for i in rows], padding=True, truncation=True,
+                                 max_length=self.max_seq_length, return_tensors="np")
+            feeds = {n: enc[n].astype("int64") for n in self.meta["inputs"]}
+            hidden = self.session.run(None, feeds)[0]
+            if self.meta["pooling"] == "cls":
+                emb = hidden[:, 0]
+            else:
+                mask = feeds["attention_mask"][..., None].astype("float32")
+                emb = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            out[rows] = emb
+        if normalize_embeddings or self.meta["normalize"]:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+
+__all__ = ["OnnxEncoder", "export_onnx"]
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Latency report for MaxScore pruning versus exhaustive BM25 scoring.
+
+Builds :class:`bm25.BM25Index` over synthetic passages with a Zipfian
+vocabulary (a few very common words, a long tail of rare ones) at several
+corpus sizes and runs the same queries through ``top_k`` with and without
+pruning::
+
+    python scripts/bench_bm25_pruning.py --sizes 10000 100000 500000
+    python scripts/bench_bm25_pruning.py --snapshot knowledge/.bm25   # real index
+
+Queries mix rare and common words, which is where pruning pays off: the
+long posting lists of common words are probed for the candidates only.
+Both paths must return identical top-k ids and scores; the script exits
+non-zero otherwise.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+import sys
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from bm25 import BM25Index
+
+
+def synthetic_index(docs: int, vocab: int, seed: int = 0) -> BM25Index:
+    rng = np.random.default_rng(seed)
+    p = 1.0 / np.arange(1, vocab + 1)
+    p /= p.sum()
+    lengths = rng.integers(20, 120, docs)
+    words = rng.choice(vocab, int(lengths.sum()), p=p)
+    index = BM25Index()
+    start = 0
+    for doc_id, n in enumerate(lengths.tolist()):
+        index.add(doc_id, " ".join(f"w{w}" for w in words[start:start + n].tolist()))
+        start += n
+    return index
+
+
+def make_queries(count: int, vocab: int, seed: int = 1):
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        common = rng.integers(0, 20, rng.integers(1, 4))
+        rare = rng.integers(20, vocab, rng.integers(1, 3))
+        queries.append(" ".join(f"w{w}" for w in np.concatenate([common, rare]).tolist()))
+    return queries
+
+
+def timed(index: BM25Index, queries, k: int, exhaustive: bool):
+    t0 = time.perf_counter()
+    results = [index.top_k(q, k, exhaustive=exhaustive) for q in queries]
+    return results, (time.perf_counter() - t0) * 1000 / len(queries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 50_000, 200_000],
+                        help="synthetic corpus sizes (passages)")
+    parser.add_argument("--vocab", type=int, default=50_000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--snapshot", help="benchmark an existing BM25 snapshot directory")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        index, _ = BM25Index.load(args.snapshot)
+        corpora = [(len(index), lambda index=index: index)]
+    else:
+        corpora = [(n, lambda n=n: synthetic_index(n, args.vocab)) for n in args.sizes]
+    queries = make_queries(args.queries, args.vocab)
+    k = args.top_k
+
+    print(f"{args.queries} queries, top-{k}")
+    print(f"{'passages':>10}{'build s':>9}{'exhaustive ms':>15}{'maxscore ms':>13}"
+          f"{'speedup':>9}{'identical':>11}")
+    failed = False
+    for size, build in corpora:
+        t0 = time.perf_counter()
+        index = build()
+        built = time.perf_counter() - t0
+        for q in queries[:5]:  # warm the posting caches of both paths
+            index.top_k(q, k)
+        exact, exact_ms = timed(index, queries, k, exhaustive=True)
+        pruned, pruned_ms = timed(index, queries, k, exhaustive=False)
+        same = sum(a[0].tolist() == b[0].tolist() and a[1].tolist() == b[1].tolist()
+                   for a, b in zip(exact, pruned))
+        failed |= same != len(queries)
+        print(f"{size:>10}{built:>9.1f}{exact_ms:>15.3f}{pruned_ms:>13.3f}"
+              f"{exact_ms / pruned_ms:>8.1f}x{f'{same}/{len(queries)}':>11}")
+    if failed:
+        sys.exit("pruned top-k differs from exhaustive scoring")
+
+
+if __name__ == "__main__":
+    main()
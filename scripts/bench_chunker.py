@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""Throughput and peak-memory report for the knowledge chunker.
+
+Compares the original character-window ``_chunk_text`` with the streaming,
+token-budgeted :func:`chunking.iter_chunks`::
+
+    python scripts/bench_chunker.py --mb 50
+    python scripts/bench_chunker.py --file knowledge/manual.txt
+
+``over budget`` counts chunks longer than the model's token limit, i.e.
+text the transformer silently truncates.  The streaming chunker reads the
+file block by block, so its peak memory stays flat with input size.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+import sys
+from typing import List
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from chunking import DEFAULT_MAX_TOKENS, READ_SIZE, get_tokenizer, iter_chunks
+from knowledge_store import MODEL_NAME
+
+
+def legacy_chunk_text(txt: str, max_chars=900, overlap=150) -> List[str]:
+    """``knowledge_store._chunk_text`` before the streaming chunker."""
+    txt = re.sub(r'\s+', ' ', (txt or '')).strip()
+    if not txt:
+        return []
+    chunks = []
+    i = 0
+    n = len(txt)
+    while i < n:
+        j = min(n, i + max_chars)
+        cut = txt[i:j]
+        m = re.search(r'.*?[.!?](\s|$)', cut)
+        if m and (i + m.end()) - i >= max_chars * 0.6:
+            j = i + m.end()
+        chunks.append(txt[i:j].strip())
+        if j >= n:
+            break
+        i = max(0, j - overlap)
+    return [c for c in chunks if c]
+
+
+def synthetic_text(path: str, mb: float, seed: int = 0) -> None:
+    import random
+
+    rnd = random.Random(seed)
+    words = ("znalostní báze dokument model vektor index věta odstavec embedding "
+             "search query token chunk the of and performance memory stream").split()
+    target = int(mb * 1024 * 1024)
+    with open(path, "w", encoding="utf-8") as f:
+        written = 0
+        while written < target:
+            sentence = " ".join(rnd.choice(words) for _ in range(rnd.randint(4, 40)))
+            line = sentence.capitalize() + rnd.choice((". ", "! ", "? ", ".\n\n"))
+            f.write(line)
+            written += len(line.encode("utf-8"))
+
+
+def measure(name, run, size_mb, tokenizer) -> None:
+    t0 = time.perf_counter()
+    chunks = sum(1 for _ in run())
+    elapsed = time.perf_counter() - t0
+    tracemalloc.start()  # second pass: peak memory and truncated chunks
+    over = sum(tokenizer.count(chunk) > DEFAULT_MAX_TOKENS for chunk in run())
+    peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+    print(f"{name:<26}{size_mb / elapsed:>10.2f}{chunks:>10}{over:>13}{peak:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=20, help="size of the synthetic document")
+    parser.add_argument("--file", help="benchmark an existing text file instead")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = args.file
+        if not path:
+            path = os.path.join(tmp, "doc.txt")
+            synthetic_text(path, args.mb)
+        size_mb = os.path.getsize(path) / 2 ** 20
+        tokenizer = get_tokenizer(MODEL_NAME)
+
+        def legacy():
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                return legacy_chunk_text(f.read())
+
+        def streaming():
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                yield from iter_chunks(iter(lambda: f.read(READ_SIZE), ""), tokenizer=tokenizer)
+
+        print(f"{size_mb:.1f} MB, tokenizer {type(tokenizer).__name__}, "
+              f"limit {DEFAULT_MAX_TOKENS} tokens")
+        print(f"{'chunker':<26}{'MB/s':>10}{'chunks':>10}{'over budget':>13}{'peak MB':>12}")
+        measure("legacy _chunk_text", legacy, size_mb, tokenizer)
+        measure("streaming iter_chunks", streaming, size_mb, tokenizer)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Parity and throughput report for the embedding backends.
+
+Every backend of :data:`embeddings.BACKENDS` embeds the same texts; the
+ONNX vectors are compared with those of the first backend (PyTorch by
+default) by cosine similarity::
+
+    python scripts/bench_embedding_backends.py --threads 4
+    python scripts/bench_embedding_backends.py --file knowledge/manual.txt --min-cos 0.99
+
+``queries/s`` encodes one text per call (the search path), ``chunks/s``
+encodes batches of ``--batch`` chunks (the ingestion path).  The script
+exits non-zero when a backend's minimum cosine falls below ``--min-cos``,
+so it doubles as a parity check before switching ``EMBED_BACKEND``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import time
+from pathlib import Path
+import sys
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from chunking import READ_SIZE, get_tokenizer, iter_chunks
+from embeddings import BACKENDS, DEFAULT_MODEL, get_model
+from bench_chunker import synthetic_text
+
+
+def load_texts(path: str, limit: int, model: str):
+    with open(path, encoding="utf-8", errors="ignore") as f:
+        chunks = iter_chunks(iter(lambda: f.read(READ_SIZE), ""), tokenizer=get_tokenizer(model))
+        return [c for c, _ in zip(chunks, range(limit))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+    parser.add_argument("--file", help="chunk an existing text file instead of synthetic text")
+    parser.add_argument("--chunks", type=int, default=512, help="texts to embed")
+    parser.add_argument("--queries", type=int, default=200, help="single-text encodes to time")
+    parser.add_argument("--batch", type=int, default=64, help="ingestion batch size")
+    parser.add_argument("--threads", type=int, default=0, help="ONNX Runtime intra-op threads")
+    parser.add_argument("--min-cos", type=float, default=0.0, help="fail below this cosine")
+    args = parser.parse_args()
+    if args.threads:
+        os.environ["EMBED_THREADS"] = str(args.threads)
+
+    path = args.file
+    if not path:
+        path = os.path.join(os.getenv("TMPDIR", "/tmp"), "bench_embedding_backends.txt")
+        synthetic_text(path, 0.5)
+    texts = load_texts(path, args.chunks, args.model)
+    queries = [" ".join(t.split()[:12]) for t in texts[:args.queries]]
+
+    print(f"{args.model}: {len(texts)} chunks, {len(queries)} queries, batch {args.batch}")
+    print(f"{'backend':<11}{'load s':>8}{'queries/s':>11}{'chunks/s':>10}"
+          f"{'min cos':>9}{'mean cos':>10}")
+    reference = None
+    failed = False
+    for backend in args.backends:
+        t0 = time.perf_counter()
+        model = get_model(args.model, backend=backend)
+        load = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        for q in queries:
+            model.encode([q], normalize_embeddings=True)
+        qps = len(queries) / (time.perf_counter() - t0)
+
+        t0 = time.perf_counter()
+        vecs = np.asarray(model.encode(texts, batch_size=args.batch, normalize_embeddings=True))
+        cps = len(texts) / (time.perf_counter() - t0)
+
+        if reference is None:
+            reference = vecs
+            low = mean = 1.0
+        else:
+            cos = (reference * vecs).sum(axis=1)
+            low, mean = float(cos.min()), float(cos.mean())
+            failed |= low < args.min_cos
+        print(f"{backend:<11}{load:>8.1f}{qps:>11.1f}{cps:>10.1f}{low:>9.4f}{mean:>10.4f}")
+    if failed:
+        sys.exit(f"cosine similarity below {args.min_cos}")
+
+
+if __name__ == "__main__":
+    main()
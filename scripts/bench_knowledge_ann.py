@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""Recall-vs-latency report for the approximate KnowledgeStore indexes.
+
+Every ANN configuration is compared with the exact ``IndexFlatIP`` results
+on the same vectors::
+
+    python scripts/bench_knowledge_ann.py --rows 200000 --queries 500
+    python scripts/bench_knowledge_ann.py --store .   # use the real knowledge index
+
+Queries are held out of the corpus, so no query has a near-duplicate to
+find.  ``--store`` measures the real embeddings and is the one to trust when
+picking ``nprobe`` / ``efSearch``.  Without it a synthetic corpus is
+generated: overlapping clusters in a 64-dimensional subspace embedded in
+MiniLM's 384 dimensions, plus isotropic noise.  It is hard enough that the
+knobs visibly trade recall for latency, but it only approximates the
+structure of sentence embeddings; use it to compare settings, not to
+predict the recall of a real corpus.
+"""
+
+from __future__ import annotations
+
+import argparse
+import time
+from pathlib import Path
+import sys
+
+import faiss
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from knowledge_store import KnowledgeStore, _ann_factory
+
+
+def synthetic_corpus(rows: int, dim: int, intrinsic: int = 64, clusters: int = 1024,
+                     seed: int = 0) -> np.ndarray:
+    """Unit vectors from overlapping clusters in a random ``intrinsic``-dim subspace."""
+    rng = np.random.default_rng(seed)
+    intrinsic = min(intrinsic, dim)
+    centers = rng.standard_normal((clusters, intrinsic)).astype("float32")
+    labels = rng.integers(0, clusters, rows)
+    # within-cluster spread as large as the spread of the centres: clusters overlap
+    latent = centers[labels] + rng.standard_normal((rows, intrinsic)).astype("float32")
+    basis = np.linalg.qr(rng.standard_normal((dim, intrinsic)))[0].astype("float32")
+    x = latent @ basis.T + 0.1 * rng.standard_normal((rows, dim)).astype("float32")
+    faiss.normalize_L2(x)
+    return x
+
+
+def held_out(xs: np.ndarray, queries: int, seed: int = 1):
+    """Split ``xs`` into a corpus and ``queries`` held-out query vectors."""
+    mask = np.zeros(len(xs), dtype=bool)
+    mask[np.random.default_rng(seed).choice(len(xs), queries, replace=False)] = True
+    return np.ascontiguousarray(xs[~mask]), np.ascontiguousarray(xs[mask])
+
+
+def timed_search(index, q, k, params=None):
+    t0 = time.perf_counter()
+    _, I = index.search(q, k, params=params)
+    return I, (time.perf_counter() - t0) * 1000 / q.shape[0]
+
+
+def recall(I, truth):
+    k = truth.shape[1]
+    hits = sum(len(set(a) & set(b)) for a, b in zip(I.tolist(), truth.tolist()))
+    return hits / (truth.shape[0] * k)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=100_000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--store", help="benchmark the vectors of an existing KnowledgeStore root")
+    args = parser.parse_args()
+
+    if args.store:
+        xs = np.ascontiguousarray(KnowledgeStore(args.store, mmap=True)._vectors)
+    else:
+        xs = synthetic_corpus(args.rows + args.queries, args.dim)
+    xb, xq = held_out(xs, args.queries)
+    n, dim = xb.shape
+    rng = np.random.default_rng(1)
+    k = args.top_k
+
+    flat = faiss.IndexFlatIP(dim)
+    flat.add(xb)
+    truth, flat_ms = timed_search(flat, xq, k)
+    print(f"{n} vectors x {dim} dims, {args.queries} queries, recall@{k}")
+    print(f"{'index':<24}{'knob':>14}{'recall':>10}{'ms/query':>12}{'build s':>10}")
+    print(f"{'Flat':<24}{'-':>14}{1.0:>10.3f}{flat_ms:>12.3f}{0.0:>10.1f}")
+
+    for index_type, knob, values in (
+        ("hnsw", "efSearch", (16, 32, 64, 128, 256)),
+        ("ivf", "nprobe", (1, 4, 16, 64, 128)),
+        ("ivfpq", "nprobe", (1, 4, 16, 64, 128)),
+    ):
+        factory = _ann_factory(index_type, n, dim)
+        t0 = time.perf_counter()
+        index = faiss.index_factory(dim, factory, faiss.METRIC_INNER_PRODUCT)
+        if not index.is_trained:
+            index.train(xb[rng.choice(n, min(n, 200_000), replace=False)])
+        index.add(xb)
+        build = time.perf_counter() - t0
+        for v in values:
+            if index_type == "hnsw":
+                params = faiss.SearchParametersHNSW(efSearch=v)
+            else:
+                params = faiss.SearchParametersIVF(nprobe=v)
+            I, ms = timed_search(index, xq, k, params)
+            print(f"{factory:<24}{f'{knob}={v}':>14}{recall(I, truth):>10.3f}{ms:>12.3f}{build:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
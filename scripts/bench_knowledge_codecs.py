@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Memory-per-chunk and recall report for the KnowledgeStore vector codecs.
+
+Each codec is loaded into a throw-away :class:`KnowledgeStore` and compared
+with exact float32 search, with and without the float32 re-score::
+
+    python scripts/bench_knowledge_codecs.py --rows 200000 --queries 500
+    python scripts/bench_knowledge_codecs.py --store . --index-type ivf
+
+``bytes/chunk`` is the size of the serialised FAISS index divided by the
+number of chunks, i.e. what the store keeps resident per chunk; the float32
+segments used by the re-score stay memory-mapped on disk.  Queries are
+held out of the corpus (see ``bench_knowledge_ann.py`` for the synthetic
+data and its limits).
+"""
+
+from __future__ import annotations
+
+import argparse
+import tempfile
+import time
+from pathlib import Path
+import sys
+
+import faiss
+import numpy as np
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from knowledge_store import ANN_TYPES, CODECS, KnowledgeStore
+from bench_knowledge_ann import held_out, recall, synthetic_corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=50_000, help="synthetic corpus size")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--index-type", choices=ANN_TYPES, default="flat")
+    parser.add_argument("--rescore", type=int, default=4, help="re-score factor to compare")
+    parser.add_argument("--store", help="benchmark the vectors of an existing KnowledgeStore root")
+    args = parser.parse_args()
+
+    if args.store:
+        xs = KnowledgeStore(args.store, mmap=True)._vectors
+    else:
+        xs = synthetic_corpus(args.rows + args.queries, args.dim)
+    xb, xq = held_out(xs, args.queries)
+    n, dim = xb.shape
+    k = args.top_k
+    _, truth = faiss.knn(xq, xb, k, metric=faiss.METRIC_INNER_PRODUCT)
+    entries = [{"doc_id": "bench", "chunk": ""} for _ in range(n)]
+
+    print(f"{n} vectors x {dim} dims, {args.queries} queries, {args.index_type} index, recall@{k}")
+    print(f"{'codec':<8}{'factory':<28}{'bytes/chunk':>12}{'recall':>9}"
+          f"{f'rescore x{args.rescore}':>13}{'ms/query':>10}{'build s':>9}")
+    for codec in CODECS:
+        with tempfile.TemporaryDirectory() as root:
+            t0 = time.perf_counter()
+            ks = KnowledgeStore(root, codec=codec, index_type=args.index_type, ann_threshold=1)
+            ks._add_vectors(xb, entries)
+            build = time.perf_counter() - t0
+            factory = ks._ann["factory"] if ks._ann else "Flat"
+            per_chunk = faiss.serialize_index(ks._index).size / n
+            params = ks._search_params()
+            _, I = ks._search_vectors(xq, k, params)
+            t0 = time.perf_counter()
+            _, I_rs = ks._search_vectors(xq, k, params, rescore=args.rescore)
+            ms = (time.perf_counter() - t0) * 1000 / args.queries
+        print(f"{codec:<8}{factory:<28}{per_chunk:>12.1f}{recall(I, truth):>9.3f}"
+              f"{recall(I_rs, truth):>13.3f}{ms:>10.3f}{build:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
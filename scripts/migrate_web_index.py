@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+"""Move inline embeddings of ``knowledge/web_index.json`` into the sidecar.
+
+Older ``/crawl`` versions stored every page vector as a JSON list inside
+the index line.  This one-time migration rewrites the index as metadata
+only and packs the vectors into ``web_index.f32`` (see
+:mod:`api.web_index`)::
+
+    python scripts/migrate_web_index.py
+    python scripts/migrate_web_index.py --index /data/knowledge/web_index.json
+
+Stop the server first.  Running it on an already migrated index is
+harmless; it only re-packs the sidecar.
+"""
+
+from __future__ import annotations
+
+import argparse
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+from api.search_web import WEB_INDEX_PATH
+from api.web_index import migrate_web_index, vectors_path
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--index", type=Path, default=WEB_INDEX_PATH)
+    args = parser.parse_args()
+
+    before = args.index.stat().st_size if args.index.exists() else 0
+    stats = migrate_web_index(args.index)
+    after = args.index.stat().st_size if args.index.exists() else 0
+    sidecar = vectors_path(args.index)
+    vectors = sidecar.stat().st_size if sidecar.exists() else 0
+    print(f"{stats['migrated']} migrated, {stats['kept']} already in the sidecar, "
+          f"{stats['dropped']} dropped")
+    print(f"{args.index}: {before} -> {after} bytes, {sidecar}: {vectors} bytes")
+
+
+if __name__ == "__main__":
+    main()
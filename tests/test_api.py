@@ -3,6 +3,7 @@ import types
 import json
 import pytest
 import asyncio
+import numpy as np
 from pathlib import Path
 from fastapi import HTTPException, Request
 
@@ -36,6 +37,7 @@ class SimpleClient:
 
     def _request(self, method, path, json_body=None, headers=None):
         headers = headers or {}
+        path, _, query = path.partition("?")
         body_bytes = b""
         header_list = [(k.lower().encode(), v.encode()) for k, v in headers.items()]
         if json_body is not None:
@@ -51,7 +53,7 @@ class SimpleClient:
             "method": method,
             "path": path,
             "raw_path": path.encode(),
-            "query_string": b"",
+            "query_string": query.encode(),
             "headers": header_list,
             "client": ("test", 123),
             "server": ("testserver", 80),
@@ -152,16 +154,6 @@ def test_user_endpoint_unauthorized():
 
 
 def test_get_context(monkeypatch, auth_header):
-    class DummyModel:
-        def encode(self, texts, **kwargs):
-            return [[0.1, 0.2, 0.3]]
-
-    class DummyStore:
-        def search(self, query, top_k=3):
-            return [{"snippet": f"embedded:{query}"}]
-    
-    monkeypatch.setattr("api.embedder._get_model", lambda: DummyModel())
-    monkeypatch.setattr("api.embedder._get_store", lambda: DummyStore())
     monkeypatch.setattr("api.get_context.search_web", lambda q, top_k=3: [f"web:{q}"])
 
     resp = client.post(
@@ -171,18 +163,32 @@ def test_get_context(monkeypatch, auth_header):
     )
     assert resp.status_code == 200
     data = resp.json()
-    assert set(data.keys()) == {"memory", "knowledge", "embedding", "web"}
+    assert set(data.keys()) == {"memory", "knowledge", "web"}
     assert isinstance(data["memory"], list)
     assert isinstance(data["knowledge"], list)
-    assert data["embedding"] == ["embedded:transformers"]
     assert data["web"] == ["web:transformers"]
     assert any("transformers" in snippet.lower() for snippet in data["knowledge"])
 
 
+def test_hybrid_query_fuses_store_chunks_and_folder_passages(monkeypatch):
+    from api import embedder
+
+    class DummyStore:
+        def hybrid_search(self, query, top_k=3):
+            return [{"snippet": "both rankings", "score": 2 / 61},
+                    {"snippet": "vector only", "score": 1 / 62}]
+
+    monkeypatch.setattr(embedder, "_get_store", lambda: DummyStore())
+    monkeypatch.setattr(embedder, "search_passages", lambda q, top_k=3: [
+        {"text": "folder passage"}, {"text": "vector only"}])
+    assert embedder.hybrid_query("q", top_k=3) == ["both rankings", "folder passage",
+                                                   "vector only"]
+
+
 def test_crawl(monkeypatch, tmp_path, auth_header):
     class DummyModel:
         def encode(self, text):
-            return types.SimpleNamespace(tolist=lambda: [0.1, 0.2])
+            return np.array([3.0, 4.0])
 
     monkeypatch.setattr("api.crawler_router._get_model", lambda: DummyModel())
     monkeypatch.setattr(
@@ -200,9 +206,9 @@ def test_crawl(monkeypatch, tmp_path, auth_header):
     data = index_file.read_text(encoding="utf-8").strip()
     assert data
     item = json.loads(data)
-    assert item["url"] == "http://example.com"
-    assert item["text"] == "dummy text"
-    assert item["embedding"] == [0.1, 0.2]
+    assert item == {"url": "http://example.com", "text": "dummy text", "row": 0, "dim": 2}
+    vectors = np.fromfile(tmp_path / "index.f32", dtype="float32")
+    assert vectors.tolist() == pytest.approx([0.6, 0.8])
 
 
 def test_get_context_retrieves_crawled_page(monkeypatch, tmp_path, auth_header):
@@ -211,8 +217,8 @@ def test_get_context_retrieves_crawled_page(monkeypatch, tmp_path, auth_header):
             return [[0.1, 0.2, 0.3]]
 
     class DummyStore:
-        def search(self, query, top_k=3):
-            return [{"snippet": "embedded"}]
+        def hybrid_search(self, query, top_k=3):
+            return [{"snippet": "hybrid", "score": 1 / 61}]
 
     # Prepare web index with a single entry
     index_file = tmp_path / "web_index.json"
@@ -238,12 +244,89 @@ def test_get_context_retrieves_crawled_page(monkeypatch, tmp_path, auth_header):
     assert any("http://example.com" in item for item in data["web"])
 
 
-def test_get_context_unauthorized(monkeypatch):
-    def dummy_embed(query: str, top_k: int = 3):
-        return [f"embedded:{query}"]
+def test_web_index_reads_legacy_lines_and_migrates(tmp_path):
+    from api.web_index import append_page, load_web_index, migrate_web_index
+
+    index_file = tmp_path / "web_index.json"
+    legacy = {"url": "http://old.example", "text": "old", "embedding": [0.0, 2.0, 0.0]}
+    index_file.write_text(json.dumps(legacy) + "\n" + "not json\n", encoding="utf-8")
+    append_page(index_file, "http://new.example", "new", np.array([1.0, 0.0, 0.0]))
+
+    entries, vectors = load_web_index(index_file)
+    assert [e["url"] for e in entries] == ["http://old.example", "http://new.example"]
+    assert vectors.tolist() == [[0.0, 1.0, 0.0], [1.0, 0.0, 0.0]]
+
+    assert migrate_web_index(index_file) == {"migrated": 1, "kept": 1, "dropped": 0}
+    assert "embedding" not in index_file.read_text(encoding="utf-8")
+    entries, vectors = load_web_index(index_file)
+    assert [(e["url"], e["row"]) for e in entries] == [("http://old.example", 0),
+                                                      ("http://new.example", 1)]
+    assert isinstance(vectors, np.memmap)
+    assert vectors.tolist() == [[0.0, 1.0, 0.0], [1.0, 0.0, 0.0]]
 
-    monkeypatch.setattr("api.get_context.embed_and_query", dummy_embed)
 
+def test_web_index_reader_parses_only_appended_lines(tmp_path, monkeypatch):
+    from api import web_index
+
+    index_file = tmp_path / "web_index.json"
+    web_index.append_page(index_file, "http://a", "a", [1.0, 0.0])
+    reader = web_index.WebIndexReader(index_file)
+    assert reader.refresh() == 1
+    assert reader.refresh() == 0
+
+    parsed = []
+    original = web_index._parse_lines
+    monkeypatch.setattr(web_index, "_parse_lines", lambda lines: parsed.extend(
+        lines := list(lines)) or original(lines))
+    web_index.append_page(index_file, "http://b", "b", [0.0, 2.0])
+    with index_file.open("a", encoding="utf-8") as f:
+        f.write('{"url": "http://c", "text": "c", "embed')  # still being written
+    assert reader.refresh() == 1
+    assert b"http://b" in b"".join(parsed) and b"http://a" not in b"".join(parsed)
+    assert [e["url"] for e in reader.entries] == ["http://a", "http://b"]
+    assert reader.vectors.tolist() == [[1.0, 0.0], [0.0, 1.0]]
+    with index_file.open("a", encoding="utf-8") as f:
+        f.write('ding": [1.0, 1.0]}\n')
+    assert reader.refresh() == 1 and reader.full_reloads == 0
+
+    web_index.migrate_web_index(index_file)  # rewrite: new file
+    assert reader.refresh() == 3 and reader.full_reloads == 1
+    index_file.write_text("", encoding="utf-8")  # truncation
+    assert reader.refresh() == 0 and reader.full_reloads == 2
+    assert reader.entries == [] and len(reader.vectors) == 0
+
+
+def _append_pages(index_file, worker, count):
+    from api.web_index import append_page
+
+    for i in range(count):
+        vec = np.zeros(4096)
+        vec[worker] = 1.0
+        append_page(index_file, f"http://{worker}/{i}", "x", vec)
+
+
+def test_web_index_appends_from_several_processes(tmp_path):
+    import multiprocessing
+
+    from api.web_index import load_web_index
+
+    index_file = tmp_path / "web_index.json"
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_append_pages, args=(index_file, w, 50)) for w in range(4)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    assert all(p.exitcode == 0 for p in procs)
+
+    entries, vectors = load_web_index(index_file)
+    assert len(entries) == 200
+    assert sorted(e["row"] for e in entries) == list(range(200))
+    for entry, vec in zip(entries, vectors):
+        assert np.argmax(vec) == int(entry["url"].split("/")[2])
+
+
+def test_get_context_unauthorized(monkeypatch):
     resp = client.post(
         "/get_context", json={"query": "transformers", "user": "jiri"}
     )
@@ -272,3 +355,77 @@ def test_auth_me(auth_header):
     assert data["username"] == "tester"
     assert data["email"] == "tester@example.com"
     assert data["approved"] is True
+
+
+def test_knowledge_add_runs_as_background_job(monkeypatch, auth_header):
+    import main
+
+    added = []
+
+    def add_manual(title, content, tags):
+        added.append(title)
+        return "doc-1", 3
+
+    monkeypatch.setattr(main.ks, "add_manual", add_manual)
+    resp = client.post(
+        "/knowledge/add", json={"title": "Note", "content": "text"}, headers=auth_header
+    )
+    assert resp.status_code == 200
+    job_id = resp.json()["job_id"]
+    main.jobs.get(job_id).future.result(timeout=5)
+
+    resp = client.get(f"/knowledge/jobs/{job_id}", headers=auth_header)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["status"] == "done" and data["kind"] == "add"
+    assert data["result"] == {"id": "doc-1", "title": "Note", "chunks": 3}
+    assert added == ["Note"]
+
+    resp = client.get("/knowledge/jobs/unknown", headers=auth_header)
+    assert resp.status_code == 404
+
+
+def test_reindex_wait_returns_the_stats_of_its_own_job(monkeypatch, auth_header):
+    import main
+
+    def sync_folder(folder, progress=None):
+        progress({"files": 2, "docs": 2, "chunks": 5})
+        main.ks.last_ingest = {"files": 99}  # e.g. a concurrent add
+        return {"added": 2, "chunks": 5}
+
+    monkeypatch.setattr(main.ks, "sync_folder", sync_folder)
+    resp = client.post("/admin/reindex_knowledge?wait=true", headers=auth_header)
+    assert resp.status_code == 200
+    data = resp.json()
+    assert data["added"] == 2 and data["stats"] == {"files": 2, "docs": 2, "chunks": 5}
+
+
+def test_readiness_reports_background_load(monkeypatch, tmp_path):
+    import main
+    from knowledge_store import KnowledgeStore
+
+    store = KnowledgeStore(str(tmp_path), load=False)
+    monkeypatch.setattr(main, "ks", store)
+    assert client.get("/healthz").status_code == 200
+    resp = client.get("/readyz")
+    assert resp.status_code == 503
+    assert resp.json()["knowledge"]["status"] == "pending"
+
+    store.load()
+    resp = client.get("/readyz")
+    assert resp.status_code == 200 and resp.json()["ready"] is True
+
+
+def test_knowledge_routes_answer_503_while_loading(monkeypatch, tmp_path, auth_header):
+    import main
+    from knowledge_store import KnowledgeStore
+
+    store = KnowledgeStore(str(tmp_path), load=False)
+    monkeypatch.setattr(store, "load_in_background", lambda: store.ready)  # never finishes
+    monkeypatch.setattr(main, "ks", store)
+    monkeypatch.setattr(main, "KNOWLEDGE_READY_WAIT", 0.1)
+    resp = client.post("/knowledge/search", json={"query": "x"}, headers=auth_header)
+    assert resp.status_code == 503
+    resp = client.post("/get_context", json={"query": "x"}, headers=auth_header)
+    assert resp.status_code == 503
+    assert client.get("/auth/me", headers=auth_header).status_code == 200
@@ -0,0 +1,136 @@
+import math
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from bm25 import BM25Index, tokenize
+
+
+def _reference(docs, query, k1=1.5, b=0.75):
+    """Exhaustive BM25 exactly as the original search_knowledge scored it."""
+    toks = {i: tokenize(t) for i, t in docs.items()}
+    avgdl = sum(len(t) for t in toks.values()) / len(toks)
+    df = Counter(term for t in toks.values() for term in set(t))
+    N = len(toks)
+    scores = {}
+    for i, tokens in toks.items():
+        tf = Counter(tokens)
+        s = 0.0
+        for q in tokenize(query):
+            if q in tf:
+                idf = math.log(1 + (N - df[q] + 0.5) / (df[q] + 0.5))
+                s += idf * tf[q] * (k1 + 1) / (tf[q] + k1 * (1 - b + b * len(tokens) / avgdl))
+        if s > 0:
+            scores[i] = s
+    return scores
+
+
+def test_scores_match_exhaustive_bm25_after_updates():
+    rnd = random.Random(0)
+    words = "alfa beta gama delta epsilon žluťoučký kůň zeta eta theta".split()
+    docs = {i * 3: " ".join(rnd.choice(words) for _ in range(rnd.randint(3, 40))) for i in range(60)}
+    index = BM25Index()
+    index.add_many(docs.items())
+    for doc_id in list(docs)[::7]:
+        assert index.remove(doc_id)
+        del docs[doc_id]
+    index.add(6, "kůň kůň beta")  # replaces an existing document
+    docs[6] = "kůň kůň beta"
+    assert not index.remove(10_000)
+
+    for query in ("beta", "kůň zeta zeta", "theta alfa gama", "unknown"):
+        expected = _reference(docs, query)
+        ids, scores = index.scores(query)
+        assert dict(zip(ids.tolist(), scores.tolist())) == pytest.approx(expected, rel=1e-5)
+        best = sorted(expected, key=lambda i: (-expected[i], i))[:5]
+        assert [i for i, _ in index.search(query, top_k=5)] == best
+
+
+def test_snapshot_roundtrip_stays_updatable(tmp_path):
+    rnd = random.Random(1)
+    words = "jedna dva tři čtyři pět šest sedm osm".split()
+    docs = {i: " ".join(rnd.choice(words) for _ in range(rnd.randint(1, 20))) for i in range(40)}
+    index = BM25Index()
+    index.add_many(docs.items())
+    index.save(str(tmp_path), extra={"note": "x"})
+    index.save(str(tmp_path))  # second generation replaces the first
+
+    loaded, extra = BM25Index.load(str(tmp_path))
+    assert extra == {} and len(loaded) == len(index)
+    assert isinstance(loaded._base["ids"], np.memmap)
+    for query in ("dva", "tři osm osm"):
+        assert loaded.search(query, 10) == pytest.approx(index.search(query, 10))
+
+    loaded.remove(3)
+    loaded.add(5, "dva dva devět")
+    loaded.add(100, "devět")
+    del docs[3]
+    docs[5], docs[100] = "dva dva devět", "devět"
+    for query in ("dva", "devět", "sedm"):
+        expected = _reference(docs, query)
+        ids, scores = loaded.scores(query)
+        assert dict(zip(ids.tolist(), scores.tolist())) == pytest.approx(expected, rel=1e-5)
+
+    loaded.save(str(tmp_path))
+    again, _ = BM25Index.load(str(tmp_path))
+    assert again.search("devět", 5) == pytest.approx(loaded.search("devět", 5))
+    assert sorted(p.name for p in tmp_path.iterdir() if p.name not in ("meta.json", "lock")) == sorted(
+        f"{name}-3.npy" for name in ("offsets", "ids", "tfs", "max_tf", "min_dl", "doc_offsets",
+                                     "doc_terms", "lengths", "present")) + ["vocab-3.lst"]
+
+
+def test_maxscore_top_k_matches_exhaustive(tmp_path):
+    rnd = random.Random(2)
+    words = [f"w{i}" for i in range(300)]
+    weights = [1 / (i + 1) for i in range(len(words))]  # Zipf-like: w0 is very common
+    docs = {i: " ".join(rnd.choices(words, weights, k=rnd.randint(5, 80))) for i in range(2000)}
+    index = BM25Index()
+    index.add_many(docs.items())
+    for doc_id in range(0, 2000, 11):
+        index.remove(doc_id)
+    index.add(5, "w0 w0 w0 w299")
+    index.save(str(tmp_path))
+    loaded, _ = BM25Index.load(str(tmp_path))
+    loaded.add(7, "w1 w250 w250")
+
+    index.add_many((i, "tie tie w0") for i in range(3000, 2900, -1))  # equal scores
+    assert index.top_k("tie", 3, exhaustive=True)[0].tolist() == [2901, 2902, 2903]
+    queries = ["tie", "w0", "w0 w1 w2", "w0 w0 w150 w299", "w3 w80 w81 w200", "w1 w250", "nic"]
+    for idx in (index, loaded):
+        for query in queries:
+            for k in (1, 3, 10, 5000):
+                ids, scores = idx.top_k(query, k)
+                ref_ids, ref_scores = idx.top_k(query, k, exhaustive=True)
+                assert ids.tolist() == ref_ids.tolist()
+                assert scores.tolist() == ref_scores.tolist()
+
+
+def test_concurrent_saves_leave_a_loadable_snapshot(tmp_path):
+    import threading
+
+    indexes = []
+    for n in (50, 80):
+        index = BM25Index()
+        index.add_many((i, f"slovo{i % 7} společné") for i in range(n))
+        indexes.append(index)
+    errors = []
+
+    def save_and_load(index):
+        try:
+            for _ in range(10):
+                index.save(str(tmp_path), extra={"n": len(index)})
+                loaded, extra = BM25Index.load(str(tmp_path))
+                assert len(loaded) == extra["n"]
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+
+    threads = [threading.Thread(target=save_and_load, args=(index,)) for index in indexes]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    loaded, extra = BM25Index.load(str(tmp_path))
+    assert len(loaded) == extra["n"] and loaded.search("společné", 3)
@@ -0,0 +1,33 @@
+from chunking import ApproxTokenizer, iter_chunks, iter_sentences
+
+
+TEXT = "First  sentence here.\n\nSecond one is a bit longer!  Third? " * 40
+
+
+def _tokens(text):
+    return len(ApproxTokenizer().spans(text))
+
+
+def test_chunks_respect_token_budget_and_overlap():
+    chunks = list(iter_chunks(TEXT, max_tokens=30, overlap=8))
+    assert len(chunks) > 5
+    assert all(_tokens(c) <= 30 for c in chunks)
+    assert all("  " not in c and "\n" not in c for c in chunks)
+    # consecutive chunks share their boundary sentence
+    assert chunks[1].startswith(list(iter_sentences(chunks[0]))[-1])
+
+
+def test_streamed_pieces_match_whole_text():
+    pieces = (TEXT[i:i + 7] for i in range(0, len(TEXT), 7))
+    assert list(iter_chunks(pieces, max_tokens=30)) == list(iter_chunks(TEXT, max_tokens=30))
+
+
+def test_long_sentences_are_split_by_tokens():
+    chunks = list(iter_chunks("word " * 100, max_tokens=16, overlap=0))
+    assert [_tokens(c) for c in chunks] == [16] * 6 + [4]
+    assert list(iter_sentences(["no end", " in sight"], max_chars=5)) == ["no", "end", "in", "sight"]
+
+
+def test_empty_text_has_no_chunks():
+    assert list(iter_chunks("")) == []
+    assert list(iter_chunks(["  ", "\n"])) == []
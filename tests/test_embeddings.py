@@ -0,0 +1,175 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from embeddings import EmbeddingCache, MicroBatcher, canonical_model_name, encode_cached
+
+
+def _encoder(calls):
+    def encode(texts):
+        calls.append(list(texts))
+        return np.array([[len(t), 1.0] for t in texts])
+    return encode
+
+
+def test_encode_cached_only_encodes_misses():
+    cache = EmbeddingCache(maxsize=10)
+    calls = []
+    out = encode_cached("all-MiniLM-L6-v2", ["ahoj", "svete", "ahoj"], _encoder(calls), cache)
+    assert calls == [["ahoj", "svete"]]
+    assert out.dtype == np.float32 and out.shape == (3, 2)
+    assert np.array_equal(out[0], out[2])
+
+    # whitespace and model-name spelling do not defeat the cache
+    encode_cached("sentence-transformers/all-MiniLM-L6-v2", ["  ahoj\n"], _encoder(calls), cache)
+    assert calls == [["ahoj", "svete"]]
+    assert cache.stats()["hits"] == 1
+
+
+def test_lru_and_ttl_eviction(monkeypatch):
+    cache = EmbeddingCache(maxsize=2, ttl=10)
+    calls = []
+    encode_cached("m", ["a", "b"], _encoder(calls), cache)
+    encode_cached("m", ["a"], _encoder(calls), cache)       # a is now most recent
+    encode_cached("m", ["c"], _encoder(calls), cache)       # evicts b
+    encode_cached("m", ["a", "b"], _encoder(calls), cache)
+    assert calls == [["a", "b"], ["c"], ["b"]]
+
+    import embeddings
+    now = embeddings.time.monotonic()
+    monkeypatch.setattr(embeddings.time, "monotonic", lambda: now + 60)
+    encode_cached("m", ["a"], _encoder(calls), cache)
+    assert calls[-1] == ["a"]
+
+
+def test_canonical_model_name():
+    assert canonical_model_name("all-MiniLM-L6-v2") == "sentence-transformers/all-MiniLM-L6-v2"
+    assert canonical_model_name("org/model") == "org/model"
+
+
+def test_micro_batcher_merges_concurrent_calls():
+    sizes = []
+    release = threading.Event()
+
+    def encode(texts):
+        release.wait(5)  # hold the first batch so the rest queue up
+        sizes.append(len(texts))
+        return np.array([[float(t[1:])] for t in texts])
+
+    batcher = MicroBatcher(encode, max_batch=4, max_wait_ms=20)
+    with ThreadPoolExecutor(8) as pool:
+        futures = [pool.submit(batcher.encode, [f"q{i}"]) for i in range(9)]
+        time.sleep(0.1)
+        release.set()
+        results = [f.result(timeout=5) for f in futures]
+    assert [r[0][0] for r in results] == list(range(9))
+    assert sum(sizes) == 9 and max(sizes) <= 4 and len(sizes) < 9
+    assert batcher.stats()["items"] == 9
+    assert batcher.encode(["q7", "q8"]).ravel().tolist() == [7.0, 8.0]
+    batcher.close()
+
+
+def test_micro_batcher_propagates_errors():
+    def encode(texts):
+        raise RuntimeError("model crashed")
+
+    batcher = MicroBatcher(encode)
+    with pytest.raises(RuntimeError, match="model crashed"):
+        batcher.encode(["a", "b"])
+    batcher.close()
+
+
+def test_model_registry_loads_each_model_once(monkeypatch):
+    import types
+    import embeddings
+
+    loaded = []
+
+    class FakeModel:
+        device = "cpu"
+
+        def __init__(self, name):
+            loaded.append(name)
+
+        def encode(self, texts, **kwargs):
+            return np.zeros((len(texts), 3), dtype="float32")
+
+        def get_sentence_embedding_dimension(self):
+            return 3
+
+    monkeypatch.setitem(sys.modules, "sentence_transformers",
+                        types.SimpleNamespace(SentenceTransformer=FakeModel))
+    monkeypatch.setattr(embeddings, "_models", {})
+    monkeypatch.setattr(embeddings, "_model_info", {})
+
+    from api import crawler_router, embedder, search_web
+    from knowledge_store import KnowledgeStore
+
+    model = embeddings.get_model("all-MiniLM-L6-v2")
+    assert embedder._get_model() is model
+    assert search_web._get_model() is model
+    assert crawler_router._get_model() is model
+    assert KnowledgeStore._embedder(types.SimpleNamespace(model_name=embeddings.DEFAULT_MODEL)) is model
+    assert loaded == ["sentence-transformers/all-MiniLM-L6-v2"]
+    stats = embeddings.model_stats()["sentence-transformers/all-MiniLM-L6-v2"]
+    assert stats["dim"] == 3 and stats["device"] == "cpu" and stats["load_seconds"] >= 0
+
+
+def test_onnx_backend_is_registered_separately(monkeypatch):
+    import embeddings
+
+    class FakeModel:
+        def encode(self, texts, **kwargs):
+            return np.zeros((len(texts), 3), dtype="float32")
+
+        def get_sentence_embedding_dimension(self):
+            return 3
+
+    calls = []
+    monkeypatch.setattr(embeddings, "_load", lambda name, backend: calls.append(backend) or FakeModel())
+    monkeypatch.setattr(embeddings, "_models", {})
+    monkeypatch.setattr(embeddings, "_model_info", {})
+    monkeypatch.setenv("EMBED_BACKEND", "onnx-int8")
+
+    model = embeddings.get_model("all-MiniLM-L6-v2")
+    assert embeddings.get_model("all-MiniLM-L6-v2") is model
+    assert embeddings.get_model("all-MiniLM-L6-v2", backend="torch") is not model
+    assert calls == ["onnx-int8", "torch"]
+    stats = embeddings.model_stats()
+    assert stats["sentence-transformers/all-MiniLM-L6-v2@onnx-int8"]["backend"] == "onnx-int8"
+    with pytest.raises(ValueError):
+        embeddings.get_model("all-MiniLM-L6-v2", backend="tensorrt")
+
+
+def test_onnx_encoder_mean_pools_and_normalizes():
+    from onnx_backend import OnnxEncoder
+
+    class FakeTokenizer:
+        def __call__(self, texts, **kwargs):
+            width = max(len(t.split()) for t in texts)
+            mask = np.array([[1] * len(t.split()) + [0] * (width - len(t.split())) for t in texts])
+            return {"input_ids": mask * 7, "attention_mask": mask}
+
+    class FakeSession:
+        def run(self, outputs, feeds):
+            # token j of every text has hidden state [j + 1, 1]
+            batch, width = feeds["input_ids"].shape
+            pos = np.broadcast_to(np.arange(1, width + 1, dtype="float32"), (batch, width))
+            return [np.stack([pos, np.ones_like(pos)], axis=-1)]
+
+    enc = OnnxEncoder.__new__(OnnxEncoder)
+    enc.meta = {"inputs": ["input_ids", "attention_mask"], "pooling": "mean",
+                "normalize": False, "dim": 2}
+    enc.tokenizer, enc.session, enc.max_seq_length = FakeTokenizer(), FakeSession(), 16
+
+    vecs = enc.encode(["a", "a b c", "a b"], batch_size=2)
+    assert np.allclose(vecs, [[1, 1], [2, 1], [1.5, 1]])  # padding is ignored
+    single = enc.encode("a b c", normalize_embeddings=True)
+    assert single.shape == (2,) and np.isclose(np.linalg.norm(single), 1.0)
@@ -0,0 +1,67 @@
+import threading
+import time
+
+import pytest
+from pathlib import Path
+import sys
+
+sys.path.append(str(Path(__file__).resolve().parents[1]))
+
+from jobs import JobQueue, QueueFull
+
+
+def _wait_done(job, timeout=5.0):
+    job.future.exception(timeout=timeout)
+    return job.to_dict()
+
+
+def test_job_reports_progress_result_and_throughput():
+    queue = JobQueue(workers=1)
+
+    def work(progress):
+        progress({"docs": 1, "chunks": 4})
+        return {"docs": 2, "chunks": 8}
+
+    job = queue.submit("sync", work)
+    info = _wait_done(job)
+    assert info["status"] == "done" and info["result"] == {"docs": 2, "chunks": 8}
+    assert info["progress"] == {"docs": 1, "chunks": 4}
+    assert info["elapsed"] >= 0 and info["finished_at"] >= info["started_at"]
+    assert queue.get(job.id) is job
+    queue.shutdown()
+
+
+def test_failed_job_records_error():
+    queue = JobQueue()
+
+    def broken(progress):
+        raise ValueError("bad pdf")
+
+    job = queue.submit("add", broken)
+    info = _wait_done(job)
+    assert info["status"] == "error" and info["error"] == "bad pdf"
+    queue.shutdown()
+
+
+def test_pending_jobs_are_bounded():
+    queue = JobQueue(workers=1, max_pending=1)
+    release = threading.Event()
+    running = queue.submit("add", lambda progress: release.wait(5))
+    while running.status != "running":
+        time.sleep(0.01)
+    queued = queue.submit("add", lambda progress: None)
+    with pytest.raises(QueueFull):
+        queue.submit("add", lambda progress: None)
+    release.set()
+    assert _wait_done(queued)["status"] == "done"
+    queue.shutdown()
+
+
+def test_old_finished_jobs_are_forgotten():
+    queue = JobQueue(keep=2)
+    done = [queue.submit("add", lambda progress: None) for _ in range(3)]
+    for job in done:
+        _wait_done(job)
+    queue.submit("add", lambda progress: None)
+    assert queue.get(done[0].id) is None and queue.get(done[2].id) is not None
+    queue.shutdown(wait=True)
@@ -1,10 +1,22 @@
+import zlib
+
 import numpy as np
+import pytest
 from pathlib import Path
 import sys
 
 sys.path.append(str(Path(__file__).resolve().parents[1]))
 
-from knowledge_store import KnowledgeStore
+import faiss
+
+import knowledge_store
+from knowledge_store import CODECS, DocumentTooLarge, KnowledgeStore
+from embeddings import query_cache
+
+
+@pytest.fixture(autouse=True)
+def _clear_query_cache():
+    query_cache.clear()
 
 
 def _dummy_embed(self, texts):
@@ -21,6 +33,30 @@ def _make_files(root: Path):
     (deep / "c.txt").write_text("deep", encoding="utf-8")
 
 
+def _make_pdf(pages) -> bytes:
+    """Minimal PDF with one line of Helvetica text per page."""
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>", None,
+            "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    kids = []
+    for text in pages:
+        stream = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objs)} 0 R >>")
+        kids.append(f"{len(objs)} 0 R")
+    objs[1] = f"<< /Type /Pages /Kids [{' '.join(kids)}] /Count {len(kids)} >>"
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
 def test_reindex_nested_files(tmp_path, monkeypatch):
     data_dir = tmp_path / "data"
     data_dir.mkdir()
@@ -35,3 +71,595 @@ def test_reindex_nested_files(tmp_path, monkeypatch):
     assert res2 == {"docs": 3, "chunks": 3}
     assert len(ks._docs) == 3
     assert ks._vectors.shape[0] == 3
+
+
+def _unit_embed(self, texts):
+    vecs = np.stack([
+        np.random.default_rng(zlib.crc32(t.encode())).standard_normal(self._dim)
+        for t in texts
+    ]).astype("float32")
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def test_add_writes_segments_and_reloads(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    for i in range(5):
+        ks.add_manual(f"note {i}", f"content {i}")
+    # log-structured merging keeps the segment count logarithmic
+    assert [rec["rows"] for rec in ks._segments] == [4, 1]
+    seg_files = sorted(p.name for p in (tmp_path / "knowledge_index").glob("seg-*.jsonl"))
+    assert len(seg_files) == 2
+
+    reloaded = KnowledgeStore(str(tmp_path))
+    assert reloaded._index.ntotal == 5
+    assert [e["title"] for e in reloaded._entries] == [f"note {i}" for i in range(5)]
+    assert reloaded.compact() == {"segments": 1, "vectors": 5}
+    assert len(list((tmp_path / "knowledge_index").glob("seg-*.jsonl"))) == 1
+
+
+def test_merges_and_training_run_outside_the_store_lock(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    free = []
+
+    def probe(ks):
+        def try_lock():
+            if ks._lock.acquire(timeout=2):
+                ks._lock.release()
+                free.append(True)
+            else:
+                free.append(False)
+        t = threading.Thread(target=try_lock)
+        t.start()
+        t.join()
+
+    write_segment, take_rows = KnowledgeStore._write_segment, KnowledgeStore._take_rows
+
+    def write(self, vectors, entries, ids, name=None):
+        if name is not None:  # a merge
+            probe(self)
+        return write_segment(self, vectors, entries, ids, name)
+
+    def take(self, rows, blocks=None):
+        if blocks is not None:  # sampling training vectors
+            probe(self)
+        return take_rows(self, rows, blocks)
+
+    monkeypatch.setattr(KnowledgeStore, "_write_segment", write)
+    monkeypatch.setattr(KnowledgeStore, "_take_rows", take)
+    ks = KnowledgeStore(str(tmp_path), index_type="ivf", ann_threshold=60)
+    for i in range(80):
+        ks.add_manual(f"note {i}", f"content {i}")
+    assert ks._ann is not None and len(ks._segments) < 10
+    assert free and all(free)
+
+    threads = [threading.Thread(target=lambda w=w: [ks.add_manual(f"t{w}", f"t{w} {i}")
+                                                    for i in range(15)]) for w in range(3)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    reloaded = KnowledgeStore(str(tmp_path), index_type="ivf", ann_threshold=60)
+    assert reloaded._rows == reloaded._index.ntotal == 125
+    assert len(set(np.concatenate(reloaded._block_ids).tolist())) == 125
+
+
+def test_background_load_reports_progress(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    for i in range(3):
+        ks.add_manual(f"note {i}", f"content {i}")
+
+    lazy = KnowledgeStore(str(tmp_path), load=False)
+    assert not lazy.ready.is_set() and lazy.load_status()["status"] == "pending"
+    assert lazy.load_in_background().wait(10)
+    status = lazy.load_status()
+    assert status["status"] == "ready" and status["rows"] == 3
+    assert status["segments"] == status["segments_total"] == len(ks._segments)
+    assert lazy.search("content 1", top_k=1)[0]["title"] == "note 1"
+
+
+def test_legacy_pickle_is_migrated(tmp_path):
+    import pickle
+
+    vectors = np.eye(3, 384, dtype="float32") * 2
+    entries = [{"doc_id": f"doc-{i}", "title": str(i), "chunk": "x"} for i in range(3)]
+    with open(tmp_path / "knowledge_index.pkl", "wb") as f:
+        pickle.dump({"vectors": vectors, "entries": entries, "dim": 384}, f)
+
+    ks = KnowledgeStore(str(tmp_path))
+    assert not (tmp_path / "knowledge_index.pkl").exists()
+    assert ks._index.ntotal == 3
+    assert np.allclose(np.linalg.norm(ks._vectors, axis=1), 1.0)
+    assert KnowledgeStore(str(tmp_path))._entries == entries
+
+
+def test_mmap_mode_matches_in_memory_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    for i in range(7):
+        ks.add_manual(f"note {i}", f"content {i}")
+
+    mapped = KnowledgeStore(str(tmp_path), mmap=True)
+    assert mapped._index is None
+    assert all(isinstance(b, np.memmap) for b in mapped._blocks)
+    q = _unit_embed(ks, ["query", "other"])
+    D_mem, I_mem = ks._search_vectors(q, 4)
+    D_map, I_map = mapped._search_vectors(q, 4)
+    assert np.array_equal(I_mem, I_map)
+    assert np.allclose(D_mem, D_map, atol=1e-5)
+    assert len(mapped.search("query", top_k=3)) == 3
+
+
+def test_switches_to_ann_index_after_threshold(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), index_type="hnsw", ann_threshold=3)
+    ks.add_manual("a", "first")
+    ks.add_manual("b", "second")
+    assert ks._ann is None and isinstance(faiss.downcast_index(ks._index.index), faiss.IndexFlatIP)
+    ks.add_manual("c", "third")
+    ks.add_manual("d", "fourth")
+    assert ks._ann["type"] == "hnsw"
+    assert ks._index.ntotal == 4
+    assert (tmp_path / "knowledge_index" / "ann.faiss").exists()
+    assert len(ks.search("anything", top_k=2, ef_search=16)) == 2
+
+    reloaded = KnowledgeStore(str(tmp_path), index_type="hnsw", ann_threshold=3)
+    assert reloaded._ann["type"] == "hnsw"
+    assert reloaded._index.ntotal == 4
+
+    # switching the configuration back to flat restores exact search
+    flat = KnowledgeStore(str(tmp_path))
+    assert flat._ann is None and flat._index.ntotal == 4
+
+
+@pytest.mark.parametrize("codec", ["fp16", "sq8", "pq"])
+def test_compressed_codec_with_rescore(tmp_path, codec):
+    rng = np.random.default_rng(0)
+    vecs = rng.standard_normal((700, 64)).astype("float32")
+    faiss.normalize_L2(vecs)
+    ks = KnowledgeStore(str(tmp_path), codec=codec)
+    ks._add_vectors(vecs, [{"doc_id": f"doc-{i}", "chunk": str(i)} for i in range(len(vecs))])
+    assert ks._ann["codec"] == codec and ks._index.ntotal == len(vecs)
+    assert ks._index.sa_code_size() < 64 * 4
+
+    q = vecs[:20]
+    D, I = ks._search_vectors(q, 5, ks._search_params(), rescore=10)
+    assert np.array_equal(I[:, 0], np.arange(20))
+    assert np.allclose(D[:, 0], 1.0, atol=1e-5)  # exact float32 scores
+
+    reloaded = KnowledgeStore(str(tmp_path), codec=codec)
+    assert reloaded._ann["codec"] == codec and reloaded._index.ntotal == len(vecs)
+    # a different codec retrains instead of loading the stale index
+    assert KnowledgeStore(str(tmp_path))._ann is None
+
+
+def _codec_store(tmp_path, monkeypatch, codec, n=700, **opts):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), codec=codec, **opts)
+    ks._dim = 16  # small vectors keep PQ training fast
+    chunks = [f"chunk {i}" for i in range(n)]
+    entries = [{"doc_id": f"doc-{i}", "title": str(i), "source": "manual",
+                "tags": ["even" if i % 2 == 0 else "odd"], "chunk": c}
+               for i, c in enumerate(chunks)]
+    ks._add_vectors(_unit_embed(ks, chunks), entries)
+    return ks
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_codec_search_skips_deleted_docs(tmp_path, monkeypatch, codec):
+    ks = _codec_store(tmp_path, monkeypatch, codec)
+    assert ks.search("chunk 3", top_k=1)[0]["doc_id"] == "doc-3"
+    ks._delete_docs(["doc-3"])
+    hits = ks.search("chunk 3", top_k=5, rescore=0)
+    assert len(hits) == 5 and "doc-3" not in [h["doc_id"] for h in hits]
+
+
+@pytest.mark.parametrize("codec", CODECS)
+def test_codec_filtered_search_through_faiss(tmp_path, monkeypatch, codec):
+    monkeypatch.setattr(KnowledgeStore, "FILTER_SCAN_ROWS", 0)  # no exact-scan shortcut
+    ks = _codec_store(tmp_path, monkeypatch, codec)
+    ks._delete_docs(["doc-4"])
+    hits = ks.search("chunk 4", top_k=5, tags=["even"], rescore=0)
+    assert len(hits) == 5
+    assert all(h["tags"] == ["even"] and h["doc_id"] != "doc-4" for h in hits)
+
+
+def test_ann_index_is_retrained_when_the_store_outgrows_it(tmp_path, monkeypatch):
+    ks = _codec_store(tmp_path, monkeypatch, "fp32", n=100, index_type="ivf", ann_threshold=50)
+    assert ks._ann["factory"] == "IVF2,Flat"
+    ks._add_vectors(_unit_embed(ks, ["a", "b"]), [{"doc_id": "x", "chunk": "a"}] * 2)
+    assert ks._ann["trained_rows"] == 100  # still sized well enough
+    chunks = [f"more {i}" for i in range(400)]
+    ks._add_vectors(_unit_embed(ks, chunks), [{"doc_id": "doc-x", "chunk": c} for c in chunks])
+    assert ks._ann["trained_rows"] == 502 and ks._ann["factory"] == "IVF12,Flat"
+    # a PQ index is retrained for another code size as well
+    assert knowledge_store._outgrown("IVF1,PQ16x4", "IVF1,PQ16x6")
+    assert not knowledge_store._outgrown("IVF1,PQ16x4", "IVF1,PQ16x4")
+
+
+@pytest.mark.parametrize("opts", [{}, {"mmap": True}, {"index_type": "hnsw", "ann_threshold": 2}])
+def test_search_filters_by_tag_and_source(tmp_path, monkeypatch, opts):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), **opts)
+    red, _ = ks.add_manual("red", "apples", tags=["fruit", "red"])
+    ks.add_manual("green", "pears", tags=["fruit"])
+    ks.add_manual("car", "engines", tags=["red"])
+    (tmp_path / "doc.txt").write_text("lorem ipsum")
+    ks.add_from_file(str(tmp_path / "doc.txt"), tags=["red"])
+
+    def titles(**kw):
+        return {h["title"] for h in ks.search("query", top_k=10, **kw)}
+
+    assert titles(tags=["fruit"]) == {"red", "green"}
+    assert titles(tags=["fruit", "red"]) == {"red", "green", "car", "doc.txt"}
+    assert titles(tags=["red"], source="manual") == {"red", "car"}
+    assert titles(source="file") == {"doc.txt"}
+    assert titles(tags=["missing"]) == set()
+    # filtered searches return top_k hits, not top_k minus the filtered ones
+    assert len(ks.search("query", top_k=2, tags=["red"])) == 2
+
+    ks.delete_doc(red)
+    assert titles(tags=["fruit"]) == {"green"}
+    ks.compact()
+    assert titles(tags=["red"]) == {"car", "doc.txt"}
+    monkeypatch.setattr(KnowledgeStore, "FILTER_SCAN_ROWS", 0)  # force the FAISS selector path
+    if ks._index is not None:
+        assert titles(tags=["red"]) == {"car", "doc.txt"}
+
+
+def test_hybrid_search_fuses_bm25_and_vectors(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    ks.add_manual("zebra", "The zebra grazes on the savanna", tags=["animals"])
+    ks.add_manual("engine", "Diesel engine maintenance manual")
+    ks.add_manual("zoo", "A zebra and a lion live in the zoo")
+    for i in range(5):
+        ks.add_manual(f"filler {i}", f"unrelated filler text number {i}")
+
+    hits = ks.hybrid_search("The zebra grazes on the savanna", top_k=3)
+    # exact text: first in both rankings
+    assert hits[0]["title"] == "zebra" and hits[0]["ranks"] == {"vector": 1, "bm25": 1}
+    assert hits[0]["score"] == pytest.approx(2 / (KnowledgeStore.RRF_K + 1))
+    assert "zoo" in [h["title"] for h in hits]
+
+    assert [h["title"] for h in ks.hybrid_search("zebra", tags=["animals"])] == ["zebra"]
+    ks.delete_doc(hits[0]["doc_id"])
+    assert "zebra" not in [h["title"] for h in ks.hybrid_search("zebra savanna")]
+
+    def no_model(self, texts):
+        raise RuntimeError("sentence-transformers package is required for embeddings")
+
+    query_cache.clear()
+    monkeypatch.setattr(KnowledgeStore, "_embed", no_model, raising=False)
+    hits = ks.hybrid_search("zebra lion", top_k=2)
+    assert [h["title"] for h in hits] == ["zoo"] and hits[0]["ranks"]["vector"] is None
+
+
+def test_chunk_bm25_index_is_loaded_with_the_store(tmp_path, monkeypatch):
+    from bm25 import BM25Index
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    for i in range(3):
+        ks.add_manual(f"note {i}", f"keyword{i} text")
+    ks = KnowledgeStore(str(tmp_path), compact_ratio=1.0)  # restart: builds and saves the chunk index
+    assert (tmp_path / "knowledge_index" / "bm25" / "meta.json").exists()
+    ks.add_manual("late", "keyword9 added after the snapshot")
+    ks.delete_doc(ks._docs[0].id)
+
+    indexed = []
+    original_add = BM25Index.add
+    monkeypatch.setattr(BM25Index, "add", lambda self, i, text: indexed.append(text) or original_add(self, i, text))
+    again = KnowledgeStore(str(tmp_path))
+    assert indexed == ["keyword9 added after the snapshot"]  # only the chunk the snapshot missed
+    assert sorted(again._lexical.doc_ids().tolist()) == sorted(
+        c for chunks in again._doc_chunks.values() for c in chunks)
+    assert all(h["ranks"]["bm25"] is None for h in again.hybrid_search("keyword0"))
+    assert [h["title"] for h in again.hybrid_search("keyword9 snapshot", top_k=1)] == ["late"]
+
+
+def test_search_many_encodes_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path))
+    for i in range(4):
+        ks.add_manual(f"note {i}", f"content {i}")
+
+    calls = []
+
+    def counting_embed(self, texts):
+        calls.append(list(texts))
+        return np.stack([ks._vectors[int(t[-1])] for t in texts])
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", counting_embed, raising=False)
+    res = ks.search_many(["q 2", "", "q 0"], top_k=2)
+    assert calls == [["q 2", "q 0"]]
+    assert res[1] == []
+    assert res[0][0]["title"] == "note 2"
+    assert res[2][0]["title"] == "note 0"
+    assert ks.search("q 3", top_k=1)[0]["title"] == "note 3"
+    # repeated queries are served from the shared embedding cache
+    ks.search_many(["q 0", "q 3"], top_k=1)
+    assert calls == [["q 2", "q 0"], ["q 3"]]
+
+
+def test_bulk_reindex_batches_and_commits_once(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    _make_files(data_dir)
+    batches = []
+
+    def recording_embed(self, texts):
+        batches.append(len(texts))
+        return _unit_embed(self, texts)
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", recording_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    seen = []
+    res = ks.reindex_folder(str(data_dir), workers=2, batch_size=2, progress=seen.append)
+    assert res == {"docs": 3, "chunks": 3}
+    assert batches == [2, 1]
+    assert len(ks._segments) == 1
+    assert [p["docs"] for p in seen][:3] == [1, 2, 3]
+    assert ks.last_ingest["chunks_per_sec"] > 0
+    assert sorted(e["file"] for e in ks._entries) == ["a.txt", "b.md", "c.txt"]
+
+
+def test_extraction_workers_are_not_forked():
+    assert knowledge_store._pool_context().get_start_method() in ("forkserver", "spawn")
+
+
+def test_first_sync_of_a_store_without_sources_keeps_its_docs(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    _make_files(data_dir)
+    embedded = []
+
+    def recording_embed(self, texts):
+        embedded.extend(texts)
+        return _unit_embed(self, texts)
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", recording_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    ks.rebuild_folder(str(data_dir))
+    (tmp_path / "store" / "knowledge_index" / "sources.json").unlink()
+    embedded.clear()
+
+    upgraded = KnowledgeStore(str(tmp_path / "store"))  # as built before sources.json
+    res = upgraded.sync_folder(str(data_dir), workers=1)
+    assert (res["added"], res["unchanged"]) == (0, 3) and embedded == []
+    assert len(upgraded._docs) == 3 and upgraded._live == 3
+
+    (data_dir / "a.txt").write_text("hello again", encoding="utf-8")
+    res = upgraded.sync_folder(str(data_dir), workers=1)
+    assert (res["added"], res["updated"]) == (0, 1) and embedded == ["hello again"]
+    assert len(upgraded._docs) == 3 and upgraded._live == 3
+
+
+def test_sync_folder_only_touches_changed_files(tmp_path, monkeypatch):
+    import os
+
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    _make_files(data_dir)
+    embedded = []
+
+    def recording_embed(self, texts):
+        embedded.extend(texts)
+        return _unit_embed(self, texts)
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", recording_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    res = ks.sync_folder(str(data_dir), workers=1)
+    assert (res["added"], res["updated"], res["removed"]) == (3, 0, 0)
+    assert sorted(embedded) == ["deep", "hello", "world"]
+
+    # nothing changed: no file is re-embedded
+    embedded.clear()
+    res = ks.sync_folder(str(data_dir), workers=1)
+    assert res["unchanged"] == 3 and embedded == []
+
+    # touched but identical content is recognised by its hash
+    os.utime(data_dir / "a.txt", (1, 1))
+    assert ks.sync_folder(str(data_dir), workers=1)["unchanged"] == 3
+    assert embedded == []
+
+    (data_dir / "sub" / "b.md").write_text("changed world", encoding="utf-8")
+    (data_dir / "sub" / "deep" / "c.txt").unlink()
+    (data_dir / "new.txt").write_text("brand new", encoding="utf-8")
+    res = ks.sync_folder(str(data_dir), workers=1)
+    assert (res["added"], res["updated"], res["removed"], res["unchanged"]) == (1, 1, 1, 1)
+    assert sorted(embedded) == ["brand new", "changed world"]
+    assert sorted(e["chunk"] for e in ks._entries) == ["brand new", "changed world", "hello"]
+    assert ks._index.ntotal == 3
+    assert len(ks._docs) == 3
+
+    reloaded = KnowledgeStore(str(tmp_path / "store"))
+    assert sorted(e["chunk"] for e in reloaded._entries) == ["brand new", "changed world", "hello"]
+    assert len({d.id for d in reloaded._docs}) == 3
+    assert reloaded.sync_folder(str(data_dir), workers=1)["unchanged"] == 3
+
+
+@pytest.mark.parametrize("options", [{}, {"mmap": True}, {"index_type": "hnsw", "ann_threshold": 2}])
+def test_delete_and_update_doc_with_tombstones(tmp_path, monkeypatch, options):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), compact_ratio=0.9, **options)
+    ids = [ks.add_manual(f"note {i}", f"content {i}")[0] for i in range(4)]
+    assert ks.search("content 1", top_k=1)[0]["doc_id"] == ids[1]
+
+    assert ks.delete_doc(ids[1]) == 1
+    hits = ks.search("content 1", top_k=4)
+    assert ids[1] not in [h["doc_id"] for h in hits] and len(hits) == 3
+    with pytest.raises(KeyError):
+        ks.delete_doc(ids[1])
+
+    ks.update_doc(ids[2], "replacement text", title="renamed")
+    assert ks.search("replacement text", top_k=1)[0]["title"] == "renamed"
+    assert ks.search("content 2", top_k=1)[0]["snippet"] != "content 2"
+    # ids are never reused, even after deletion
+    assert ks.add_manual("fresh", "fresh")[0] == "doc-5"
+
+    reloaded = KnowledgeStore(str(tmp_path), compact_ratio=0.9, **options)
+    assert reloaded._live == 4
+    assert {h["doc_id"] for h in reloaded.search("x", top_k=10)} == {ids[0], ids[2], ids[3], "doc-5"}
+
+    reloaded.compact()
+    assert reloaded._rows == 4 and not reloaded._tombstones
+    assert not (tmp_path / "knowledge_index" / "tombstones.npy").exists()
+    assert {h["doc_id"] for h in reloaded.search("x", top_k=10)} == {ids[0], ids[2], ids[3], "doc-5"}
+
+
+def test_hnsw_pq_uses_the_nbits_of_the_training_size():
+    n = knowledge_store.CODEC_MIN_ROWS["pq"]
+    m, nbits = knowledge_store._pq_spec(n, 32)
+    spec = knowledge_store._ann_factory("hnsw", n, 32, "pq")
+    assert spec == f"HNSW32_PQ{m}x{nbits}"
+    index = faiss.index_factory(32, spec, faiss.METRIC_INNER_PRODUCT)
+    storage = faiss.downcast_index(faiss.downcast_index(index).storage)
+    assert storage.pq.nbits == nbits == 4
+
+
+def test_concurrent_adds_and_deletes_keep_doc_metadata(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), compact_ratio=1.0)
+    doomed = [ks.add_manual(f"old {i}", f"old {i}")[0] for i in range(20)]
+    added = []
+
+    def add(worker):
+        for i in range(20):
+            added.append(ks.add_manual(f"new {worker} {i}", f"new {worker} {i}")[0])
+
+    threads = [threading.Thread(target=add, args=(w,)) for w in range(3)]
+    threads.append(threading.Thread(target=lambda: [ks.delete_doc(d) for d in doomed]))
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(added)) == 60
+    assert sorted(d.id for d in ks._docs) == sorted(added)
+    reloaded = KnowledgeStore(str(tmp_path), compact_ratio=1.0)
+    assert sorted(d.id for d in reloaded._docs) == sorted(added)
+
+
+def test_rebuild_folder_does_not_reuse_doc_ids(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    (data_dir / "a.txt").write_text("hello", encoding="utf-8")
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    first = {d.id for d in ks._docs} | {ks.add_manual("note", "text")[0]}
+    ks.rebuild_folder(str(data_dir))
+    assert not first & {d.id for d in ks._docs}
+    reloaded = KnowledgeStore(str(tmp_path / "store"))
+    assert reloaded.add_manual("later", "text")[0] not in first | {d.id for d in ks._docs}
+
+
+def test_update_doc_keeps_the_origin_of_the_document(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    (tmp_path / "a.txt").write_text("původní obsah", encoding="utf-8")
+    doc_id, _ = ks.add_from_file(str(tmp_path / "a.txt"))
+
+    ks.update_doc(doc_id, "nový obsah")
+    live = [e for e in ks._entries if e["doc_id"] == doc_id][-1]
+    assert live["chunk"] == "nový obsah" and live["file"] == "a.txt"
+
+
+def test_deletions_trigger_compaction(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), compact_ratio=0.3)
+    ids = [ks.add_manual(f"note {i}", f"content {i}")[0] for i in range(5)]
+    ks.delete_doc(ids[0])
+    assert ks._rows == 5 and len(ks._tombstones) == 1
+    ks.delete_doc(ids[3])
+    assert ks._rows == 3 and not ks._tombstones
+    assert [e["doc_id"] for e in ks._entries] == [ids[1], ids[2], ids[4]]
+
+
+def test_pdf_pages_are_streamed(tmp_path, monkeypatch):
+    pytest.importorskip("pdfminer")
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    pdf = tmp_path / "manual.pdf"
+    pdf.write_bytes(_make_pdf(["First page text.", "Second page text."]))
+    pages = list(knowledge_store._iter_pdf_pages(str(pdf)))
+    assert len(pages) == 2 and "First page" in pages[0] and "Second page" in pages[1]
+
+    ks = KnowledgeStore(str(tmp_path / "store"))
+    doc_id, n = ks.add_from_file(str(pdf))
+    assert n == 1
+    assert ks.search("page", top_k=1)[0]["snippet"] == "First page text. Second page text."
+
+
+def test_chunks_are_embedded_in_batches(tmp_path, monkeypatch):
+    calls = []
+
+    def embed(self, texts):
+        calls.append(len(texts))
+        return _unit_embed(self, texts)
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", embed, raising=False)
+    monkeypatch.setattr(KnowledgeStore, "EMBED_BATCH", 2)
+    ks = KnowledgeStore(str(tmp_path))
+    doc_id, n = ks.add_manual("long", " ".join(f"Sentence number {i}." for i in range(300)))
+    assert n > 4 and max(calls) == 2 and sum(calls) == n
+    assert len(ks._doc_chunks[doc_id]) == n
+
+    def failing(self, texts):
+        raise RuntimeError("encoder down")
+
+    monkeypatch.setattr(KnowledgeStore, "_embed", failing, raising=False)
+    with pytest.raises(RuntimeError):
+        ks.add_manual("broken", "text")
+    assert [d.title for d in ks._docs] == ["long"]
+
+
+def test_documents_over_size_limit_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    data = tmp_path / "data"
+    data.mkdir()
+    (data / "small.txt").write_text("tiny", encoding="utf-8")
+    (data / "big.txt").write_text("x" * 100, encoding="utf-8")
+    ks = KnowledgeStore(str(tmp_path / "store"), max_doc_bytes=50)
+    with pytest.raises(DocumentTooLarge):
+        ks.add_from_file(str(data / "big.txt"))
+    assert ks._docs == []
+    assert ks.reindex_folder(str(data), workers=1) == {"docs": 1, "chunks": 1}
+    assert ks.last_ingest["errors"] == 1
+
+    class Response:
+        headers = {"content-type": "text/html"}
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def iter_content(self, size):
+            yield b"<title>T</title><p>" + b"y" * 30
+            yield b"y" * 30 + b"</p>"
+
+    import requests
+    monkeypatch.setattr(requests, "get", lambda *a, **kw: Response())
+    with pytest.raises(DocumentTooLarge):
+        ks.add_from_url("http://example.com/page")
+    ks.max_doc_bytes = None
+    doc_id, n = ks.add_from_url("http://example.com/page")
+    assert n == 1 and ks._get_doc(doc_id).title == "T"
+
+
+def test_concurrent_searches_share_query_batches(tmp_path, monkeypatch):
+    monkeypatch.setattr(KnowledgeStore, "_embed", _unit_embed, raising=False)
+    ks = KnowledgeStore(str(tmp_path), query_batch=8, query_wait_ms=50)
+    for i in range(3):
+        ks.add_manual(f"note {i}", f"content {i}")
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(6) as pool:
+        hits = list(pool.map(lambda i: ks.search(f"question {i}", top_k=2), range(6)))
+    assert all(len(h) == 2 for h in hits)
+    stats = ks._batcher.stats()
+    assert stats["items"] == 6 and stats["batches"] < 6
@@ -1,4 +1,5 @@
 import sys
+import time
 from pathlib import Path
 
 import pytest
@@ -9,9 +10,16 @@ sys.path.append(str(Path(__file__).resolve().parents[1]))
 from api import search_knowledge
 
 
+@pytest.fixture(autouse=True)
+def _drop_pending_save():
+    yield
+    search_knowledge.reload_knowledge()  # cancel a snapshot save into tmp_path
+
+
 def test_new_files_become_searchable(tmp_path, monkeypatch):
     # Point the knowledge loader to a temporary directory
     monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
     search_knowledge.reload_knowledge()
 
     # Initial file and query to populate caches
@@ -24,3 +32,155 @@ def test_new_files_become_searchable(tmp_path, monkeypatch):
     # The new file should be discovered without restarting
     results = search_knowledge.search_knowledge("fresh")
     assert any("fresh" in r for r in results)
+
+
+def test_only_changed_files_are_retokenized(tmp_path, monkeypatch):
+    from bm25 import BM25Index
+
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
+    search_knowledge.reload_knowledge()
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.txt").write_text(f"{name} common words", encoding="utf-8")
+    assert search_knowledge.sync_knowledge() == {"added": 3, "updated": 0, "removed": 0}
+
+    indexed = []
+    original_add = BM25Index.add
+    monkeypatch.setattr(BM25Index, "add", lambda self, i, text: indexed.append(text) or original_add(self, i, text))
+    (tmp_path / "b.txt").write_text("b rewritten with zeppelin", encoding="utf-8")
+    (tmp_path / "c.txt").unlink()
+    assert search_knowledge.search_knowledge("zeppelin") == ["b rewritten with zeppelin"]
+    assert indexed == ["b rewritten with zeppelin"]
+    assert search_knowledge.search_knowledge("c") == []
+    assert sorted(search_knowledge.search_knowledge("common")) == ["a common words"]
+
+
+def test_scans_are_throttled(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 3600)
+    search_knowledge.reload_knowledge()
+    (tmp_path / "first.txt").write_text("alpha", encoding="utf-8")
+    assert search_knowledge.search_knowledge("alpha") == ["alpha"]
+
+    (tmp_path / "second.txt").write_text("fresh", encoding="utf-8")
+    assert search_knowledge.search_knowledge("fresh") == []  # within the interval
+    search_knowledge.sync_knowledge()
+    assert search_knowledge.search_knowledge("fresh") == ["fresh"]
+
+
+def test_restart_reuses_snapshot(tmp_path, monkeypatch):
+    from bm25 import BM25Index
+
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
+    search_knowledge.reload_knowledge()
+    for name in ("a", "b", "c"):
+        (tmp_path / f"{name}.txt").write_text(f"{name} common words", encoding="utf-8")
+    search_knowledge.sync_knowledge()
+    assert search_knowledge.flush_snapshot()
+    assert (tmp_path / ".bm25" / "meta.json").exists()
+
+    search_knowledge.reload_knowledge()  # a new worker process
+    indexed = []
+    original_add = BM25Index.add
+    monkeypatch.setattr(BM25Index, "add", lambda self, i, text: indexed.append(text) or original_add(self, i, text))
+    (tmp_path / "b.txt").write_text("b changed while stopped", encoding="utf-8")
+    assert search_knowledge.sync_knowledge() == {"added": 0, "updated": 1, "removed": 0}
+    assert indexed == ["b changed while stopped"]
+    assert sorted(search_knowledge.search_knowledge("common")) == ["a common words", "c common words"]
+    assert search_knowledge.search_knowledge("stopped") == ["b changed while stopped"]
+
+
+def test_best_passage_is_returned_with_highlights(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
+    monkeypatch.setattr(search_knowledge, "PASSAGE_CHARS", 60)
+    search_knowledge.reload_knowledge()
+    filler = "\n".join(f"řádek {i} s obecným textem o ničem" for i in range(20))
+    (tmp_path / "doc.txt").write_text(f"{filler}\nKotel se restartuje tlačítkem Reset.\n{filler}\n"
+                                      + "slovo " * 100, encoding="utf-8")
+
+    hits = search_knowledge.search_passages("restart kotel reset")
+    best = hits[0]
+    assert best["source"] == "doc.txt"
+    assert "Kotel se restartuje tlačítkem Reset." in best["text"]
+    assert [best["text"][s:e] for s, e in best["highlights"]] == ["Kotel", "Reset"]
+    raw = (tmp_path / "doc.txt").read_bytes()[best["start"]:best["end"]]
+    assert raw.decode("utf-8") == best["text"]
+
+    snippets = search_knowledge.search_knowledge("slovo obecným", top_k=5)
+    assert snippets and all(len(s) <= 60 for s in snippets)
+
+
+def test_snapshot_is_saved_in_the_background(tmp_path, monkeypatch):
+    from bm25 import BM25Index
+
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
+    monkeypatch.setattr(search_knowledge, "SAVE_DELAY", 0.2)
+    search_knowledge.reload_knowledge()
+    meta = tmp_path / ".bm25" / "meta.json"
+    (tmp_path / "a.txt").write_text("first", encoding="utf-8")
+    search_knowledge.sync_knowledge()
+    (tmp_path / "b.txt").write_text("second", encoding="utf-8")
+    search_knowledge.sync_knowledge()
+    assert not meta.exists()  # not written by the syncing query
+
+    deadline = time.monotonic() + 5
+    while not meta.exists() and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert meta.exists()
+    assert not search_knowledge.flush_snapshot()  # nothing pending any more
+    index, extra = BM25Index.load(str(tmp_path / ".bm25"))
+    assert sorted(extra["files"]) == ["a.txt", "b.txt"] and len(index) == 2
+
+
+def test_file_edited_between_scans_is_not_read_at_old_offsets(tmp_path, monkeypatch):
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 3600)
+    monkeypatch.setattr(search_knowledge, "PASSAGE_CHARS", 40)
+    search_knowledge.reload_knowledge()
+    doc = tmp_path / "doc.txt"
+    doc.write_text("úvod o ničem\n\nkotel se restartuje tlačítkem\n", encoding="utf-8")
+    assert search_knowledge.search_knowledge("kotel") == ["kotel se restartuje tlačítkem"]
+
+    # edited within SCAN_INTERVAL: the passage moved and the old one is gone
+    doc.write_text("kotel má nový návod\n\núplně jiný text na konci souboru\n", encoding="utf-8")
+    hits = search_knowledge.search_passages("kotel restartuje")
+    assert [h["text"] for h in hits] == ["kotel má nový návod"]
+    assert search_knowledge.search_knowledge("restartuje") == []
+
+
+def test_search_during_concurrent_syncs(tmp_path, monkeypatch):
+    import threading
+
+    monkeypatch.setattr(search_knowledge, "KNOWLEDGE_DIR", tmp_path)
+    monkeypatch.setattr(search_knowledge, "SCAN_INTERVAL", 0)
+    search_knowledge.reload_knowledge()
+    for i in range(20):
+        (tmp_path / f"{i}.txt").write_text(f"společné slovo {i}", encoding="utf-8")
+    search_knowledge.sync_knowledge()
+    errors = []
+    done = threading.Event()
+
+    def edit():
+        try:
+            for n in range(30):
+                (tmp_path / f"{n % 20}.txt").write_text("společné " + "nové " * n, encoding="utf-8")
+                search_knowledge.sync_knowledge()
+        except Exception as exc:  # pragma: no cover - reported below
+            errors.append(exc)
+        finally:
+            done.set()
+
+    editor = threading.Thread(target=edit)
+    editor.start()
+    while not done.is_set():
+        try:
+            for hit in search_knowledge.search_passages("společné", 5):
+                assert hit["source"].endswith(".txt")
+        except Exception as exc:
+            errors.append(exc)
+            break
+    editor.join()
+    assert errors == []